@@ -0,0 +1,864 @@
+import os
+import sys
+import json
+import time
+import random
+import tracemalloc
+import tempfile
+import threading
+import globals
+import utils
+from fakebot import FakeBot
+
+# Offline benchmarks against an in-process fake bot:
+#   python3 bench.py <benchmark> [args...]
+# Every run works in a fresh temporary directory, so no real player data is touched.
+
+
+def setup(latency: float = 0) -> FakeBot:
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    globals.bot = FakeBot(latency)
+    return globals.bot
+
+
+def start_game():
+    import main
+    import storage_utils
+    storage_utils.start()
+    return main
+
+
+def run_runtime(runtime, commands: int) -> float:
+    handler = runtime.handler
+    handled = 0
+    lock = threading.Lock()
+
+    def count_handled(message):
+        nonlocal handled
+        try:
+            handler(message)
+        finally:
+            with lock:
+                handled += 1
+                if handled == commands:
+                    runtime.stop()
+
+    runtime.handler = count_handled
+    start = time.perf_counter()
+    runtime.run()
+    return time.perf_counter() - start
+
+
+# Same command stream handled one by one (the old polling loop) and by the concurrent runtime
+def throughput(players="100", commands="2000", latency="0.02"):
+    players, commands, latency = int(players), int(commands), float(latency)
+    bot = setup(latency)
+    main = start_game()
+    from runtime import Runtime
+
+    for i in range(commands):
+        bot.push(1 + i % players, "/profile")
+    start = time.perf_counter()
+    updates = bot.get_updates(limit=commands)
+    for update in updates:
+        main.handle_input(update.message)
+    sequential = time.perf_counter() - start
+    bot.get_updates(offset=updates[-1].update_id + 1, timeout=0)
+
+    for i in range(commands):
+        bot.push(1 + i % players, "/profile")
+    concurrent = run_runtime(Runtime(bot, main.handle_input, poll_timeout=0), commands)
+
+    print("Sequential: " + str(round(commands / sequential)) + " commands/sec")
+    print("Concurrent: " + str(round(commands / concurrent)) + " commands/sec")
+    main.shutdown()
+
+
+# Bot API calls per command with every notification sent right away vs. combined per command
+def messages(players="100"):
+    players = int(players)
+    bot = setup()
+    main = start_game()
+    from outbox import Outbox
+    script = ["/buy_shuttle", "/buy_shuttle", "/find_planet", "/upgrade_cargo", "/upgrade_celestial_database",
+              "/profile", "/shop"]
+
+    def run_script(first_uid, combine):
+        bot.reset_stats()
+        for uid in range(first_uid, first_uid + players):
+            main.init_context(uid, "player" + str(uid)).money = 1000
+            for command in script:
+                if combine:
+                    with Outbox():
+                        main.init_context(uid, "player" + str(uid))
+                        main.handle_command(command[1:])
+                else:
+                    main.init_context(uid, "player" + str(uid))
+                    main.handle_command(command[1:])
+        return bot.sent_messages / (players * len(script))
+
+    print("Immediate: " + str(round(run_script(1, False), 2)) + " API calls per command")
+    print("Combined:  " + str(round(run_script(players + 1, True), 2)) + " API calls per command")
+    main.shutdown()
+
+
+def random_planets(count, now, max_absence):
+    from planet import Planet
+    from resource import roll_resource
+    planets = []
+    for i in range(count):
+        planet = Planet(roll_resource())
+        planet.set_resource_amount(random.uniform(1, 500))
+        planet.last_check = now - random.randint(0, max_absence)
+        planets.append(planet)
+    return planets
+
+
+# Times progress.extract() for growing absences, tests/test_progress.py checks it against the old loop
+def progress(planets="20"):
+    planets = int(planets)
+    setup()
+    import progress as engine
+    rate = 0.085
+    now = utils.now()
+
+    for days in (1, 30, 365):
+        player_planets = random_planets(planets, now, days * 24 * 3600)
+        start = time.perf_counter()
+        for i in range(1000):
+            engine.extract(player_planets, now, rate, 1000)
+        elapsed = (time.perf_counter() - start) / 1000
+        print(str(days) + " day(s) away, " + str(planets) + " planets: " + str(round(elapsed * 10 ** 6, 1)) + " us")
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+# Planet objects vs. the column store: one extraction tick plus per-resource totals
+def layout(*sizes):
+    setup()
+    import progress as engine
+    from planet_array import PlanetArray, numpy
+    sizes = [int(size) for size in sizes] or [10, 1000, 100000]
+    now = utils.now()
+    print("NumPy: " + ("yes" if numpy is not None else "no, using the array module fallback"))
+
+    for size in sizes:
+        planets, objects_size = measure_memory(lambda: random_planets(size, now, 24 * 3600))
+        store, array_size = measure_memory(lambda: PlanetArray.from_planets(planets))
+        repeat = max(1, 10000 // size)
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            extraction = engine.extract(planets, now, 0.085, size * 10)
+            totals = {}
+            for planet, amount in zip(planets, extraction.amounts):
+                totals[planet.resource] = totals.get(planet.resource, 0) + amount
+        objects_time = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for i in range(repeat):
+            store.extract(now, 0.085, size * 10)
+            store.reserves()
+        array_time = (time.perf_counter() - start) / repeat
+
+        print(str(size) + " planets: objects " + str(round(objects_time * 1000, 3)) + " ms, " +
+              str(objects_size // size) + " B/planet; arrays " + str(round(array_time * 1000, 3)) + " ms, " +
+              str(array_size // size) + " B/planet")
+
+
+# Single vs. batched roll speed of resource.sampler, tests/test_resource.py checks the frequencies
+def distribution(rolls="1000000"):
+    rolls = int(rolls)
+    setup()
+    from resource import sampler, roll_resource
+
+    start = time.perf_counter()
+    for i in range(100000):
+        roll_resource()
+    single = (time.perf_counter() - start) / 100000
+
+    start = time.perf_counter()
+    sampler.roll_ids(rolls)
+    batched = (time.perf_counter() - start) / rolls
+    print("Single rolls: " + str(round(single * 10 ** 9)) + " ns, batched: " + str(round(batched * 10 ** 9)) + " ns")
+
+
+# Share of each command in the load benchmark's traffic
+command_mix = {
+    "/find_planet": 20,
+    "/check_progress": 20,
+    "/show_cargo": 15,
+    "/profile": 10,
+    "/sell_Iron_all": 5,
+    "/sell_Stone_1": 5,
+    "/upgrade_cargo": 5,
+    "/upgrade_celestial_database": 5,
+    "/celestial_database": 5,
+    "/shop": 5,
+    "/buy_shuttle": 5,
+}
+
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)]
+
+
+# Fresh storage and a stopped scheduler, timed tasks are run by hand to measure a single tick
+def reset_game(storage_utils):
+    storage_utils.stop()
+    storage_utils.unload()
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    storage_utils.load_storage()
+
+
+def create_players(count):
+    import player as plr
+    import storage_utils
+    import galaxy
+    for uid in range(1, count + 1):
+        player = plr.Player(uid, "player" + str(uid))
+        player.money = 10000
+        for i in range(3):
+            player.shuttle_hangar.add_shuttle(plr.Shuttle())
+        for i in range(3):
+            planet = galaxy.discover(1)
+            planet.set_resource_amount(random.uniform(10, 100))
+            planet.last_check -= random.randint(0, 3600)
+            player.planet_container.add_planet(planet)
+        storage_utils.save_player(player)
+
+
+def load_run(players, commands):
+    import main
+    import storage_utils
+    from fakebot import FakeUser, FakeMessage
+    from player import action_lengths, Action
+    reset_game(storage_utils)
+
+    start = time.perf_counter()
+    create_players(players)
+    utils.out("Created " + str(players) + " players in " + str(round(time.perf_counter() - start, 2)) + " s")
+    storage_utils.write_all()
+
+    mix = random.choices(list(command_mix.keys()), weights=list(command_mix.values()), k=commands)
+    latencies = []
+    start = time.perf_counter()
+    for command in mix:
+        uid = random.randint(1, players)
+        message = FakeMessage(FakeUser(uid, "player" + str(uid)), command)
+        command_start = time.perf_counter()
+        main.handle_input(message)
+        latencies.append(time.perf_counter() - command_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    start = time.perf_counter()
+    storage_utils.write_all()
+    backup_time = time.perf_counter() - start
+
+    # Nothing is due yet: cost of a tick with every expedition still in flight
+    scheduler = storage_utils.timed_task_daemon
+    pending = len(scheduler)
+    start = time.perf_counter()
+    scheduler.run_due(time.time())
+    idle_tick_time = time.perf_counter() - start
+
+    # Bring every expedition back right now
+    length = action_lengths[Action.PLANET_SEARCH]
+    for uid in globals.player_storage.uids():
+        player = globals.player_storage.get(uid)
+        for action in player.pending_actions:
+            action.start_time -= length
+    start = time.perf_counter()
+    fired = scheduler.run_due(time.time() + length)
+    tick_time = time.perf_counter() - start
+
+    return {
+        "players": players,
+        "commands": commands,
+        "commands_per_sec": round(commands / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "backup_ms": round(backup_time * 1000, 3),
+        "backup_records": storage_utils.last_write_records,
+        "backup_bytes": storage_utils.last_write_bytes,
+        "pending_actions": pending,
+        "idle_tick_ms": round(idle_tick_time * 1000, 3),
+        "tick_ms": round(tick_time * 1000, 3),
+        "tick_actions": fired,
+    }
+
+
+# Synthetic players and a mixed command stream through main.handle_input:
+#   python3 bench.py load [player counts...] [--commands N] [--output results.json]
+def load(*args):
+    args = list(args)
+    commands = 20000
+    output = os.path.abspath("bench_results.json")
+    if "--commands" in args:
+        i = args.index("--commands")
+        commands = int(args[i + 1])
+        del args[i:i + 2]
+    if "--output" in args:
+        i = args.index("--output")
+        output = os.path.abspath(args[i + 1])
+        del args[i:i + 2]
+    sizes = [int(arg) for arg in args] or [1000, 10000, 100000]
+
+    setup()
+    random.seed(1)
+    results = []
+    for players in sizes:
+        result = load_run(players, commands)
+        results.append(result)
+        utils.out(str(result))
+
+    with open(output, "w") as file:
+        json.dump({"time": int(time.time()), "results": results}, file, indent=2)
+    utils.out("Results written to " + output)
+
+    import main
+    main.shutdown()
+
+
+# Cost of instrumentation: the same command stream with metrics enabled and disabled
+def overhead(players="1000", commands="20000"):
+    players, commands = int(players), int(commands)
+    setup()
+    import main
+    import metrics
+    import storage_utils
+    from fakebot import FakeUser, FakeMessage
+    reset_game(storage_utils)
+    create_players(players)
+
+    mix = random.choices(list(command_mix.keys()), weights=list(command_mix.values()), k=commands)
+    messages = [FakeMessage(FakeUser(uid, "player" + str(uid)), command)
+                for uid, command in zip((random.randint(1, players) for i in range(commands)), mix)]
+
+    timings = {}
+    for enabled in (False, True, False, True):
+        metrics.enabled = enabled
+        start = time.perf_counter()
+        for message in messages:
+            main.handle_input(message)
+        timings.setdefault(enabled, []).append(time.perf_counter() - start)
+
+    disabled, enabled = min(timings[False]), min(timings[True])
+    print("Metrics disabled: " + str(round(commands / disabled)) + " commands/sec")
+    print("Metrics enabled:  " + str(round(commands / enabled)) + " commands/sec (" +
+          utils.round_str((enabled - disabled) / disabled * 100) + "% overhead)")
+
+    start = time.perf_counter()
+    for i in range(100000):
+        storage_utils.backup_duration.observe(0.001)
+    print("Histogram observe: " + str(round((time.perf_counter() - start) / 100000 * 10 ** 9)) + " ns")
+    main.shutdown()
+
+
+# Time from a restart command to the first command handled after it, through the same runtime, shutdown
+#   and start as under the watchdog: a soft restart keeps the loaded players, a hard restart loads them
+#   from disk again
+def restart(players="10000"):
+    players = int(players)
+    bot = setup()
+    import main
+    import storage_utils
+    reset_game(storage_utils)
+    create_players(players)
+    storage_utils.stop()
+    handle_input = main.handle_input
+    start = None
+
+    # The restart command is timed from when it's handled, the next run stops after its first command
+    def timed_handle_input(message):
+        nonlocal start
+        try:
+            handle_input(message)
+        finally:
+            start = time.perf_counter()
+        if message.text == "/profile":
+            raise Exception("stop")
+
+    main.handle_input = timed_handle_input
+    try:
+        for kind in ("restart", "hard_restart"):
+            bot.push(main.admin_ids[0], "/" + kind)
+            try:
+                main.run()
+            except Exception as e:
+                if str(e) != kind:
+                    raise
+            if kind == "hard_restart":
+                storage_utils.unload()
+            restarted = start
+            bot.push(1, "/profile")
+            try:
+                main.run()
+            except Exception as e:
+                if str(e) != "stop":
+                    raise
+            print(("Soft" if kind == "restart" else "Hard") + " restart, " + str(players) +
+                  " players: first response after " + str(round((start - restarted) * 1000, 1)) + " ms")
+    finally:
+        main.handle_input = handle_input
+
+
+# Full snapshots while commands keep coming in: pickling everything under a global freeze (the only
+#   consistent option without a copy) against the per-player "copy" and copy-on-write "fork" modes
+def snapshot(players="20000"):
+    players = int(players)
+    setup()
+    import main
+    import pickle
+    import journal
+    import storage_utils
+    from fakebot import FakeUser, FakeMessage
+    reset_game(storage_utils)
+    create_players(players)
+    storage = globals.player_storage
+
+    def frozen_dump():
+        with storage_utils.freeze_players():
+            utils.write_atomic("frozen.dat", lambda file: pickle.dump((0, storage.players), file))
+
+    for mode in ("frozen", "copy", "fork"):
+        if mode == "frozen":
+            compactor = threading.Thread(target=frozen_dump)
+            compactor.start()
+        else:
+            storage.journal.mode = mode
+            storage.journal.compact_async(storage.players, storage.snapshot)
+            compactor = storage.journal.compactor
+
+        start = time.perf_counter()
+        latencies = []
+        while compactor.is_alive():
+            uid = random.randint(1, players)
+            command_start = time.perf_counter()
+            main.handle_input(FakeMessage(FakeUser(uid, "player" + str(uid)), "/profile"))
+            latencies.append(time.perf_counter() - command_start)
+        compactor.join()
+        duration = time.perf_counter() - start
+
+        latencies.sort()
+        print(mode.ljust(6) + " " + str(players) + " players: snapshot " + str(round(duration * 1000)) + " ms, " +
+              str(len(latencies)) + " commands handled meanwhile, worst command " +
+              str(round(latencies[-1] * 1000, 1) if latencies else 0) + " ms")
+    print("Pause reported by journal: " + journal.snapshot_pause.summary())
+    main.shutdown()
+
+
+# Legacy pickle snapshot against the binary format: file size, loading everything, and the
+#   first lookup of single players straight from a freshly opened file
+def format(players="20000", lookups="1000"):
+    players, lookups = int(players), int(lookups)
+    setup()
+    import main
+    import pickle
+    import codec
+    import snapshot
+    import storage_utils
+    reset_game(storage_utils)
+    create_players(players)
+    storage = globals.player_storage
+    uids = [str(random.randint(1, players)) for i in range(lookups)]
+
+    utils.write_atomic("legacy.dat", lambda file: pickle.dump((0, storage.players), file))
+    records = [(uid, player.next_wakeup(), player.rank_scores(), codec.encode(player))
+               for uid, player in storage.players.items()]
+    utils.write_atomic("binary.dat", lambda file: snapshot.write(file, 0, records))
+
+    start = time.perf_counter()
+    with open("legacy.dat", "rb") as file:
+        pickle.load(file)
+    legacy_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reader = snapshot.Snapshot("binary.dat")
+    for uid, due, scores, record in reader.records():
+        codec.decode(record)
+    binary_load = time.perf_counter() - start
+    reader.close()
+
+    start = time.perf_counter()
+    reader = snapshot.Snapshot("binary.dat")
+    for uid in uids:
+        reader.get(uid)
+    lookup = (time.perf_counter() - start) / lookups
+    reader.close()
+
+    for name, file, load_time in (("Pickle", "legacy.dat", legacy_load), ("Binary", "binary.dat", binary_load)):
+        print(name + ": " + str(round(os.path.getsize(file) / players)) + " bytes per player, full load of " +
+              str(players) + " players " + str(round(load_time * 1000)) + " ms")
+    print("Binary: single player lookup from a freshly opened file " + str(round(lookup * 10 ** 6, 1)) + " us")
+    main.shutdown()
+
+
+# Bytes per player as traced by tracemalloc, for a few (planets, shuttles) mixes, and what
+#   a million such players would take. The bounded galaxy traits cache is left out
+def footprint(players="10000"):
+    players = int(players)
+    setup()
+    import galaxy
+    import player as plr
+
+    def build(planets, shuttles):
+        created = {}
+        for uid in range(1, players + 1):
+            player = plr.Player(uid, "player" + str(uid))
+            for i in range(shuttles):
+                player.shuttle_hangar.add_shuttle(plr.Shuttle())
+            for i in range(planets):
+                player.planet_container.index_planet(galaxy.discover(1))
+            player.pop_changes()
+            created[str(uid)] = player
+        galaxy.traits.cache_clear()
+        return created
+
+    for planets, shuttles in ((0, 0), (0, 1), (3, 3), (5, 3), (20, 5)):
+        created, size = measure_memory(lambda: build(planets, shuttles))
+        per_player = size / players
+        print(str(planets).rjust(2) + " planets, " + str(shuttles) + " shuttles: " + str(round(per_player)) +
+              " B/player, " + str(round(per_player * 10 ** 6 / 2 ** 30, 2)) + " GiB per million players")
+        del created
+
+
+# Planets stored in full against planets generated from galaxy coordinates: memory and encoded
+#   bytes per planet, and the cost of regenerating a planet's traits with and without the cache
+def galaxy(planets="100000"):
+    planets = int(planets)
+    setup()
+    import codec
+    import galaxy
+    import player as plr
+    from planet import Planet
+    from resource import roll_resource
+
+    def stored():
+        created = []
+        for i in range(planets):
+            planet = Planet(roll_resource())
+            planet.set_resource_amount(random.uniform(3.75, 25))
+            created.append(planet)
+        return created
+
+    def generated():
+        return [galaxy.discover(1) for i in range(planets)]
+
+    for name, build in (("Stored", stored), ("Generated", generated)):
+        created, size = measure_memory(build)
+        player = plr.Player(1, "player1")
+        empty = len(codec.encode(player))
+        for planet in created[:100]:
+            player.planet_container.index_planet(planet)
+        encoded = (len(codec.encode(player)) - empty) / 100
+        print(name.ljust(9) + " planets: " + str(round(size / planets)) + " B/planet in memory, " +
+              utils.round_str(encoded) + " B/planet encoded")
+
+    coordinates = [planet.coordinates for planet in created]
+    galaxy.traits.cache_clear()
+    start = time.perf_counter()
+    for position in coordinates:
+        galaxy.traits(position)
+    cold = (time.perf_counter() - start) / planets
+    start = time.perf_counter()
+    for position in coordinates[-1000:] * 100:
+        galaxy.traits(position)
+    warm = (time.perf_counter() - start) / 100000
+    print("Traits: " + str(round(cold * 10 ** 9)) + " ns generated, " + str(round(warm * 10 ** 9)) + " ns cached")
+
+
+# Predicted cargo-full and depletion wakeups: cost of predicting them on save, of a tick with nothing
+#   due, and of a tick where every player's cargo bay fills up at once
+def notifications(players="100000"):
+    players = int(players)
+    bot = setup()
+    import main
+    import storage_utils
+    reset_game(storage_utils)
+    scheduler = storage_utils.timed_task_daemon
+
+    start = time.perf_counter()
+    create_players(players)
+    utils.out("Created and scheduled " + str(players) + " players in " + str(round(time.perf_counter() - start, 2)) +
+              " s, " + str(len(storage_utils.wakeups)) + " with a wakeup")
+
+    start = time.perf_counter()
+    fired = scheduler.run_due(time.time())
+    print("Idle tick: " + str(fired) + " wakeups, " + str(round((time.perf_counter() - start) * 1000, 3)) + " ms")
+
+    # Leave every cargo bay a gram short of full, with an hour of drilling not collected yet
+    for uid in globals.player_storage.uids():
+        player = globals.player_storage.get(uid)
+        player.cargo.cur_weight = player.cargo.max_weight - 0.001
+        for planet in player.planet_container.get_planets():
+            planet.last_check -= 3600
+        player.mark_changed()
+        storage_utils.save_player(player)
+
+    bot.reset_stats()
+    start = time.perf_counter()
+    fired = scheduler.run_due(time.time())
+    elapsed = time.perf_counter() - start
+    print("Full tick: " + str(fired) + " wakeups in " + str(round(elapsed * 1000)) + " ms (" +
+          str(round(elapsed / max(fired, 1) * 10 ** 6, 1)) + " us each), " + str(bot.sent_messages) +
+          " notifications, " + str(len(scheduler)) + " entries left in the queue")
+    main.shutdown()
+
+
+# Sending a whole hangar out with /find_planet_all and bringing it back, and a single /find_planet with
+#   every other shuttle already out, for hangars of growing size: the cost per shuttle should stay flat
+def hangar(sizes="10,100,1000"):
+    bot = setup()
+    import main
+    import metrics
+    import storage_utils
+    import player as plr
+    from fakebot import FakeUser, FakeMessage
+    from player import action_lengths, Action
+    reset_game(storage_utils)
+    scheduler = storage_utils.timed_task_daemon
+    length = action_lengths[Action.PLANET_SEARCH]
+
+    def send(uid, command):
+        start = time.perf_counter()
+        main.handle_input(FakeMessage(FakeUser(uid, "player" + str(uid)), command))
+        return time.perf_counter() - start
+
+    def bring_back(player):
+        for action in player.pending_actions:
+            action.start_time -= length
+        storage_utils.schedule_wakeup(str(player.id), player.next_wakeup())
+        start = time.perf_counter()
+        scheduler.run_due(time.time())
+        return time.perf_counter() - start
+
+    for uid, size in enumerate(int(size) for size in sizes.split(",")):
+        player = plr.Player(uid + 1, "player" + str(uid + 1))
+        player.planet_container.max_planets = 10 * size
+        for i in range(size):
+            player.shuttle_hangar.add_shuttle(plr.Shuttle())
+        storage_utils.save_player(player)
+
+        bot.reset_stats()
+        dispatch = send(player.id, "/find_planet_all")
+        sent = len(player.pending_actions)
+        back = bring_back(player)
+        messages = bot.sent_messages
+
+        send(player.id, "/find_planet_" + str(size - 1))
+        single = send(player.id, "/find_planet")
+        bring_back(player)
+
+        print(str(size).rjust(5) + " shuttles: sent " + str(sent) + " in " + metrics.ms_str(dispatch) + " (" +
+              str(round(dispatch / sent * 10 ** 6, 1)) + " us each), back in " + metrics.ms_str(back) + " (" +
+              str(round(back / sent * 10 ** 6, 1)) + " us each), " + str(messages) + " messages; " +
+              "last idle shuttle sent in " + str(round(single * 10 ** 6)) + " us")
+    main.shutdown()
+
+
+# Commands per second through the sharded front with a growing number of worker processes, every player
+#   is created before the run so only the command mix is measured. Scaling is bounded by the CPU count
+def sharding(players="10000", commands="20000", counts="1,2,4"):
+    players, commands = int(players), int(commands)
+    setup()
+    import shards
+    from fakebot import FakeUser, FakeMessage
+    utils.out(str(os.cpu_count()) + " CPUs")
+
+    random.seed(1)
+    mix = random.choices(list(command_mix.keys()), weights=list(command_mix.values()), k=commands)
+    uids = [random.randint(1, players) for i in range(commands)]
+    for count in (int(count) for count in counts.split(",")):
+        setup()
+        dispatcher = shards.Dispatcher(count)
+        dispatcher.start()
+        for uid in range(1, players + 1):
+            dispatcher.dispatch(FakeMessage(FakeUser(uid, "player" + str(uid)), "/shop"))
+        dispatcher.barrier()
+
+        start = time.perf_counter()
+        for uid, command in zip(uids, mix):
+            dispatcher.dispatch(FakeMessage(FakeUser(uid, "player" + str(uid)), command))
+        dispatcher.barrier()
+        elapsed = time.perf_counter() - start
+        dispatcher.stop()
+        print(str(count) + " shards: " + str(round(commands / elapsed)) + " commands/sec")
+
+
+# Leaderboards of a million players: building them at startup, updating a player's scores, and the
+#   queries behind /leaderboard, against sorting every player for each query
+def leaderboards(players="1000000", queries="10000"):
+    players, queries = int(players), int(queries)
+    from leaderboard import Leaderboards, board_key
+
+    random.seed(1)
+    scores = {str(uid): (random.randint(1, 60), random.randint(0, 5000), round(random.uniform(0, 10 ** 6), 2),
+                         random.randint(0, 40)) for uid in range(1, players + 1)}
+    start = time.perf_counter()
+    boards = Leaderboards(scores.items())
+    print("Built for " + str(players) + " players in " + str(round(time.perf_counter() - start, 2)) + " s")
+
+    uids = [str(random.randint(1, players)) for i in range(queries)]
+    start = time.perf_counter()
+    for uid in uids:
+        lvl, exp, money, planets = scores[uid]
+        scores[uid] = (lvl, exp + 10, money + random.uniform(-100, 100), planets + random.choice((-1, 1)))
+        boards.update(uid, scores[uid])
+    update = (time.perf_counter() - start) / queries
+    print("Update: " + str(round(update * 10 ** 6, 1)) + " us")
+
+    for board in ("level", "credits", "planets"):
+        start = time.perf_counter()
+        for uid in uids:
+            boards.query(board, board_key(board, uid, scores[uid]), 10)
+        query = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        ranked = sorted(scores, key=lambda uid: board_key(board, uid, scores[uid]))
+        ranked[:10], ranked.index(uids[0])
+        scan = time.perf_counter() - start
+        print(board.ljust(7) + " top 10 and own rank: " + str(round(query * 10 ** 6, 1)) + " us, sorting everyone: " +
+              str(round(scan * 1000)) + " ms")
+
+
+# Matching against a market holding <orders> resting orders spread over every resource: orders and fills
+#   per second through Market.place, escrow and settlement included, and saving and loading the book
+def market(orders="100000", placed="20000"):
+    orders, placed = int(orders), int(placed)
+    setup()
+    import types
+    from resource import Resource
+    from market import Market, Side
+
+    class Trader(types.SimpleNamespace):
+        def notify(self, msg):
+            pass
+
+        def mark_changed(self):
+            pass
+
+    class Cargo:
+        def contains(self, resource, quantity):
+            return True
+
+        def remove(self, resource, quantity):
+            return True
+
+        def put(self, resource, quantity):
+            return 0
+
+    random.seed(1)
+    traders = [Trader(id=uid, money=float("inf"), cargo=Cargo(), market_seq=0) for uid in range(1, 1001)]
+    resources = list(Resource)
+    exchange = Market("market.dat")
+    start = time.perf_counter()
+    for i in range(orders):
+        side = random.choice((Side.BUY, Side.SELL))
+        price = random.uniform(1, 2) if side == Side.BUY else random.uniform(2, 3)
+        exchange.place(random.choice(traders), side, random.choice(resources), random.randint(1, 100), price)
+    print(str(orders) + " resting orders placed in " + str(round(time.perf_counter() - start, 2)) + " s")
+    # As a backup would once the traders are written
+    exchange.confirm({str(trader.id): trader.market_seq for trader in traders})
+
+    fills = 0
+    settle_fill = exchange.settle_fill
+
+    def count_fill(order, quantity, price, limit):
+        nonlocal fills
+        fills += 1
+        settle_fill(order, quantity, price, limit)
+
+    exchange.settle_fill = count_fill
+    start = time.perf_counter()
+    for i in range(placed):
+        side = random.choice((Side.BUY, Side.SELL))
+        price = random.uniform(1.5, 3) if side == Side.BUY else random.uniform(1, 2.5)
+        exchange.place(random.choice(traders), side, random.choice(resources), random.randint(1, 300), price)
+    elapsed = time.perf_counter() - start
+    print(str(placed) + " crossing orders: " + str(round(placed / elapsed)) + " orders/sec, " +
+          str(round(fills / 2 / elapsed)) + " fills/sec, " + str(len(exchange.orders)) + " orders resting afterwards")
+
+    start = time.perf_counter()
+    exchange.changed = True
+    exchange.save()
+    saved = time.perf_counter() - start
+    start = time.perf_counter()
+    Market("market.dat")
+    print("Save: " + str(round(saved * 1000)) + " ms, load: " + str(round((time.perf_counter() - start) * 1000)) +
+          " ms (" + str(os.path.getsize("market.dat") // 1024) + " KB)")
+
+
+# Patrol battles due in one tick: fought one by one with Entity.attack, against combat.resolve() with
+#   every attacker slot of a round as array operations across the battles still going
+def combat(battles="1000,5000,20000"):
+    import combat
+    from entity import Entity
+
+    def patrols(count):
+        random.seed(1)
+        result = []
+        for i in range(count):
+            ship = Entity("ship")
+            ship.hp = ship.max_hp = random.randint(25, 100)
+            ship.shield = ship.shield_max = random.randint(1, 10)
+            ship.atk = random.randint(1, 5)
+            result.append(combat.Battle([ship], combat.spawn_mobs(random.randint(1, 30), str(i))))
+        return result
+
+    def outcome(battle):
+        return battle.rounds, battle.winner, [(entity.hp, entity.shield, entity.dead)
+                                              for entity in battle.fleet + battle.mobs]
+
+    print("NumPy: " + ("yes" if combat.numpy is not None else "no, resolve() falls back to the naive loop"))
+    combat.batch_min = 0
+    for count in map(int, battles.split(",")):
+        naive = patrols(count)
+        start = time.perf_counter()
+        for battle in naive:
+            combat.fight(battle)
+        naive_time = time.perf_counter() - start
+
+        batched = patrols(count)
+        start = time.perf_counter()
+        combat.resolve(batched)
+        batched_time = time.perf_counter() - start
+
+        same = all(outcome(a) == outcome(b) for a, b in zip(naive, batched))
+        print(str(count) + " battles: " + str(round(naive_time * 1000)) + " ms one by one, " +
+              str(round(batched_time * 1000)) + " ms batched (" + str(round(count / batched_time)) +
+              " battles/sec), " + ("identical" if same else "DIFFERENT") + " results")
+
+
+benchmarks = {
+    "throughput": throughput,
+    "messages": messages,
+    "progress": progress,
+    "layout": layout,
+    "distribution": distribution,
+    "load": load,
+    "overhead": overhead,
+    "restart": restart,
+    "snapshot": snapshot,
+    "format": format,
+    "footprint": footprint,
+    "galaxy": galaxy,
+    "notifications": notifications,
+    "hangar": hangar,
+    "sharding": sharding,
+    "leaderboards": leaderboards,
+    "market": market,
+    "combat": combat,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("Usage: python3 bench.py <" + "|".join(benchmarks) + "> [args...]")
+        sys.exit(1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,35 @@
+import time
+import calendar
+
+
+# Where game time comes from: utils.now() and the timed task daemon both read utils.clock, so
+#   replacing it with a VirtualClock lets a simulation (simulate.py) skip ahead by days at a time
+class Clock:
+    # Whether startup work may go on in background threads. A virtual clock keeps everything on the
+    #   caller's thread, so the same run always does the same things in the same order
+    background = True
+
+    # Whole seconds since the epoch, game time
+    def now(self) -> int:
+        return calendar.timegm(time.gmtime())
+
+    # Same time with fractions of a second, what timed task deadlines are compared against
+    def time(self) -> float:
+        return time.time()
+
+
+# Only moves when told to
+class VirtualClock(Clock):
+    background = False
+
+    def __init__(self, start: float = 0):
+        self.current = start
+
+    def now(self) -> int:
+        return int(self.current)
+
+    def time(self) -> float:
+        return self.current
+
+    def advance(self, seconds: float):
+        self.current += seconds
@@ -0,0 +1,296 @@
+import pickle
+import struct
+from resource import Resource
+from entity import Cargo
+from planet import Planet
+from galaxy import GalaxyPlanet
+from planet_array import PlanetView
+from player import Player, PendingAction, Action, Shuttle, ShuttleHangar, PlanetContainer
+
+# Schema-versioned binary player records: a 2-byte schema version followed by the fields that version
+#   lists, in order. Records of older versions are decoded into plain dicts, brought up to date by
+#   <migrations> and only then turned into objects, so changing a class never breaks saved players.
+# Field kinds:
+#   "q" int64, "I" uint32, "n" number (float64, read back as int if whole), "?" bool, "s" string,
+#   (Enum,) member index, ("object", name), ("map", Enum, kind) enum-keyed map of numbers,
+#   ("list", name) list of objects, a dict is stored as the list of its values,
+#   ("list", (name, ...)) list of objects of several kinds, each one prefixed with the index of its kind
+# Enum members are stored by declaration index, so new members must only ever be appended.
+schema_version = 4
+
+upgradeable = [("upgrade_lvl", "q"), ("upgrade_amount", "q"), ("upgrade_multiplier", "n"), ("upgrade_cost", "n")]
+
+schemas = {
+    1: {
+        "player": [("id", "q"), ("name", "s"), ("hp", "n"), ("max_hp", "n"), ("shield", "n"), ("shield_max", "n"),
+                   ("atk", "n"), ("dead", "?"), ("last_check", "n"), ("money", "n"), ("lvl", "q"), ("exp", "q"),
+                   ("required_exp", "q"), ("drill_lvl", "q"), ("cargo", ("object", "cargo")),
+                   ("pending_actions", ("list", "pending_action")),
+                   ("planet_container", ("object", "planet_container")),
+                   ("shuttle_hangar", ("object", "shuttle_hangar"))],
+        "cargo": upgradeable + [("cur_weight", "n"), ("max_weight", "n"), ("contents", ("map", Resource, "n"))],
+        "pending_action": [("uid", "q"), ("action", (Action,)), ("start_time", "n"), ("length", "q"), ("ready", "?")],
+        "planet_container": upgradeable + [("max_planets", "q"), ("planets", ("list", "planet"))],
+        "planet": [("name", "s"), ("resource", (Resource,)), ("resource_amount", "n"), ("last_check", "n")],
+        "shuttle_hangar": [("shuttles", ("list", "shuttle"))],
+        "shuttle": [("name", "s"), ("lvl", "q"), ("hp", "n"), ("in_use", "?"), ("departure_time", "n")],
+    },
+}
+
+# Planets are either stored in full or generated from their galaxy coordinates
+schemas[2] = dict(schemas[1])
+schemas[2]["planet_container"] = upgradeable + [("max_planets", "q"),
+                                                ("planets", ("list", ("planet", "galaxy_planet")))]
+schemas[2]["galaxy_planet"] = [("coordinates", "I"), ("extracted", "n"), ("last_check", "n")]
+
+# Shuttles have ids and planet searches know which shuttle they sent out
+schemas[3] = dict(schemas[2])
+schemas[3]["pending_action"] = schemas[2]["pending_action"] + [("shuttle_id", "q")]
+schemas[3]["shuttle"] = [("id", "q")] + schemas[2]["shuttle"]
+
+# Players count the market operations applied to them, see Market
+schemas[4] = dict(schemas[3])
+schemas[4]["player"] = schemas[3]["player"] + [("market_seq", "q")]
+
+
+# Version 1 planets are all stored in full, and they are read back the same way in version 2
+def migrate_1(state):
+    return state
+
+
+# Ids are handed out by the hangar and searches linked to their shuttle by departure time
+#   once the player is built, see ShuttleHangar.link()
+def migrate_2(state):
+    for shuttle in state["shuttle_hangar"]["shuttles"]:
+        shuttle["id"] = -1
+    for action in state["pending_actions"]:
+        action["shuttle_id"] = -1
+    return state
+
+
+def migrate_3(state):
+    state["market_seq"] = 0
+    return state
+
+
+# migrations[version](state) turns a decoded player State of <version> into one of <version> + 1
+migrations = {1: migrate_1, 2: migrate_2, 3: migrate_3}
+
+classes = {"player": Player, "cargo": Cargo, "pending_action": PendingAction, "planet_container": PlanetContainer,
+           "planet": Planet, "galaxy_planet": GalaxyPlanet, "shuttle_hangar": ShuttleHangar, "shuttle": Shuttle}
+# Classes written as another kind, they're read back as that kind's class
+encoded_as = {PlanetView: "planet"}
+
+version_header = struct.Struct(">H")
+string_header = struct.Struct(">H")
+count_header = struct.Struct(">I")
+map_header = struct.Struct(">B")
+map_entry = struct.Struct(">Bd")
+enum_id = struct.Struct(">B")
+variant_id = struct.Struct(">B")
+
+scalar_kinds = {"q": "q", "I": "I", "n": "d", "?": "?"}
+
+
+def number(value: float):
+    return int(value) if value.is_integer() else value
+
+
+# Consecutive scalar fields are packed with a single struct
+class Scalars:
+    def __init__(self, fields):
+        self.names = [name for name, kind in fields]
+        self.numbers = [i for i, (name, kind) in enumerate(fields) if kind == "n"]
+        self.struct = struct.Struct(">" + "".join(scalar_kinds[kind] for name, kind in fields))
+
+    def encode(self, obj, out: list):
+        out.append(self.struct.pack(*[getattr(obj, name) for name in self.names]))
+
+    def decode(self, data, offset: int, state: dict) -> int:
+        values = self.struct.unpack_from(data, offset)
+        state.update(zip(self.names, values))
+        for i in self.numbers:
+            state[self.names[i]] = number(values[i])
+        return offset + self.struct.size
+
+
+class Field:
+    def __init__(self, name: str, kind, codecs: dict):
+        self.name = name
+        self.kind = kind
+        self.codecs = codecs
+        enum = kind[1] if kind[0] == "map" else kind[0] if isinstance(kind, tuple) else None
+        if isinstance(enum, type):
+            self.members = list(enum)
+            self.ids = {member: id for id, member in enumerate(self.members)}
+        if kind[0] == "list" and isinstance(kind[1], tuple):
+            self.variants = kind[1]
+            self.variant_ids = {classes[name]: id for id, name in enumerate(self.variants)}
+            for cls, name in encoded_as.items():
+                if name in self.variants:
+                    self.variant_ids[cls] = self.variants.index(name)
+
+    def encode(self, obj, out: list):
+        value = getattr(obj, self.name)
+        kind = self.kind
+        if kind == "s":
+            data = value.encode()
+            out.append(string_header.pack(len(data)))
+            out.append(data)
+        elif kind[0] == "object":
+            self.codecs[kind[1]].encode(value, out)
+        elif kind[0] == "list":
+            items = value.values() if isinstance(value, dict) else value
+            out.append(count_header.pack(len(value)))
+            if isinstance(kind[1], tuple):
+                for item in items:
+                    id = self.variant_ids[type(item)]
+                    out.append(variant_id.pack(id))
+                    self.codecs[self.variants[id]].encode(item, out)
+            else:
+                codec = self.codecs[kind[1]]
+                for item in items:
+                    codec.encode(item, out)
+        elif kind[0] == "map":
+            ids = self.ids
+            out.append(map_header.pack(len(value)))
+            for key, amount in value.items():
+                out.append(map_entry.pack(ids[key], amount))
+        else:
+            out.append(enum_id.pack(self.ids[value]))
+
+    def decode(self, data, offset: int, state: dict, make) -> int:
+        kind = self.kind
+        if kind == "s":
+            length, = string_header.unpack_from(data, offset)
+            offset += string_header.size
+            state[self.name] = bytes(data[offset:offset + length]).decode()
+            return offset + length
+        if kind[0] == "object":
+            state[self.name], offset = self.codecs[kind[1]].decode(data, offset, make)
+            return offset
+        if kind[0] == "list":
+            count, = count_header.unpack_from(data, offset)
+            offset += count_header.size
+            items = []
+            for i in range(count):
+                if isinstance(kind[1], tuple):
+                    id, = variant_id.unpack_from(data, offset)
+                    offset += variant_id.size
+                    codec = self.codecs[self.variants[id]]
+                else:
+                    codec = self.codecs[kind[1]]
+                item, offset = codec.decode(data, offset, make)
+                items.append(item)
+            state[self.name] = items
+            return offset
+        if kind[0] == "map":
+            members = self.members
+            count, = map_header.unpack_from(data, offset)
+            offset += map_header.size
+            contents = {}
+            for i in range(count):
+                id, amount = map_entry.unpack_from(data, offset)
+                contents[members[id]] = number(amount)
+                offset += map_entry.size
+            state[self.name] = contents
+            return offset
+
+        id, = enum_id.unpack_from(data, offset)
+        state[self.name] = self.members[id]
+        return offset + enum_id.size
+
+
+class ObjectCodec:
+    def __init__(self, name: str, fields: list, codecs: dict):
+        self.name = name
+        self.steps = []
+        scalars = []
+        for name, kind in fields:
+            if kind in scalar_kinds:
+                scalars.append((name, kind))
+                continue
+            if scalars:
+                self.steps.append(Scalars(scalars))
+                scalars = []
+            self.steps.append(Field(name, kind, codecs))
+        if scalars:
+            self.steps.append(Scalars(scalars))
+
+    def encode(self, obj, out: list):
+        for step in self.steps:
+            step.encode(obj, out)
+
+    # <make>(name, state) turns the decoded fields into whatever the caller wants, objects or dicts
+    def decode(self, data, offset: int, make) -> tuple:
+        state = {}
+        for step in self.steps:
+            if isinstance(step, Scalars):
+                offset = step.decode(data, offset, state)
+            else:
+                offset = step.decode(data, offset, state, make)
+        return make(self.name, state), offset
+
+
+def compile_schema(schema: dict) -> dict:
+    codecs = {}
+    for name, fields in schema.items():
+        codecs[name] = ObjectCodec(name, fields, codecs)
+    return codecs
+
+
+codecs = {version: compile_schema(schema) for version, schema in schemas.items()}
+
+
+# Objects are restored the same way pickle would restore them
+def make_object(name: str, state: dict):
+    obj = classes[name].__new__(classes[name])
+    obj.__setstate__(state)
+    return obj
+
+
+# Decoded fields of an object of an older schema version, <name> is its kind in the schema
+class State(dict):
+    def __init__(self, name: str, state: dict):
+        super().__init__(state)
+        self.name = name
+
+
+def make_state(name: str, state: dict):
+    return State(name, state)
+
+
+# Turn a migrated player State into objects
+def build(value):
+    if isinstance(value, State):
+        return make_object(value.name, {field: build(item) for field, item in value.items()})
+    if isinstance(value, list):
+        return [build(item) for item in value]
+    return value
+
+
+def encode(player) -> bytes:
+    out = [version_header.pack(schema_version)]
+    codecs[schema_version]["player"].encode(player, out)
+    return b"".join(out)
+
+
+def version(data) -> int:
+    if data[0] == pickle.PROTO[0]:
+        return 0
+    return version_header.unpack_from(data)[0]
+
+
+# Also accepts players pickled before this format existed, pickles always start with the PROTO opcode
+def decode(data):
+    record_version = version(data)
+    if record_version == 0:
+        return pickle.loads(data)
+    if record_version == schema_version:
+        return codecs[record_version]["player"].decode(data, version_header.size, make_object)[0]
+
+    state = codecs[record_version]["player"].decode(data, version_header.size, make_state)[0]
+    while record_version < schema_version:
+        state = migrations[record_version](state)
+        record_version += 1
+    return build(state)
@@ -0,0 +1,163 @@
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import utils
+from entity import Entity, Mob
+
+# Fleet vs. mob battles under the Entity.attack rules, in rounds: every ship of the fleet that is still
+#   standing attacks the first mob still standing, then every mob left attacks the first ship left.
+# A battle ends when one side is destroyed, or undecided after <max_rounds>.
+# fight() resolves one battle with Entity.attack itself. resolve() does many at once: with NumPy every
+#   attacker slot of a round is one set of array operations across all battles still going, which gives
+#   exactly the same results as fight(), otherwise (or for a few battles) it uses fight() for each battle.
+max_rounds = 100
+
+# Below this many battles setting up the arrays costs more than fighting them one by one
+batch_min = 100
+
+mob_names = ["Raider", "Marauder", "Corsair", "Scavenger", "Drone", "Wrecker"]
+
+
+class Battle(utils.Slotted):
+    __slots__ = ("fleet", "mobs", "rounds", "winner")
+
+    FLEET = "fleet"
+    MOBS = "mobs"
+
+    def __init__(self, fleet: list, mobs: list):
+        self.fleet = fleet
+        self.mobs = mobs
+        self.rounds = 0
+        # FLEET, MOBS, or None while it's undecided
+        self.winner = None
+
+    def decide(self, fleet_alive: bool, mobs_alive: bool):
+        if fleet_alive != mobs_alive:
+            self.winner = Battle.FLEET if fleet_alive else Battle.MOBS
+
+
+# Mobs met by a player of level <lvl>, the same for the same <seed>
+def spawn_mobs(lvl: int, seed: str) -> list:
+    rng = random.Random(seed)
+    mobs = []
+    for i in range(rng.randint(1, min(1 + lvl // 3, 4))):
+        mob = Mob()
+        mob.name = rng.choice(mob_names)
+        mob.hp = mob.max_hp = rng.randint(3, 5 + lvl)
+        mob.shield = mob.shield_max = rng.randint(1, 1 + lvl // 2)
+        mob.atk = 1 + rng.randint(0, lvl // 5)
+        mobs.append(mob)
+    return mobs
+
+
+def first_alive(entities: list) -> Entity:
+    for entity in entities:
+        if not entity.dead:
+            return entity
+    return None
+
+
+def fight(battle: Battle, rounds: int = max_rounds) -> Battle:
+    sides = ((battle.fleet, battle.mobs), (battle.mobs, battle.fleet))
+    while battle.rounds < rounds and first_alive(battle.fleet) and first_alive(battle.mobs):
+        battle.rounds += 1
+        for attackers, defenders in sides:
+            for attacker in attackers:
+                target = first_alive(defenders)
+                if attacker.dead or target is None:
+                    continue
+                attacker.attack(target)
+    battle.decide(first_alive(battle.fleet) is not None, first_alive(battle.mobs) is not None)
+    return battle
+
+
+def resolve(battles: list, rounds: int = max_rounds) -> list:
+    if numpy is None or len(battles) < batch_min:
+        for battle in battles:
+            fight(battle, rounds)
+        return battles
+
+    fleet = Side([battle.fleet for battle in battles])
+    mobs = Side([battle.mobs for battle in battles])
+    played = numpy.zeros(len(battles), dtype=numpy.int64)
+    live = numpy.arange(len(battles))
+    for round in range(rounds):
+        live = live[fleet.alive[live].any(axis=1) & mobs.alive[live].any(axis=1)]
+        if not len(live):
+            break
+        played[live] += 1
+        for attackers, defenders in ((fleet, mobs), (mobs, fleet)):
+            for slot in range(attackers.slots):
+                attackers.attack(slot, defenders, live)
+
+    fleet.write_back()
+    mobs.write_back()
+    outcomes = zip(played.tolist(), fleet.alive.any(axis=1).tolist(), mobs.alive.any(axis=1).tolist())
+    for battle, (count, fleet_alive, mobs_alive) in zip(battles, outcomes):
+        battle.rounds = count
+        battle.decide(fleet_alive, mobs_alive)
+    return battles
+
+
+# One side of every battle as (battle, slot) columns, battles with fewer entities are padded with dead slots.
+# Entities are copied in and out one attribute at a time for all of them, that's where most of the
+#   time of a batch goes
+class Side:
+    def __init__(self, groups: list):
+        self.entities = [entity for group in groups for entity in group]
+        lengths = numpy.array([len(group) for group in groups])
+        self.slots = int(lengths.max())
+        shape = (len(groups), self.slots)
+        self.cells = (numpy.repeat(numpy.arange(len(groups)), lengths),
+                      numpy.arange(len(self.entities)) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths))
+
+        self.hp = numpy.zeros(shape, dtype=numpy.int64)
+        self.shield = numpy.zeros(shape, dtype=numpy.float64)
+        self.shield_max = numpy.ones(shape, dtype=numpy.float64)
+        self.atk = numpy.zeros(shape, dtype=numpy.float64)
+        self.alive = numpy.zeros(shape, dtype=bool)
+        self.hp[self.cells] = [entity.hp for entity in self.entities]
+        self.shield[self.cells] = [entity.shield for entity in self.entities]
+        self.shield_max[self.cells] = [entity.shield_max for entity in self.entities]
+        self.atk[self.cells] = [entity.atk for entity in self.entities]
+        self.alive[self.cells] = [not entity.dead for entity in self.entities]
+        self.before = (self.hp[self.cells], self.shield[self.cells], self.alive[self.cells])
+
+    # Entity.attack by the entity in <slot> of every battle in <rows> on the first defender still alive
+    def attack(self, slot: int, defenders: 'Side', rows):
+        rows = rows[self.alive[rows, slot]]
+        rows = rows[defenders.alive[rows].any(axis=1)]
+        if not len(rows):
+            return
+        target = defenders.alive[rows].argmax(axis=1)
+
+        shield = defenders.shield[rows, target]
+        shield_percent = shield / defenders.shield_max[rows, target]
+        atk = self.atk[rows, slot]
+        atk = atk - (atk * shield_percent)
+
+        shielded = shield_percent > 0
+        shield = numpy.where(shielded, shield - numpy.maximum(atk, 1), shield)
+        atk = numpy.where(shielded & (shield < 0), atk + numpy.abs(shield), atk)
+        shield = numpy.where(shielded & (shield < 0), 0, shield)
+
+        hp = numpy.maximum(defenders.hp[rows, target] - numpy.trunc(atk).astype(numpy.int64), 0)
+        defenders.shield[rows, target] = shield
+        defenders.hp[rows, target] = hp
+        defenders.alive[rows, target] &= hp != 0
+
+    # Copies the outcome to the entities and marks the ones it changed
+    def write_back(self):
+        hp, shield, alive = self.hp[self.cells], self.shield[self.cells], self.alive[self.cells]
+        changed = numpy.flatnonzero((hp != self.before[0]) | (shield != self.before[1]) | (alive != self.before[2]))
+        hp, shield, alive = hp[changed].tolist(), shield[changed].tolist(), alive[changed].tolist()
+        for i, index in enumerate(changed.tolist()):
+            entity = self.entities[index]
+            entity.hp = hp[i]
+            entity.shield = int(shield[i]) if shield[i].is_integer() else shield[i]
+            entity.dead = not alive[i]
+            entity.mark_changed()
@@ -0,0 +1,324 @@
+import os
+import time
+import heapq
+import pickle
+import itertools
+import threading
+import traceback
+import utils
+import metrics
+
+send_latency = metrics.histogram("send_message_latency_seconds", "Bot API send_message round-trip time")
+send_errors = metrics.counter_family("send_message_errors_total", "Failed send_message calls", "code")
+
+# Lower value is delivered first
+PRIORITY_REPLY = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BROADCAST = 2
+
+# Telegram's limits: ~30 messages/sec overall and ~1 message/sec to the same chat
+global_rate = 30
+chat_rate = 1
+chat_burst = 3
+
+max_attempts = 5
+max_backoff = 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+# <on_done>(sent) is called once the message was sent or given up on, with sent=False if it was
+#   dropped because delivery stopped first
+class Message:
+    def __init__(self, chat_id: int, text: str, priority: int, on_done=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.attempts = 0
+        self.on_done = on_done
+
+    def done(self, sent: bool = True):
+        if self.on_done is not None:
+            self.on_done(sent)
+
+
+# Outgoing message queue served by a pool of worker threads.
+# Messages wait in <ready> ordered by (priority, order of sending); a message whose chat is out of tokens
+#   is parked in <delayed> until the chat's bucket refills, so it doesn't hold up other chats.
+class Delivery:
+    def __init__(self, bot, workers: int = 4):
+        self.bot = bot
+        self.workers = workers
+        self.ready = []
+        self.delayed = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}
+        self.threads = []
+        self.running = False
+        self.stopped = False
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_REPLY, on_done=None):
+        message = Message(chat_id, text, priority, on_done)
+        with self.cond:
+            if not self.stopped:
+                heapq.heappush(self.ready, (priority, next(self.counter), message))
+                self.cond.notify()
+                return
+        message.done(False)
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.ready) + len(self.delayed) + self.in_flight
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.drop_idle_buckets()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(chat_rate, chat_burst)
+        return bucket
+
+    def drop_idle_buckets(self):
+        now = time.monotonic()
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if bucket.is_idle(now):
+                del self.chat_buckets[chat_id]
+
+    def delay(self, message: Message, until: float):
+        heapq.heappush(self.delayed, (until, next(self.counter), message))
+
+    def next_message(self):
+        with self.cond:
+            while self.running or self.ready or self.delayed:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    message = heapq.heappop(self.delayed)[2]
+                    heapq.heappush(self.ready, (message.priority, next(self.counter), message))
+
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                if self.ready:
+                    global_wait = self.global_bucket.wait_time(now)
+                    if global_wait > 0:
+                        self.cond.wait(global_wait)
+                        continue
+
+                    message = heapq.heappop(self.ready)[2]
+                    chat_wait = self.chat_bucket(message.chat_id).wait_time(now)
+                    if chat_wait > 0:
+                        self.delay(message, now + chat_wait)
+                        continue
+
+                    self.global_bucket.take()
+                    self.chat_bucket(message.chat_id).take()
+                    self.in_flight += 1
+                    return message
+
+                self.cond.wait(timeout)
+            return None
+
+    def work(self):
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+
+            try:
+                with metrics.Timer(send_latency):
+                    self.bot.send_message(message.chat_id, message.text)
+                self.sent += 1
+                message.done()
+            except Exception as e:
+                send_errors.labels(str(getattr(e, "error_code", "other"))).inc()
+                self.retry(message, e)
+            finally:
+                with self.cond:
+                    self.in_flight -= 1
+
+    # Rate limit errors are retried after the time Telegram asks for, other errors with exponential backoff.
+    # Client errors (blocked bot, deleted chat, ...) are not worth retrying.
+    def retry(self, message: Message, e: Exception):
+        error_code = getattr(e, "error_code", None)
+        message.attempts += 1
+        if (error_code is not None and 400 <= error_code < 500 and error_code != 429) \
+                or message.attempts >= max_attempts:
+            self.failed += 1
+            utils.out("Failed to deliver a message to " + str(message.chat_id) + ": " + str(e))
+            message.done()
+            return
+
+        delay = min(2 ** message.attempts, max_backoff)
+        if error_code == 429:
+            result = getattr(e, "result_json", None) or {}
+            delay = result.get("parameters", {}).get("retry_after", delay)
+
+        with self.cond:
+            until = time.monotonic() + delay
+            self.chat_bucket(message.chat_id).block(until)
+            self.delay(message, until)
+            self.cond.notify()
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Workers exit once everything queued so far has been delivered (or given up on). Whatever is still
+    #   queued after <timeout> is dropped, and so is anything sent from then on
+    def stop(self, timeout: float = 30):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self.threads = []
+
+        with self.cond:
+            self.stopped = True
+            dropped = [entry[2] for entry in self.ready + self.delayed]
+            self.ready, self.delayed = [], []
+            self.cond.notify_all()
+        for message in dropped:
+            message.done(False)
+
+
+# Sends one text to a list of players in batches, so an interrupted broadcast picks up where it left off
+#   after a restart. The text and players are written to <broadcast_file> once when it starts, after every
+#   batch only the position is written to <broadcast_position_file>.
+# Only one broadcast runs at a time, it owns the file. When delivery stops halfway through a batch, the
+#   broadcast ends without moving past that batch, so its players may get the text twice but never miss it
+broadcast_file = "broadcast.dat"
+broadcast_position_file = "broadcast.pos"
+broadcast_batch = 100
+
+active_broadcast = None
+broadcast_lock = threading.Lock()
+
+broadcast_started = "Broadcast started."
+broadcast_busy = "Another broadcast is still running, try again once it's done."
+
+
+class Broadcast:
+    def __init__(self, delivery: Delivery, text: str, uids: list, position: int = 0):
+        self.delivery = delivery
+        self.text = text
+        self.uids = uids
+        self.position = position
+        self.thread = None
+
+    # The position goes first, so a broadcast file never comes with the position of an older broadcast
+    def save(self):
+        self.save_position()
+        utils.write_atomic(broadcast_file, lambda file: pickle.dump((self.text, self.uids), file))
+
+    def save_position(self):
+        utils.write_atomic(broadcast_position_file, lambda file: file.write(str(self.position).encode()))
+
+    # False if another broadcast is still running
+    def start(self) -> bool:
+        global active_broadcast
+        with broadcast_lock:
+            if active_broadcast is not None:
+                return False
+            active_broadcast = self
+        self.save()
+        self.thread = threading.Thread(target=self.fan_out, daemon=True)
+        self.thread.start()
+        return True
+
+    def fan_out(self):
+        global active_broadcast
+        utils.out("Broadcasting to " + str(len(self.uids) - self.position) + " players...")
+        try:
+            while self.position < len(self.uids):
+                batch = self.uids[self.position:self.position + broadcast_batch]
+                if not self.send_batch(batch):
+                    utils.out("Broadcast interrupted, " + str(len(self.uids) - self.position) + " players left")
+                    return
+                self.position += len(batch)
+                self.save_position()
+            os.remove(broadcast_file)
+            os.remove(broadcast_position_file)
+            utils.out("Broadcast done.")
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with broadcast_lock:
+                active_broadcast = None
+
+    # False if delivery stopped before every message of the batch was sent
+    def send_batch(self, batch: list) -> bool:
+        remaining = len(batch)
+        all_sent = True
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def on_done(sent: bool):
+            nonlocal remaining, all_sent
+            with lock:
+                remaining -= 1
+                all_sent = all_sent and sent
+                if remaining == 0:
+                    done.set()
+
+        for uid in batch:
+            self.delivery.send(int(uid), self.text, PRIORITY_BROADCAST, on_done)
+        done.wait()
+        return all_sent
+
+
+def resume_broadcast(delivery: Delivery):
+    if not os.path.exists(broadcast_file):
+        return None
+
+    with open(broadcast_file, "rb") as file:
+        text, uids = pickle.load(file)
+    position = 0
+    if os.path.exists(broadcast_position_file):
+        with open(broadcast_position_file, "rb") as file:
+            position = int(file.read())
+    broadcast = Broadcast(delivery, text, uids, position)
+    return broadcast if broadcast.start() else None
+
+
+# After delivery has stopped, the running broadcast (if any) finishes its current batch right away
+def join_broadcast():
+    with broadcast_lock:
+        broadcast = active_broadcast
+    if broadcast is not None:
+        broadcast.thread.join()
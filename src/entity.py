@@ -3,8 +3,32 @@ import icons
 from resource import *
 
 
-class Upgradeable:
+# Anything persisted as part of a player record: mutations mark it changed,
+#   storage_utils.save_player() only writes players that have changes to flush
+class Trackable(utils.Slotted):
+    __slots__ = ("changed",)
+
+    def __init__(self):
+        self.changed = False
+
+    def __setstate__(self, state):
+        self.changed = False
+        super().__setstate__(state)
+
+    def mark_changed(self):
+        self.changed = True
+
+    def pop_changed(self) -> bool:
+        changed = self.changed
+        self.changed = False
+        return changed
+
+
+class Upgradeable(Trackable):
+    __slots__ = ("upgrade_lvl", "upgrade_amount", "upgrade_multiplier", "upgrade_cost")
+
     def __init__(self, upgrade_by=1, upgrade_multiplier=0.5, initial_cost=1):
+        super().__init__()
         self.upgrade_lvl = 1
         self.upgrade_amount = upgrade_by
         self.upgrade_multiplier = upgrade_multiplier
@@ -13,9 +37,15 @@ class Upgradeable:
     def upgrade(self):
         self.upgrade_lvl += 1
         self.upgrade_cost += self.upgrade_cost * self.upgrade_multiplier
+        self.mark_changed()
 
 
 class Cargo(Upgradeable):
+    __slots__ = ("cur_weight", "max_weight", "contents")
+
+    # Drilled amounts are floats, a cargo bay less than this many kg short of its capacity is full
+    full_tolerance = 1e-6
+
     def __init__(self):
         super().__init__(upgrade_by=25, upgrade_multiplier=0.20, initial_cost=15)
         self.cur_weight = 0
@@ -33,6 +63,7 @@ class Cargo(Upgradeable):
             self.cur_weight = self.max_weight
 
         self.contents[resource] = self.get(resource) + (quantity - overflow)
+        self.mark_changed()
         return overflow
 
     def remove(self, resource: Resource, quantity: float) -> bool:
@@ -45,6 +76,7 @@ class Cargo(Upgradeable):
         if self.cur_weight < 0:
             self.cur_weight = 0
 
+        self.mark_changed()
         return True
 
     def contains(self, resource: Resource, quantity: float) -> bool:
@@ -60,17 +92,24 @@ class Cargo(Upgradeable):
     def is_empty(self) -> bool:
         return not self.contents
 
+    def free_space(self) -> float:
+        free_space = self.max_weight - self.cur_weight
+        return free_space if free_space > self.full_tolerance else 0
+
     def is_full(self) -> bool:
-        return self.cur_weight == self.max_weight
+        return self.free_space() == 0
 
     def get_cargo_header_str(self):
         return (icons.box + " Cargo bay " +
                 "[" + utils.round_str(self.cur_weight) + "/" + utils.round_str(self.max_weight) + " kg]")
 
 
-class Entity:
-    def __init__(self):
-        self.name = utils.rand_str(15)
+class Entity(Trackable):
+    __slots__ = ("name", "hp", "max_hp", "shield", "shield_max", "atk", "dead", "cargo")
+
+    def __init__(self, name: str = ""):
+        super().__init__()
+        self.name = name
 
         self.hp = 25
         self.max_hp = self.hp
@@ -97,11 +136,13 @@ class Entity:
         if self.shield < 0:
             dmg_overflow = abs(self.shield)
             self.shield = 0
+        self.mark_changed()
         return dmg_overflow
 
     def take_damage(self, amount: int):
         self.hp -= amount
         self.check_stats()
+        self.mark_changed()
 
     def attack(self, enemy: 'Entity'):
         enemy_shield = enemy.get_shield_percent()
@@ -121,5 +162,7 @@ class Entity:
 
 
 class Mob(Entity):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
@@ -0,0 +1,63 @@
+import time
+import threading
+from collections import deque
+
+
+# In-process stand-in for telebot.TeleBot: serves queued updates to get_updates()
+#   and counts send_message() calls, optionally sleeping to imitate a Telegram round-trip.
+# Like Telegram, get_updates() waits up to <timeout> for an update and keeps serving the same updates
+#   until a later call confirms them with a higher offset.
+
+class FakeUser:
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+
+class FakeMessage:
+    def __init__(self, user: FakeUser, text: str):
+        self.from_user = user
+        self.text = text
+
+
+class FakeUpdate:
+    def __init__(self, update_id: int, message: FakeMessage):
+        self.update_id = update_id
+        self.message = message
+
+
+class FakeBot:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.updates = deque()
+        self.next_update_id = 1
+        self.lock = threading.Lock()
+        self.pushed = threading.Condition(self.lock)
+        self.sent_messages = 0
+        self.sent_bytes = 0
+
+    def push(self, uid: int, text: str):
+        with self.lock:
+            user = FakeUser(uid, "player" + str(uid))
+            self.updates.append(FakeUpdate(self.next_update_id, FakeMessage(user, text)))
+            self.next_update_id += 1
+            self.pushed.notify_all()
+
+    def get_updates(self, offset=None, limit=100, timeout=20, **kwargs):
+        with self.lock:
+            while self.updates and offset is not None and self.updates[0].update_id < offset:
+                self.updates.popleft()
+            self.pushed.wait_for(lambda: self.updates, timeout or 0.01)
+            return [self.updates[i] for i in range(min(limit, len(self.updates)))]
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self.lock:
+            self.sent_messages += 1
+            self.sent_bytes += len(text)
+
+    def reset_stats(self):
+        with self.lock:
+            self.sent_messages = 0
+            self.sent_bytes = 0
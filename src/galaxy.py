@@ -0,0 +1,86 @@
+import random
+import string
+import struct
+import hashlib
+import functools
+from typing import NamedTuple
+from resource import Resource, sampler
+from planet import resources_per_lvl
+import utils
+
+# Procedural galaxy: everything about a planet follows from its coordinates, so only
+#   what changed since it was found (extracted kg, last_check) has to be stored.
+# Coordinates are a 32-bit int, the discovering captain's level in the top 8 bits and a random position
+#   in the rest; the level sets how rich the planet is, like the rolled amounts used to.
+# Changing <seed> changes every planet already found, so it must stay the same for a world
+seed = 0x5eed6a1a
+level_shift = 24
+max_level = 255
+
+name_letters = string.ascii_letters + string.digits + " "
+
+hash_key = struct.Struct(">QI")
+hash_fields = struct.Struct(">6s3I")
+
+
+class Traits(NamedTuple):
+    name: str
+    resource: Resource
+    reserves: float
+
+
+# Regenerating traits costs a hash, recently used planets are cached
+@functools.lru_cache(maxsize=1 << 16)
+def traits(coordinates: int) -> Traits:
+    digest = hashlib.blake2b(hash_key.pack(seed, coordinates), digest_size=hash_fields.size).digest()
+    name_bytes, u, v, w = hash_fields.unpack(digest)
+    name = "".join([name_letters[byte % len(name_letters)] for byte in name_bytes])
+    u, v, w = u / (1 << 32), v / (1 << 32), w / (1 << 32)
+    resource = sampler.pick(u, v)
+
+    base_resources = (coordinates >> level_shift) * resources_per_lvl
+    return Traits(name, resource, base_resources * (0.15 + 0.85 * w))
+
+
+def coordinates(level: int, position: int) -> int:
+    return (min(max(level, 1), max_level) << level_shift) | (position & ((1 << level_shift) - 1))
+
+
+# A planet found by a captain of <level>, at a random position
+def discover(level: int) -> 'GalaxyPlanet':
+    return GalaxyPlanet(coordinates(level, random.getrandbits(level_shift)))
+
+
+# Same interface as planet.Planet, name, resource and initial reserves come from traits()
+class GalaxyPlanet(utils.Slotted):
+    __slots__ = ("coordinates", "extracted", "last_check", "handle")
+
+    def __init__(self, coordinates: int):
+        self.coordinates = coordinates
+        self.extracted = 0
+        self.last_check = utils.now()
+        self.handle = None
+
+    @property
+    def name(self) -> str:
+        return traits(self.coordinates).name
+
+    @property
+    def resource(self) -> Resource:
+        return traits(self.coordinates).resource
+
+    @property
+    def resource_amount(self) -> float:
+        return traits(self.coordinates).reserves - self.extracted
+
+    @resource_amount.setter
+    def resource_amount(self, amount: float):
+        self.extracted = traits(self.coordinates).reserves - amount
+
+    def set_resource_amount(self, amt):
+        self.resource_amount = amt
+
+    def time_passed(self, now):
+        passed = now - self.last_check
+        self.last_check = now
+        return passed
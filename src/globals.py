@@ -3,7 +3,28 @@ import telebot
 version = "v0.1"
 bot = telebot.TeleBot("1250437591:AAH6edw9aDKW8S8MKKxtj5hdf0OGNn3fCY4", parse_mode=None)
 
-player_storage = {}
-pending_players = []
+# "memory" keeps every player loaded, "sqlite" loads players on demand
+storage_backend = "memory"
+player_cache_size = 10000
 
-storage_changed = False
+# How the "memory" backend writes full snapshots, see journal.snapshot_modes
+snapshot_mode = "fork"
+
+# "objects" keeps every planet as an object, "array" keeps a player's planets in columns and drills them
+#   with NumPy when it's installed, see planet_array.py. Planets of the galaxy are stored in full then
+planet_layout = "objects"
+
+# Worker processes players are split across by uid, see shards.py; 1 runs everything in this process
+shards = 1
+
+# Prometheus-format metrics are written here on every backup if set
+metrics_file = None
+
+player_storage = None
+scheduler = None
+leaderboards = None
+market = None
+delivery = None
+# shards.Shard in a worker process, shards.Dispatcher in the front process of a sharded run
+shard = None
+dispatcher = None
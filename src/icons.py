@@ -16,3 +16,5 @@ upgrade = "🌟"
 hp = "❤"
 atk = "🔥"
 defense = "🛡️"
+leaderboard = "🏆"
+market = "🏪"
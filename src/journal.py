@@ -0,0 +1,233 @@
+import os
+import glob
+import pickle
+import struct
+import time
+import threading
+import contextlib
+import utils
+import codec
+import metrics
+import snapshot
+
+# Every journal record is length-prefixed, the uid followed by the player's codec record.
+# Journals written before that hold pickles of (uid, player) instead
+record_header = struct.Struct(">I")
+record_uid = struct.Struct(">q")
+
+snapshot_duration = metrics.histogram("snapshot_duration_seconds", "Time to write a full player snapshot")
+snapshot_pause = metrics.histogram("snapshot_pause_seconds", "Longest time command handling was blocked by a snapshot")
+
+# "fork" serializes the snapshot in a child process working on a copy-on-write view of the players,
+#   "copy" (and platforms without fork) copies players one at a time under their own lock instead
+snapshot_modes = ("fork", "copy")
+
+
+# <freeze> is a context manager that keeps every player from being modified, <lock_player>(uid) one that
+#   keeps a single player from being modified; both are needed to serialize players consistently
+class Journal:
+    def __init__(self, snapshot_file: str, compact_size: int = 16 * 1024 * 1024, mode: str = "fork",
+                 freeze=contextlib.nullcontext, lock_player=lambda uid: contextlib.nullcontext()):
+        self.snapshot_file = snapshot_file
+        self.compact_size = compact_size
+        self.mode = mode if hasattr(os, "fork") else "copy"
+        self.freeze = freeze
+        self.lock_player = lock_player
+        self.generation = 0
+        self.journal = None
+        self.lock = threading.Lock()
+        self.compactor = None
+
+    def journal_file(self, generation: int) -> str:
+        return self.snapshot_file + ".journal." + str(generation)
+
+    def journal_generations(self):
+        generations = []
+        for file in glob.glob(glob.escape(self.snapshot_file) + ".journal.*"):
+            suffix = file.rsplit(".", 1)[1]
+            if suffix.isnumeric():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    # Snapshot is either a binary snapshot.Snapshot or a legacy pickle, a plain dict of players
+    #   or a (generation, players) tuple, where <generation> is the last journal already merged into it
+    def read_snapshot(self):
+        if not os.path.exists(self.snapshot_file) or utils.file_size(self.snapshot_file) == 0:
+            return 0, None, {}
+
+        if snapshot.is_snapshot(self.snapshot_file):
+            reader = snapshot.Snapshot(self.snapshot_file)
+            return reader.generation, reader, {}
+
+        utils.out("Reading legacy pickle snapshot " + self.snapshot_file)
+        with open(self.snapshot_file, "rb") as file:
+            legacy = pickle.load(file)
+
+        if isinstance(legacy, dict):
+            return 0, None, legacy
+        generation, players = legacy
+        for uid, player in players.items():
+            if isinstance(player, bytes):
+                players[uid] = pickle.loads(player)
+        return generation, None, players
+
+    # Returns the snapshot reader (None if there is no binary snapshot) and every player changed since,
+    #   players that are only in the snapshot are decoded on demand
+    def load(self) -> tuple:
+        snapshot_generation, reader, storage = self.read_snapshot()
+        self.generation = snapshot_generation
+
+        for generation in self.journal_generations():
+            if generation <= snapshot_generation:
+                os.remove(self.journal_file(generation))
+                continue
+            self.replay(self.journal_file(generation), storage)
+            self.generation = generation
+
+        self.open_journal(max(self.generation, snapshot_generation + 1))
+        return reader, storage
+
+    # A record cut short by a crash is dropped along with everything after it
+    def replay(self, file_name: str, storage: dict):
+        valid_size = 0
+        with open(file_name, "rb") as file:
+            while True:
+                header = file.read(record_header.size)
+                if len(header) < record_header.size:
+                    break
+                length, = record_header.unpack(header)
+                data = file.read(length)
+                if len(data) < length:
+                    break
+                if data[0] == pickle.PROTO[0]:
+                    uid, player = pickle.loads(data)
+                else:
+                    uid = str(record_uid.unpack_from(data)[0])
+                    player = codec.decode(memoryview(data)[record_uid.size:])
+                storage[uid] = player
+                valid_size = file.tell()
+
+        if valid_size < utils.file_size(file_name):
+            utils.out("Dropping truncated tail of " + file_name)
+            os.truncate(file_name, valid_size)
+
+    def open_journal(self, generation: int):
+        if self.journal is not None:
+            self.journal.close()
+        self.generation = generation
+        self.journal = open(self.journal_file(generation), "ab")
+
+    # Each player is encoded under its own lock, the file is only locked for the write itself.
+    # <before_write>() runs once every player is encoded
+    def append(self, records, before_write=lambda: None) -> int:
+        data = []
+        for uid, player in records:
+            with self.lock_player(uid):
+                data.append(record_uid.pack(int(uid)) + codec.encode(player))
+        before_write()
+
+        written = 0
+        with self.lock:
+            for record in data:
+                self.journal.write(record_header.pack(len(record)))
+                self.journal.write(record)
+                written += record_header.size + len(record)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        return written
+
+    def needs_compaction(self) -> bool:
+        return self.journal.tell() >= self.compact_size and not self.is_compacting()
+
+    def is_compacting(self) -> bool:
+        return self.compactor is not None and self.compactor.is_alive()
+
+    # Start a new journal generation and merge everything before it into the snapshot in the background.
+    # Changes made while the snapshot is written go to the new generation, and replaying them over a player
+    #   state that is already newer is harmless, so each player only has to be serialized consistently.
+    # Players never decoded from the previous snapshot <reader> are copied over as they are
+    def compact_async(self, storage: dict, reader=None):
+        if self.mode == "fork":
+            args = self.fork_snapshot(storage, reader)
+            self.compactor = threading.Thread(target=self.compact, args=args, daemon=True)
+        else:
+            with self.lock:
+                merged_generation = self.generation
+                self.open_journal(merged_generation + 1)
+            args = (merged_generation, storage, reader)
+            self.compactor = threading.Thread(target=self.copy_snapshot, args=args, daemon=True)
+        self.compactor.start()
+
+    # Like Redis BGSAVE: players are only frozen for the fork itself, the child encodes its
+    #   copy-on-write view while the parent keeps handling commands
+    def fork_snapshot(self, storage: dict, reader):
+        start = time.perf_counter()
+        with self.freeze():
+            with self.lock:
+                merged_generation = self.generation
+                self.open_journal(merged_generation + 1)
+            pid = os.fork()
+            if pid == 0:
+                self.write_child(merged_generation, storage, reader)
+            paused = time.perf_counter() - start
+        return merged_generation, start, paused, pid
+
+    # Runs in the forked child, where only this thread exists and locks held by other threads
+    #   (stdout, metrics) may never be released, so it only touches the snapshot file
+    def write_child(self, merged_generation: int, storage: dict, reader):
+        status = 0
+        try:
+            records = ((uid, player.next_wakeup(), player.rank_scores(), codec.encode(player))
+                       for uid, player in storage.items())
+            self.write_snapshot(merged_generation, records, storage, reader)
+        except BaseException as e:
+            os.write(2, ("Snapshot failed: " + repr(e) + "\n").encode())
+            status = 1
+        os._exit(status)
+
+    def copy_snapshot(self, merged_generation: int, storage: dict, reader):
+        start = time.perf_counter()
+        paused = 0
+        records = []
+        players = list(storage.items())
+        for uid, player in players:
+            copy_start = time.perf_counter()
+            with self.lock_player(uid):
+                records.append((uid, player.next_wakeup(), player.rank_scores(), codec.encode(player)))
+            paused = max(paused, time.perf_counter() - copy_start)
+
+        self.write_snapshot(merged_generation, records, dict(players), reader)
+        self.compact(merged_generation, start, paused)
+
+    def write_snapshot(self, merged_generation: int, records, decoded: dict, reader):
+        def all_records():
+            yield from records
+            if reader is not None:
+                for uid, due, scores, record in reader.records():
+                    if uid not in decoded:
+                        yield uid, due, scores, record
+
+        utils.write_atomic(self.snapshot_file, lambda file: snapshot.write(file, merged_generation, all_records()))
+
+    def compact(self, merged_generation: int, start: float, paused: float, pid: int = None):
+        if pid is not None:
+            pid, status = os.waitpid(pid, 0)
+            if os.waitstatus_to_exitcode(status) != 0:
+                utils.out("Snapshot child failed, keeping the journals")
+                return
+
+        for generation in self.journal_generations():
+            if generation <= merged_generation:
+                os.remove(self.journal_file(generation))
+
+        duration = time.perf_counter() - start
+        snapshot_duration.observe(duration)
+        snapshot_pause.observe(paused)
+        utils.out("Snapshot written (" + self.mode + ") in " + metrics.ms_str(duration) + ", commands paused for " +
+                  metrics.ms_str(paused))
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            self.journal.close()
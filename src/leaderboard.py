@@ -0,0 +1,243 @@
+import time
+import bisect
+import threading
+import traceback
+import icons
+import utils
+
+
+# Sorted keys kept in buckets of up to 2 * <bucket_size>, along with a Fenwick tree over the bucket lengths.
+# A key is found with a bisect over the bucket maxima and one within its bucket and its position comes
+#   from the tree, so rank and n-th lookups are O(log n); adding and removing a key also moves the rest
+#   of its bucket, which is a memmove of a few hundred pointers
+class RankedList:
+    bucket_size = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.buckets = [keys[i:i + self.bucket_size] for i in range(0, len(keys), self.bucket_size)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(keys)
+        self.tree = []
+        self.rebuild_tree()
+
+    def __len__(self):
+        return self.size
+
+    def rebuild_tree(self):
+        tree = [len(bucket) for bucket in self.buckets]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def tree_add(self, i: int, delta: int):
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i |= i + 1
+
+    # Keys in the buckets before bucket <i>
+    def prefix(self, i: int) -> int:
+        total = 0
+        while i > 0:
+            total += self.tree[i - 1]
+            i &= i - 1
+        return total
+
+    # (bucket, index in it) of the key at <position>
+    def locate(self, position: int) -> tuple:
+        i = 0
+        step = 1 << (len(self.tree).bit_length() - 1) if self.tree else 0
+        while step:
+            if i + step <= len(self.tree) and self.tree[i + step - 1] <= position:
+                i += step
+                position -= self.tree[i - 1]
+            step >>= 1
+        return i, position
+
+    def add(self, key):
+        self.size += 1
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            self.rebuild_tree()
+            return
+
+        b = min(bisect.bisect_left(self.maxes, key), len(self.buckets) - 1)
+        bucket = self.buckets[b]
+        bisect.insort(bucket, key)
+        self.maxes[b] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            half = len(bucket) // 2
+            self.buckets[b:b + 1] = [bucket[:half], bucket[half:]]
+            self.maxes[b:b + 1] = [bucket[half - 1], bucket[-1]]
+            self.rebuild_tree()
+        else:
+            self.tree_add(b, 1)
+
+    def remove(self, key):
+        b = bisect.bisect_left(self.maxes, key)
+        bucket = self.buckets[b] if b < len(self.buckets) else []
+        i = bisect.bisect_left(bucket, key)
+        if i == len(bucket) or bucket[i] != key:
+            raise KeyError(key)
+
+        del bucket[i]
+        self.size -= 1
+        if bucket:
+            self.maxes[b] = bucket[-1]
+            self.tree_add(b, -1)
+        else:
+            del self.buckets[b]
+            del self.maxes[b]
+            self.rebuild_tree()
+
+    # Number of keys lower than <key>
+    def rank(self, key) -> int:
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.buckets):
+            return self.size
+        return self.prefix(b) + bisect.bisect_left(self.buckets[b], key)
+
+    # Up to <count> keys from <start> on, in order
+    def slice(self, start: int, count: int) -> list:
+        if start >= self.size:
+            return []
+        b, i = self.locate(start)
+        keys = []
+        while len(keys) < count and b < len(self.buckets):
+            keys += self.buckets[b][i:i + count - len(keys)]
+            b += 1
+            i = 0
+        return keys
+
+
+# Scores are Player.rank_scores(): (level, exp, credits, planets)
+boards = {
+    "level": lambda scores: (-scores[0], -scores[1]),
+    "credits": lambda scores: (-scores[2],),
+    "planets": lambda scores: (-scores[3],),
+}
+titles = {"level": "Level", "credits": "Credits", "planets": "Planets"}
+not_ready = icons.leaderboard + " The leaderboards are still being put together, try again in a minute."
+
+
+# Keys sort best first: the negated scores, ties go to the lower uid
+def board_key(board: str, uid, scores: tuple) -> tuple:
+    return boards[board](scores) + (int(uid),)
+
+
+# Every player's rank on each board, kept up to date as players are saved, so neither top lists nor
+#   a player's own rank ever look at more than O(log n) entries.
+# Sorting a million players takes seconds, so at startup they are built in the background and updates
+#   made in the meantime are applied once that's done; until then the boards aren't ready.
+# Names come with the updates, a player on a top list that hasn't been saved since the start gets theirs
+#   from <name_of>(uid) once, names don't change
+class Leaderboards:
+    def __init__(self, ranks=(), name_of=None):
+        self.lock = threading.Lock()
+        self.pending = None
+        self.names = {}
+        self.name_of = name_of
+        self.build(ranks)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def build(self, ranks):
+        scores = dict(ranks)
+        lists = {board: RankedList(board_key(board, uid, values) for uid, values in scores.items())
+                 for board in boards}
+        with self.lock:
+            self.scores = scores
+            self.lists = lists
+            pending, self.pending = self.pending, None
+            for uid, (values, name) in (pending or {}).items():
+                self.apply(uid, values, name)
+
+    # <ranks> yields (uid, scores) of every player, like the player storage's ranks()
+    def build_async(self, ranks):
+        self.pending = {}
+        thread = threading.Thread(target=self.build_logged, args=(ranks,), daemon=True)
+        thread.start()
+        return thread
+
+    def build_logged(self, ranks):
+        start = time.perf_counter()
+        try:
+            self.build(ranks)
+        except Exception:
+            traceback.print_exc()
+            return
+        utils.out("Leaderboards of " + str(len(self)) + " players built in " +
+                  utils.round_str(time.perf_counter() - start) + " s")
+
+    def update(self, uid: str, scores: tuple, name: str = None):
+        with self.lock:
+            if self.pending is not None:
+                self.pending[uid] = (scores, name)
+            else:
+                self.apply(uid, scores, name)
+
+    def apply(self, uid: str, scores: tuple, name: str = None):
+        if name is not None:
+            self.names[uid] = name
+        old = self.scores.get(uid)
+        if old == scores:
+            return
+        self.scores[uid] = scores
+        for board, ranked in self.lists.items():
+            key = board_key(board, uid, scores)
+            if old is not None:
+                old_key = board_key(board, uid, old)
+                if old_key == key:
+                    continue
+                ranked.remove(old_key)
+            ranked.add(key)
+
+    # The first <count> (key, name, scores) on <board>, how many players are ahead of <key> and how many
+    #   there are in total, so the answers of several shards can be merged; None while not ready
+    def query(self, board: str, key: tuple, count: int):
+        with self.lock:
+            if self.pending is not None:
+                return None
+            ranked = self.lists[board]
+            top = [(entry, str(entry[-1]), self.scores[str(entry[-1])]) for entry in ranked.slice(0, count)]
+            names = [self.names.get(uid) for entry, uid, scores in top]
+            ahead, total = ranked.rank(key), len(ranked)
+
+        named = []
+        for (entry, uid, scores), name in zip(top, names):
+            if name is None:
+                name = self.look_up_name(uid)
+            named.append((entry, name, scores))
+        return named, ahead, total
+
+    def look_up_name(self, uid: str) -> str:
+        name = self.name_of(uid) if self.name_of is not None else None
+        if name is None:
+            return uid
+        with self.lock:
+            return self.names.setdefault(uid, name)
+
+
+def score_str(board: str, scores: tuple) -> str:
+    if board == "level":
+        return "level " + str(scores[0]) + " (" + str(scores[1]) + " exp)"
+    if board == "credits":
+        return icons.money + " " + utils.round_str(scores[2])
+    return icons.planet + " " + str(scores[3]) + " planets"
+
+
+# <top> are (key, name, scores) sorted best first, <rank> is the player's own 1-based rank
+def format_board(board: str, top: list, rank: int, total: int, scores: tuple) -> str:
+    msg = icons.leaderboard + " Leaderboard: " + titles[board] + "\n\n"
+    for position, (key, name, entry_scores) in enumerate(top):
+        msg += str(position + 1) + ". " + name + " - " + score_str(board, entry_scores) + "\n"
+    if not top:
+        msg += "Nobody is on this leaderboard yet.\n"
+
+    msg += "\nYou are #" + str(rank) + " of " + str(max(total, rank)) + " with " + score_str(board, scores) + "\n\n"
+    msg += " ".join("/leaderboard_" + other for other in boards if other != board)
+    return msg
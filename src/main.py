@@ -1,24 +1,70 @@
 import math
+import time
+import contextvars
 import player as plr
 import storage_utils
 import globals as game
 import utils
+import metrics
+import shards
+import leaderboard
 from resource import Resource
+from market import Side
+from runtime import Runtime
+from outbox import Outbox
+from delivery import Delivery, Broadcast, resume_broadcast, join_broadcast, broadcast_started, broadcast_busy
 
 admin_ids = [46010798]
 
-player: plr.Player
+# Player whose message is being handled, scoped to the current request
+current_player = contextvars.ContextVar("current_player")
+
+command_names = {"profile", "find_planet", "find_planet_all", "patrol", "check_progress", "show_cargo", "shop",
+                 "celestial_database", "buy_shuttle", "upgrade_cargo", "upgrade_celestial_database", "sell", "stats",
+                 "leaderboard", "market", "bid", "ask", "cancel", "broadcast", "restart", "hard_restart", "stop"}
+command_latency = metrics.histogram_family("command_latency_seconds", "Time to handle a command", "command")
 
 
 def handle_admin_command(command):
+    player = current_player.get()
+
+    if command == "stats":
+        if game.shard is not None:
+            game.shard.stats(player.id)
+        else:
+            player.notify(metrics.summary())
+        return True
     if command == "restart":
         restart()
+    if command == "hard_restart":
+        restart("hard_restart")
     if command == "stop":
         stop()
+    if command.startswith("broadcast "):
+        broadcast(command.split(" ", 1)[1])
+        return True
+    return False
 
 
 def handle_arg_command(command, args):
-    global player
+    player = current_player.get()
+
+    if command in ("bid", "ask"):
+        if len(args) != 3 or args[0] not in Resource.__members__ or not args[1].isnumeric():
+            return
+        try:
+            price = float(args[2])
+        except ValueError:
+            return
+        if math.isfinite(price):
+            side = Side.BUY if command == "bid" else Side.SELL
+            game.market.place(player, side, Resource[args[0]], int(args[1]), price)
+
+    if command == "cancel" and args and args[0].isnumeric():
+        game.market.cancel(player, int(args[0]))
+
+    if command == "market" and args and args[0] in Resource.__members__:
+        game.market.view_book(player, Resource[args[0]])
 
     if command == "sell":
         resource = Resource[args[0]]
@@ -31,7 +77,7 @@ def handle_arg_command(command, args):
 
 
 def handle_upgrade_command(command):
-    global player
+    player = current_player.get()
 
     if command == "celestial_database":
         player.upgrade(player.planet_container)
@@ -41,10 +87,28 @@ def handle_upgrade_command(command):
 
 
 def handle_command(command):
-    global player
+    with metrics.Timer(command_latency.labels(command_label(command))):
+        perform_command(command)
 
-    if player.id in admin_ids:
-        handle_admin_command(command)
+
+# Known commands are measured separately, /find_planet_N along with /find_planet and everything
+#   else with arguments by its first word
+def command_label(command):
+    if command in command_names:
+        return command
+    if command.startswith("find_planet_"):
+        return "find_planet"
+    name = command.split(" ")[0].split("_")[0]
+    return name if name in command_names else "other"
+
+
+def perform_command(command):
+    player = current_player.get()
+
+    if player.id in admin_ids and handle_admin_command(command):
+        return
+
+    game.market.settle(player)
 
     if command == "profile":
         player.show_profile()
@@ -52,6 +116,17 @@ def handle_command(command):
     elif command == "find_planet":
         player.start_timed_action(plr.Action.PLANET_SEARCH)
 
+    elif command == "find_planet_all":
+        player.start_timed_action(plr.Action.PLANET_SEARCH, None)
+
+    elif command.startswith("find_planet_"):
+        count = command.rsplit("_", 1)[1]
+        if count.isnumeric() and int(count) > 0:
+            player.start_timed_action(plr.Action.PLANET_SEARCH, int(count))
+
+    elif command == "patrol":
+        player.start_timed_action(plr.Action.PATROL)
+
     elif command == "check_progress":
         player.check_progress(True)
 
@@ -67,6 +142,17 @@ def handle_command(command):
     elif command == "buy_shuttle":
         player.buy_shuttle()
 
+    elif command == "market":
+        game.market.view(player)
+
+    elif command == "leaderboard":
+        show_leaderboard("level")
+
+    elif command.startswith("leaderboard_"):
+        board = command.split("_", 1)[1]
+        if board in leaderboard.boards:
+            show_leaderboard(board)
+
     elif "upgrade" in command:
         handle_upgrade_command(command.split("_", 1)[1])
 
@@ -77,48 +163,139 @@ def handle_command(command):
     storage_utils.save_player(player)
 
 
-@game.bot.message_handler(func=lambda m: True)
 def handle_input(message):
-    global player
     user_data = message.from_user
-    init_context(user_data.id, user_data.username)
+    with Outbox(), storage_utils.player_lock(user_data.id):
+        player = init_context(user_data.id, user_data.username)
+
+        if "/" in message.text:
+            handle_command(message.text[1:])
+        else:
+            player.notify("Unknown command")
+
+    if start_time is not None:
+        log_first_response()
 
-    if "/" in message.text:
-        handle_command(message.text[1:])
+
+leaderboard_size = 10
+
+
+def show_leaderboard(board):
+    player = current_player.get()
+    scores = player.rank_scores()
+    key = leaderboard.board_key(board, player.id, scores)
+    if game.shard is not None:
+        game.shard.leaderboard(player.id, board, key, scores, leaderboard_size)
         return
 
-    game.bot.send_message(player.id, "Unknown command")
+    answer = leaderboard_query(board, key, leaderboard_size)
+    if answer is None:
+        player.notify(leaderboard.not_ready)
+        return
+    top, ahead, total = answer
+    player.notify(leaderboard.format_board(board, top, ahead + 1, total, scores))
+
+
+# The top of <board> with player names, how many players are ahead of <key> and how many are ranked,
+#   what every shard answers in a sharded run; None while the leaderboards are being built
+def leaderboard_query(board, key, count):
+    return game.leaderboards.query(board, key, count)
 
 
 def init_context(uid, player_name):
-    global player
     player = storage_utils.load_player(uid)
 
     if player is None:
         player = plr.Player(uid, player_name)
 
-
-def shutdown():
-    storage_utils.backup_daemon.cancel()
-    storage_utils.timed_task_daemon.cancel()
-    storage_utils.write_all()
+    current_player.set(player)
+    return player
 
 
-def restart():
-    shutdown()
-    game.bot.send_message(player.id, "We do be restarting tha bot...")
-    raise Exception("restart")
+# Handlers only ask for a restart or stop, run() shuts everything down once the runtime has finished
+#   and the watchdog decides what to do next
+def restart(reason="restart"):
+    player = current_player.get()
+    player.notify("We do be restarting tha bot...")
+    raise Exception(reason)
 
 
 def stop():
-    shutdown()
-    game.bot.send_message(player.id, "Stopping... Good night!")
+    player = current_player.get()
+    player.notify("Stopping... Good night!")
     raise Exception("stop")
 
 
-for id in admin_ids:
-    game.bot.send_message(id, "bot started!")
+def broadcast(text):
+    player = current_player.get()
+    if game.shard is not None:
+        game.shard.broadcast(player.id, text)
+    elif Broadcast(game.delivery, text, game.player_storage.uids()).start():
+        player.notify(broadcast_started)
+    else:
+        player.notify(broadcast_busy)
+
+
+start_time = None
+first_response_time = metrics.histogram("first_response_seconds", "Time from (re)start to the first handled command",
+                                        buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 3600))
 
-utils.out("Running & listening for updates...")
 
-game.bot.polling()
+def log_first_response():
+    global start_time
+    started = start_time
+    start_time = None
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        first_response_time.observe(elapsed)
+        utils.out("First response " + utils.round_str(elapsed) + " s after start")
+
+
+def run(started: float = None):
+    global start_time
+    start_time = started if started is not None else time.perf_counter()
+    if game.shards > 1:
+        game.dispatcher = shards.Dispatcher(game.shards)
+        game.dispatcher.start()
+        handler = dispatch_input
+    else:
+        storage_utils.start()
+        handler = handle_input
+    game.delivery = Delivery(game.bot)
+    game.delivery.start()
+    resume_broadcast(game.delivery)
+
+    for id in admin_ids:
+        game.bot.send_message(id, "bot started!")
+
+    utils.out("Running & listening for updates... (ready in " +
+              utils.round_str(time.perf_counter() - start_time) + " s)")
+    runtime = Runtime(game.bot, handler)
+    if game.dispatcher is not None:
+        game.dispatcher.on_stop = runtime.stop
+    try:
+        runtime.run()
+    finally:
+        shutdown()
+
+
+# Front process of a sharded run, the shard owning the user handles the message
+def dispatch_input(message):
+    game.dispatcher.dispatch(message)
+    if start_time is not None:
+        log_first_response()
+
+
+def shutdown():
+    if game.dispatcher is not None:
+        game.dispatcher.stop()
+        game.dispatcher = None
+    storage_utils.stop()
+    if game.delivery is not None:
+        game.delivery.stop()
+        join_broadcast()
+        game.delivery = None
+
+
+if __name__ == "__main__":
+    run()
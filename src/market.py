@@ -0,0 +1,416 @@
+import os
+import enum
+import heapq
+import pickle
+import threading
+import utils
+import icons
+import strings
+from resource import Resource
+
+
+class Side(enum.Enum):
+    BUY = 0
+    SELL = 1
+
+
+# A limit order for whole kg of a resource at a price per kg, <quantity> is what's left of it
+class Order(utils.Slotted):
+    __slots__ = ("id", "uid", "resource", "side", "price", "quantity", "placed")
+
+    def __init__(self, id: int, uid: str, resource: Resource, side: Side, price: float, quantity: int):
+        self.id = id
+        self.uid = uid
+        self.resource = resource
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.placed = utils.now()
+
+    # Best first: lowest asks and highest bids, older orders first at the same price
+    def priority(self) -> tuple:
+        return (self.price if self.side == Side.SELL else -self.price), self.id
+
+    def crosses(self, resting) -> bool:
+        return resting.price <= self.price if self.side == Side.BUY else resting.price >= self.price
+
+
+def opposite(side: Side) -> Side:
+    return Side.SELL if side == Side.BUY else Side.BUY
+
+
+# Bids and asks of one resource, each a heap of (priority, order). Filled and cancelled orders are
+#   left in the heaps with nothing left of them and dropped once they come up, or all at once when they
+#   make up more than half of their heap
+class OrderBook:
+    def __init__(self, resource: Resource):
+        self.resource = resource
+        self.heaps = {Side.BUY: [], Side.SELL: []}
+        self.dead = {Side.BUY: 0, Side.SELL: 0}
+
+    def add(self, order: Order):
+        heapq.heappush(self.heaps[order.side], (order.priority(), order))
+
+    def cancel(self, order: Order):
+        order.quantity = 0
+        self.died(order.side)
+
+    def died(self, side: Side):
+        self.dead[side] += 1
+        heap = self.heaps[side]
+        if self.dead[side] * 2 > len(heap):
+            heap[:] = [entry for entry in heap if entry[1].quantity > 0]
+            heapq.heapify(heap)
+            self.dead[side] = 0
+
+    # Rebuilding from a list of orders is linear instead of one push each
+    def load(self, orders: list):
+        for side, heap in self.heaps.items():
+            heap.extend((order.priority(), order) for order in orders if order.side == side)
+            heapq.heapify(heap)
+
+    def best(self, side: Side) -> Order:
+        heap = self.heaps[side]
+        while heap and heap[0][1].quantity <= 0:
+            heapq.heappop(heap)
+            self.dead[side] -= 1
+        return heap[0][1] if heap else None
+
+    # Fills <order> against the other side in price-time priority as far as its limit allows, at the prices
+    #   of the resting orders; returns (resting order, quantity, price) of every fill
+    def match(self, order: Order) -> list:
+        fills = []
+        other = opposite(order.side)
+        while order.quantity > 0:
+            resting = self.best(other)
+            if resting is None or not order.crosses(resting):
+                break
+            quantity = min(order.quantity, resting.quantity)
+            order.quantity -= quantity
+            resting.quantity -= quantity
+            fills.append((resting, quantity, resting.price))
+            if resting.quantity == 0:
+                self.died(other)
+        return fills
+
+    # (price, total quantity) of the best <levels> prices on <side>, walking the heap best first
+    #   without popping it, so it only looks at the entries it returns and their children
+    def depth(self, side: Side, levels: int) -> list:
+        heap = self.heaps[side]
+        frontier = [(heap[0], 0)] if heap else []
+        result = []
+        while frontier and len(result) <= levels:
+            (priority, order), i = heapq.heappop(frontier)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if order.quantity <= 0:
+                continue
+            if result and result[-1][0] == order.price:
+                result[-1][1] += order.quantity
+            else:
+                result.append([order.price, order.quantity])
+        return [tuple(level) for level in result[:levels]]
+
+
+# What the market owes a player: credits, resources, and the fills to tell them about
+class Settlement(utils.Slotted):
+    __slots__ = ("credits", "goods", "fills")
+
+    def __init__(self):
+        self.credits = 0
+        self.goods = {}
+        self.fills = []
+
+    def add_goods(self, resource: Resource, quantity: float):
+        self.goods[resource] = self.goods.get(resource, 0) + quantity
+
+
+# Player-to-player exchange. Placing an order takes its credits or resources from the player right away,
+#   so the book only ever holds what's already paid for and matching never touches another player.
+# Whatever a fill owes the owner of a resting order goes into their settlement and is handed over under
+#   their own player lock, by the timed task daemon (<on_settlement>(uid) asks for that) or by their
+#   next command. Orders and settlements are written to <file> along with every backup.
+# Players are saved separately, so every operation that changes a player (placing an order and settling)
+#   also counts up their market_seq and goes into <ledger> as (seq, credits, goods) until the player has
+#   been written with it. The market is encoded after the players of a backup and written before them,
+#   so on disk it's never behind any player, and reconcile() applies whatever a player missed after a crash
+class Market:
+    def __init__(self, file: str, on_settlement=lambda uid: None):
+        self.file = file
+        self.on_settlement = on_settlement
+        self.lock = threading.Lock()
+        self.books = {resource: OrderBook(resource) for resource in Resource}
+        self.orders = {}
+        self.player_orders = {}
+        self.settlements = {}
+        self.ledger = {}
+        self.next_id = 1
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.file):
+            return
+        with open(self.file, "rb") as file:
+            state = pickle.load(file)
+        self.next_id, orders, self.settlements = state[:3]
+        self.ledger = state[3] if len(state) > 3 else {}
+        for order in orders:
+            self.index(order)
+        for resource, book in self.books.items():
+            book.load([order for order in orders if order.resource == resource])
+
+    # Orders are pickled under the lock, so the file always holds one consistent state of the market
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            data = pickle.dumps((self.next_id, list(self.orders.values()), self.settlements, self.ledger))
+            self.changed = False
+        utils.write_atomic(self.file, lambda file: file.write(data))
+
+    # market_seq of every player in the ledger, read under their lock before a backup so each of them is
+    #   either written by it or already was; confirm() then drops what they have on disk
+    def ledger_seqs(self, lock_player, load_player) -> dict:
+        with self.lock:
+            uids = list(self.ledger.keys())
+        seqs = {}
+        for uid in uids:
+            with lock_player(uid):
+                player = load_player(uid)
+                if player is not None:
+                    seqs[uid] = player.market_seq
+        return seqs
+
+    def confirm(self, seqs: dict):
+        with self.lock:
+            for uid, seq in seqs.items():
+                entries = [entry for entry in self.ledger.get(uid, ()) if entry[0] > seq]
+                if entries:
+                    self.ledger[uid] = entries
+                else:
+                    self.ledger.pop(uid, None)
+                self.changed = True
+
+    # Call with the player's lock and the market lock held, right where the player is changed
+    def record(self, player, credits: float, goods: dict):
+        player.market_seq += 1
+        player.mark_changed()
+        self.ledger.setdefault(str(player.id), []).append((player.market_seq, credits, goods))
+
+    # After loading: applies to each player the operations the market has on disk but the player doesn't,
+    #   the caller saves the players that returns
+    def reconcile(self, player) -> bool:
+        uid = str(player.id)
+        with self.lock:
+            missed = [entry for entry in self.ledger.get(uid, ()) if entry[0] > player.market_seq]
+            for seq, credits, goods in missed:
+                player.money += credits
+                for resource, quantity in goods.items():
+                    if quantity < 0:
+                        player.cargo.remove(resource, min(-quantity, player.cargo.get(resource)))
+                    else:
+                        overflow = player.cargo.put(resource, quantity)
+                        if overflow > 0:
+                            self.settlement(uid).add_goods(resource, overflow)
+                player.market_seq = seq
+                player.mark_changed()
+            if missed:
+                self.changed = True
+        return bool(missed)
+
+    def index(self, order: Order):
+        self.orders[order.id] = order
+        self.player_orders.setdefault(order.uid, set()).add(order.id)
+
+    def drop(self, order: Order):
+        del self.orders[order.id]
+        ids = self.player_orders[order.uid]
+        ids.discard(order.id)
+        if not ids:
+            del self.player_orders[order.uid]
+
+    def settlement(self, uid: str) -> Settlement:
+        settlement = self.settlements.get(uid)
+        if settlement is None:
+            settlement = self.settlements[uid] = Settlement()
+        return settlement
+
+    def pending_settlements(self) -> list:
+        with self.lock:
+            return list(self.settlements.keys())
+
+    def place(self, player, side: Side, resource: Resource, quantity: int, price: float):
+        uid = str(player.id)
+        price = round(price, 2)
+        if quantity < 1 or price <= 0:
+            return
+
+        if side == Side.BUY:
+            cost = quantity * price
+            if player.money < cost:
+                player.notify("You don't have enough credits to buy " + str(quantity) + " kg of " + resource.name +
+                              " at " + icons.money + utils.round_str(price) + " per kg!")
+                return
+        elif not player.cargo.contains(resource, quantity):
+            player.notify("You don't have this quantity of " + resource.name + " in your cargo bay!")
+            return
+
+        makers = set()
+        with self.lock:
+            if side == Side.BUY:
+                player.money -= cost
+                self.record(player, -cost, {})
+            else:
+                player.cargo.remove(resource, quantity)
+                self.record(player, 0, {resource: -quantity})
+            order = Order(self.next_id, uid, resource, side, price, quantity)
+            self.next_id += 1
+            fills = self.books[resource].match(order)
+            for resting, filled, fill_price in fills:
+                self.settle_fill(resting, filled, fill_price, resting.price)
+                self.settle_fill(order, filled, fill_price, price)
+                if resting.quantity == 0:
+                    self.drop(resting)
+                if resting.uid != uid:
+                    makers.add(resting.uid)
+            if order.quantity > 0:
+                self.index(order)
+                self.books[resource].add(order)
+            self.changed = True
+
+        for maker in makers:
+            self.on_settlement(maker)
+
+        msg = (icons.market + " Order #" + str(order.id) + ": " + side.name.lower() + " " + str(quantity) + " kg of " +
+               resource.name + " at " + icons.money + utils.round_str(price) + " per kg")
+        if order.quantity > 0:
+            msg += ("\n" + str(order.quantity) + " kg waiting in the order book" + strings.tab +
+                    "/cancel_" + str(order.id))
+        player.notify(msg)
+        self.settle(player)
+
+    # <limit> is the price credits were escrowed at, a buyer filled at a better price gets the difference back
+    def settle_fill(self, order: Order, quantity: int, price: float, limit: float):
+        settlement = self.settlement(order.uid)
+        if order.side == Side.BUY:
+            settlement.add_goods(order.resource, quantity)
+            settlement.credits += (limit - price) * quantity
+        else:
+            settlement.credits += price * quantity
+        settlement.fills.append((order.side, order.resource, quantity, price))
+
+    def cancel(self, player, id: int):
+        uid = str(player.id)
+        with self.lock:
+            order = self.orders.get(id)
+            if order is None or order.uid != uid:
+                player.notify("You don't have an order #" + str(id) + "!")
+                return
+
+            settlement = self.settlement(uid)
+            if order.side == Side.BUY:
+                settlement.credits += order.price * order.quantity
+            else:
+                settlement.add_goods(order.resource, order.quantity)
+            self.drop(order)
+            self.books[order.resource].cancel(order)
+            self.changed = True
+
+        player.notify(icons.market + " Order #" + str(id) + " cancelled.")
+        self.settle(player)
+
+    # Hands over everything the market owes <player> in one message, the caller holds their player lock.
+    # Resources that don't fit in the cargo bay stay with the market until the player has room
+    def settle(self, player):
+        uid = str(player.id)
+        delivered = False
+        waiting = {}
+        with self.lock:
+            settlement = self.settlements.pop(uid, None)
+            if settlement is None:
+                return
+            self.changed = True
+
+            goods = {}
+            for resource, quantity in settlement.goods.items():
+                overflow = player.cargo.put(resource, quantity)
+                delivered = delivered or overflow < quantity
+                if overflow > 0:
+                    waiting[resource] = overflow
+                if overflow < quantity:
+                    goods[resource] = quantity - overflow
+            if waiting:
+                held = self.settlement(uid)
+                for resource, quantity in waiting.items():
+                    held.add_goods(resource, quantity)
+            if settlement.credits > 0:
+                player.money += settlement.credits
+            if settlement.credits > 0 or goods:
+                self.record(player, max(settlement.credits, 0), goods)
+
+        msg = ""
+        if settlement.fills:
+            msg += icons.market + " Market:\n"
+            for side, resource, quantity, price in settlement.fills:
+                msg += (icons.bulletpoint + " " + ("Bought " if side == Side.BUY else "Sold ") + str(quantity) +
+                        " kg of " + resource.name + " at " + icons.money + utils.round_str(price) + "\n")
+
+        if settlement.credits > 0:
+            msg += icons.money + " You receive +" + utils.round_str(settlement.credits) + " credits.\n"
+
+        if waiting:
+            if delivered or settlement.fills:
+                msg += (icons.box + " Your cargo bay is full, " +
+                        ", ".join(utils.round_str(quantity) + " kg of " + resource.name
+                                  for resource, quantity in waiting.items()) +
+                        " will wait at the market until there's room.\n")
+
+        if msg:
+            player.notify(msg.rstrip("\n"))
+
+    def view(self, player):
+        uid = str(player.id)
+        msg = icons.market + " Market\n\n"
+        with self.lock:
+            quotes = []
+            for resource, book in self.books.items():
+                bid, ask = book.best(Side.BUY), book.best(Side.SELL)
+                if bid is not None or ask is not None:
+                    quotes.append((resource, bid, ask))
+            orders = sorted((self.orders[id] for id in self.player_orders.get(uid, ())), key=lambda order: order.id)
+
+        for resource, bid, ask in quotes:
+            msg += (icons.bulletpoint + " " + resource.name + ": bid " + price_str(bid) + ", ask " + price_str(ask) +
+                    strings.tab + "/market_" + resource.name + "\n")
+        if not quotes:
+            msg += "Nobody is trading right now.\n"
+
+        if orders:
+            msg += "\nYour orders:\n"
+            for order in orders:
+                msg += (icons.bulletpoint + " #" + str(order.id) + " " + order.side.name.lower() + " " +
+                        str(order.quantity) + " kg of " + order.resource.name + " at " + icons.money +
+                        utils.round_str(order.price) + strings.tab + "/cancel_" + str(order.id) + "\n")
+
+        msg += "\nTo place an order: /bid_<resource>_<kg>_<price> or /ask_<resource>_<kg>_<price>"
+        player.notify(msg)
+
+    def view_book(self, player, resource: Resource, levels: int = 5):
+        with self.lock:
+            asks = self.books[resource].depth(Side.SELL, levels)
+            bids = self.books[resource].depth(Side.BUY, levels)
+
+        msg = icons.market + " " + resource.name + " order book\n\nAsks:\n"
+        for price, quantity in reversed(asks):
+            msg += icons.bulletpoint + " " + str(quantity) + " kg at " + icons.money + utils.round_str(price) + "\n"
+        msg += "Bids:\n"
+        for price, quantity in bids:
+            msg += icons.bulletpoint + " " + str(quantity) + " kg at " + icons.money + utils.round_str(price) + "\n"
+        msg += "\nNPC price: " + icons.money + utils.round_str(resource.value.price) + " per kg"
+        player.notify(msg)
+
+
+def price_str(order: Order) -> str:
+    return "-" if order is None else icons.money + utils.round_str(order.price)
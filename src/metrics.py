@@ -0,0 +1,192 @@
+import time
+import bisect
+import threading
+import utils
+import strings
+
+# Lightweight in-process instrumentation: counters, gauges and fixed-bucket histograms,
+#   shown to admins via /stats and optionally dumped to a file in Prometheus text format
+enabled = True
+
+# Histogram bucket upper bounds, in seconds
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+lock = threading.Lock()
+registry = {}
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        if enabled:
+            with lock:
+                self.value += amount
+
+    def prometheus(self, labels: str = "") -> list:
+        return [self.name + labels + " " + str(self.value)]
+
+    def summary(self) -> str:
+        return utils.round_str(self.value)
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def get(self):
+        try:
+            return self.function()
+        except Exception:
+            return 0
+
+    def prometheus(self, labels: str = "") -> list:
+        return [self.name + labels + " " + str(self.get())]
+
+    def summary(self) -> str:
+        return str(self.get())
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    # Upper bound of the bucket the percentile falls into
+    def percentile(self, percent: float) -> float:
+        target = self.count * percent / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and seen > 0:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return 0
+
+    def prometheus(self, labels: str = "") -> list:
+        lines = []
+        cumulative = 0
+        inner = labels[1:-1] + "," if labels else ""
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(self.name + "_bucket{" + inner + "le=\"" + str(bound) + "\"} " + str(cumulative))
+        lines.append(self.name + "_sum" + labels + " " + str(self.sum))
+        lines.append(self.name + "_count" + labels + " " + str(self.count))
+        return lines
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return "no data"
+        return (str(self.count) + " x, avg " + ms_str(self.sum / self.count) + ", p50 <" + ms_str(self.percentile(50)) +
+                ", p99 <" + ms_str(self.percentile(99)))
+
+
+# Metrics of the same kind told apart by one label (e.g. latency per command)
+class Family:
+    def __init__(self, name: str, help: str, label: str, create):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.create = create
+        self.kind = create().kind
+        self.children = {}
+
+    def labels(self, value: str):
+        child = self.children.get(value)
+        if child is None:
+            with lock:
+                child = self.children.setdefault(value, self.create())
+        return child
+
+    def prometheus(self, labels: str = "") -> list:
+        lines = []
+        for value, child in sorted(self.children.items()):
+            lines += child.prometheus("{" + self.label + "=\"" + value + "\"}")
+        return lines
+
+    def summary(self) -> str:
+        return "".join("\n" + strings.tab + value + ": " + child.summary()
+                       for value, child in sorted(self.children.items()))
+
+
+def register(metric):
+    with lock:
+        return registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str) -> Counter:
+    return register(Counter(name, help))
+
+
+def gauge(name: str, help: str, function) -> Gauge:
+    return register(Gauge(name, help, function))
+
+
+def histogram(name: str, help: str, buckets=default_buckets) -> Histogram:
+    return register(Histogram(name, help, buckets))
+
+
+def histogram_family(name: str, help: str, label: str, buckets=default_buckets) -> Family:
+    return register(Family(name, help, label, lambda: Histogram(name, help, buckets)))
+
+
+def counter_family(name: str, help: str, label: str) -> Family:
+    return register(Family(name, help, label, lambda: Counter(name, help)))
+
+
+def ms_str(seconds: float) -> str:
+    return utils.round_str(seconds * 1000) + " ms"
+
+
+def summary() -> str:
+    return "\n".join(metric.name + ": " + metric.summary() for name, metric in sorted(registry.items()))
+
+
+def prometheus() -> str:
+    lines = []
+    for name, metric in sorted(registry.items()):
+        lines.append("# HELP " + name + " " + metric.help)
+        lines.append("# TYPE " + name + " " + metric.kind)
+        lines += metric.prometheus()
+    return "\n".join(lines) + "\n"
+
+
+def dump(file: str):
+    text = prometheus().encode()
+    utils.write_atomic(file, lambda out: out.write(text))
+
+
+class Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
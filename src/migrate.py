@@ -0,0 +1,83 @@
+import sys
+import utils
+import codec
+import shards
+from journal import Journal
+from storage import SQLiteStorage, player_row
+
+# Convert players.dat (snapshot + journal) into an SQLite player database:
+#   python3 migrate.py [players.dat] [players.db]
+# Rewrite players.dat as a binary snapshot of the current schema version, merging its journals
+#   and converting a legacy pickle snapshot:
+#   python3 migrate.py --snapshot [players.dat]
+# Split players.dat into players.0.dat ... players.<count - 1>.dat by uid for a sharded run (globals.shards),
+#   replacing what they held before; players.dat itself is left alone and ignored by sharded runs:
+#   python3 migrate.py --shard <count> [players.dat]
+
+batch_size = 1000
+
+
+# Loads and decodes every player, the caller closes <journal>
+def load_all(journal: Journal) -> dict:
+    utils.out("Loading " + journal.snapshot_file + "...")
+    reader, players = journal.load()
+    if reader is not None:
+        for uid, due, scores, record in reader.records():
+            if uid not in players:
+                players[uid] = codec.decode(record)
+        reader.close()
+    return players
+
+
+def migrate(player_file: str, player_db: str):
+    journal = Journal(player_file)
+    players = load_all(journal)
+    journal.close()
+
+    database = SQLiteStorage(player_db)
+    rows = []
+    for uid, player in players.items():
+        rows.append(player_row(str(uid), player))
+        if len(rows) >= batch_size:
+            database.write_rows(rows)
+            rows = []
+    database.write_rows(rows)
+
+    utils.out("Migrated " + str(len(players)) + " players into " + player_db)
+
+
+def convert(player_file: str):
+    journal = Journal(player_file, mode="copy")
+    players = load_all(journal)
+    journal.compact_async(players)
+    journal.close()
+    utils.out("Converted " + player_file + " to snapshot schema version " + str(codec.schema_version))
+
+
+def shard(count: int, player_file: str):
+    journal = Journal(player_file)
+    players = load_all(journal)
+    journal.close()
+
+    slices = [{} for i in range(count)]
+    for uid, player in players.items():
+        slices[shards.shard_of(uid, count)][uid] = player
+
+    for index, slice in enumerate(slices):
+        shard_journal = Journal(shards.shard_file(player_file, index), mode="copy")
+        reader, replaced = shard_journal.load()
+        if reader is not None:
+            reader.close()
+        shard_journal.compact_async(slice)
+        shard_journal.close()
+        utils.out("Wrote " + str(len(slice)) + " players to " + shard_journal.snapshot_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--snapshot":
+        convert(sys.argv[2] if len(sys.argv) > 2 else "players.dat")
+    elif len(sys.argv) > 2 and sys.argv[1] == "--shard":
+        shard(int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else "players.dat")
+    else:
+        migrate(sys.argv[1] if len(sys.argv) > 1 else "players.dat",
+                sys.argv[2] if len(sys.argv) > 2 else "players.db")
@@ -0,0 +1,77 @@
+import contextvars
+import globals
+from delivery import PRIORITY_REPLY, PRIORITY_BACKGROUND
+
+# Telegram won't accept longer messages
+message_limit = 4096
+separator = "\n\n"
+
+current_outbox = contextvars.ContextVar("current_outbox", default=None)
+
+
+# Collects everything sent to players while handling one command (or one timed task)
+#   and delivers it as one combined message per player on exit
+class Outbox:
+    def __init__(self, priority: int = PRIORITY_REPLY):
+        self.priority = priority
+        self.messages = {}
+        self.token = None
+
+    def add(self, uid: int, msg: str):
+        self.messages.setdefault(uid, []).append(msg)
+
+    def flush(self):
+        messages = self.messages
+        self.messages = {}
+        for uid, msgs in messages.items():
+            for text in combine(msgs):
+                deliver(uid, text, self.priority)
+
+    def __enter__(self):
+        self.token = current_outbox.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        current_outbox.reset(self.token)
+        self.flush()
+
+
+def send(uid: int, msg: str):
+    outbox = current_outbox.get()
+    if outbox is None:
+        deliver(uid, msg, PRIORITY_BACKGROUND)
+    else:
+        outbox.add(uid, msg)
+
+
+# Without a delivery queue running (benchmarks, tools) messages go straight to the bot
+def deliver(uid: int, text: str, priority: int):
+    if globals.delivery is None:
+        globals.bot.send_message(uid, text)
+    else:
+        globals.delivery.send(uid, text, priority)
+
+
+# Join messages, starting a new one only when the next part would go over the length limit
+def combine(msgs) -> list:
+    texts = []
+    text = ""
+    for msg in msgs:
+        while len(msg) > message_limit:
+            if text:
+                texts.append(text)
+                text = ""
+            texts.append(msg[:message_limit])
+            msg = msg[message_limit:]
+
+        if not text:
+            text = msg
+        elif len(text) + len(separator) + len(msg) <= message_limit:
+            text += separator + msg
+        else:
+            texts.append(text)
+            text = msg
+
+    if text:
+        texts.append(text)
+    return texts
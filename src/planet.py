@@ -3,12 +3,15 @@ import utils
 resources_per_lvl = 25
 
 
-class Planet:
+class Planet(utils.Slotted):
+    __slots__ = ("name", "resource", "resource_amount", "last_check", "handle")
+
     def __init__(self, resource):
         self.name = utils.rand_str(6)
         self.resource = resource
         self.resource_amount = 0
         self.last_check = utils.now()
+        self.handle = None
 
     def set_resource_amount(self, amt):
         self.resource_amount = amt
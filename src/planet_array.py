@@ -0,0 +1,241 @@
+import array
+from resource import Resource
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import progress
+
+resources = list(Resource)
+resource_ids = {resource: id for id, resource in enumerate(resources)}
+
+
+# Planets stored as parallel columns (resource id, amount, last_check) instead of one object per planet.
+# Extraction, depletion and per-resource totals run as vectorized NumPy operations when NumPy is available,
+#   otherwise the columns are plain arrays and the same operations fall back to Python loops.
+# Removed slots are marked dead and reused, so indices of live planets never change.
+class PlanetArray:
+    def __init__(self, capacity: int = 16):
+        self.size = 0
+        self.free = []
+        self.names = []
+        if numpy is not None:
+            self.resource_id = numpy.zeros(capacity, dtype=numpy.int8)
+            self.amount = numpy.zeros(capacity, dtype=numpy.float64)
+            self.last_check = numpy.zeros(capacity, dtype=numpy.float64)
+            self.alive = numpy.zeros(capacity, dtype=bool)
+        else:
+            self.resource_id = array.array("b", bytes(capacity))
+            self.amount = array.array("d", bytes(8 * capacity))
+            self.last_check = array.array("d", bytes(8 * capacity))
+            self.alive = array.array("b", bytes(capacity))
+
+    @staticmethod
+    def from_planets(planets):
+        store = PlanetArray(max(len(planets), 16))
+        for planet in planets:
+            store.add(planet.resource, planet.resource_amount, planet.last_check, planet.name)
+        return store
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def grow(self):
+        capacity = len(self.amount) * 2
+        if numpy is not None:
+            for column in ("resource_id", "amount", "last_check", "alive"):
+                old = getattr(self, column)
+                new = numpy.zeros(capacity, dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, column, new)
+        else:
+            for column in (self.resource_id, self.alive):
+                column.frombytes(bytes(len(column)))
+            for column in (self.amount, self.last_check):
+                column.frombytes(bytes(8 * len(column)))
+
+    def add(self, resource: Resource, amount: float, last_check: float, name: str = "") -> 'PlanetView':
+        if self.free:
+            index = self.free.pop()
+            self.names[index] = name
+        else:
+            if self.size == len(self.amount):
+                self.grow()
+            index = self.size
+            self.size += 1
+            self.names.append(name)
+
+        self.resource_id[index] = resource_ids[resource]
+        self.amount[index] = amount
+        self.last_check[index] = last_check
+        self.alive[index] = True
+        return PlanetView(self, index)
+
+    def remove(self, index: int):
+        self.alive[index] = False
+        self.amount[index] = 0
+        self.names[index] = ""
+        self.free.append(index)
+
+    def view(self, index: int) -> 'PlanetView':
+        return PlanetView(self, index)
+
+    def live_indices(self):
+        if numpy is not None:
+            return numpy.flatnonzero(self.alive[:self.size])
+        return [index for index in range(self.size) if self.alive[index]]
+
+    def views(self) -> list:
+        return [PlanetView(self, int(index)) for index in self.live_indices()]
+
+    def reserves(self) -> dict:
+        if numpy is not None:
+            alive = self.alive[:self.size]
+            totals = numpy.bincount(self.resource_id[:self.size][alive], weights=self.amount[:self.size][alive],
+                                    minlength=len(resources))
+            counts = self.counts()
+            return {resources[id]: float(totals[id]) for id in range(len(resources)) if counts.get(resources[id])}
+
+        totals = {}
+        for index in self.live_indices():
+            resource = resources[self.resource_id[index]]
+            totals[resource] = totals.get(resource, 0) + self.amount[index]
+        return totals
+
+    def counts(self) -> dict:
+        if numpy is not None:
+            counts = numpy.bincount(self.resource_id[:self.size][self.alive[:self.size]], minlength=len(resources))
+            return {resources[id]: int(counts[id]) for id in range(len(resources)) if counts[id]}
+
+        counts = {}
+        for index in self.live_indices():
+            resource = resources[self.resource_id[index]]
+            counts[resource] = counts.get(resource, 0) + 1
+        return counts
+
+    # Same model as progress.extract(): returns an Extraction with per-slot amounts and depletion flags
+    #   for live_indices(), in that order. Doesn't modify the store, see apply().
+    def extract(self, now: int, rate: float, free_space: float) -> progress.Extraction:
+        if numpy is None:
+            return progress.extract(self.views(), now, rate, free_space)
+
+        rate /= 60
+        live = self.live_indices()
+        amount = self.amount[live]
+        start = numpy.minimum(self.last_check[live], now)
+        depletion = start + amount / rate
+        stop = numpy.minimum(depletion, now)
+        runs_out = depletion <= now
+
+        stop_time = fill_time(start, stop, rate, free_space)
+        end = now if stop_time is None else stop_time
+
+        depleted = runs_out & (end >= stop)
+        extracted = numpy.where(depleted, amount, numpy.minimum(numpy.maximum(end - start, 0) * rate, amount))
+        return progress.Extraction(extracted, depleted, stop_time)
+
+    # Write an extraction back: drilled amounts are subtracted, depleted planets removed.
+    # Returns extracted kg per resource and the removed planets' names.
+    def apply(self, extraction: progress.Extraction, now: int) -> tuple:
+        live = self.live_indices()
+        stop_time = now if extraction.stop_time is None else extraction.stop_time
+        if numpy is not None:
+            self.amount[live] -= extraction.amounts
+            self.last_check[live] = numpy.maximum(self.last_check[live], stop_time)
+            totals = numpy.bincount(self.resource_id[live], weights=extraction.amounts, minlength=len(resources))
+            extracted = {resources[id]: float(totals[id]) for id in range(len(resources)) if totals[id] > 0}
+            depleted = live[extraction.depleted].tolist()
+        else:
+            extracted = {}
+            depleted = []
+            for index, amount, is_depleted in zip(live, extraction.amounts, extraction.depleted):
+                self.amount[index] -= amount
+                self.last_check[index] = max(self.last_check[index], stop_time)
+                if amount > 0:
+                    resource = resources[self.resource_id[index]]
+                    extracted[resource] = extracted.get(resource, 0) + amount
+                if is_depleted:
+                    depleted.append(index)
+
+        names = [self.names[index] for index in depleted]
+        for index in depleted:
+            self.remove(index)
+        return extracted, names
+
+
+def fill_time(start, stop, rate: float, free_space: float):
+    if len(start) == 0:
+        return None
+    if free_space <= 0:
+        return float(start.min())
+
+    drilling = stop > start
+    times = numpy.concatenate((start[drilling], stop[drilling]))
+    changes = numpy.concatenate((numpy.ones(drilling.sum()), -numpy.ones(drilling.sum())))
+    order = numpy.lexsort((changes, times))
+    times = times[order]
+    active = numpy.cumsum(changes[order])
+
+    # Output between consecutive slope changes, running total at the end of each interval
+    produced = active[:-1] * rate * numpy.diff(times)
+    total = numpy.cumsum(produced)
+    full = numpy.flatnonzero(total >= free_space)
+    if len(full) == 0:
+        return None
+
+    interval = full[0]
+    before = total[interval - 1] if interval > 0 else 0
+    return float(times[interval] + (free_space - before) / (active[interval] * rate))
+
+
+# Planet API on top of one slot of a PlanetArray
+class PlanetView:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: PlanetArray, index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def handle(self) -> int:
+        return self.index
+
+    @property
+    def name(self) -> str:
+        return self.store.names[self.index]
+
+    @property
+    def resource(self) -> Resource:
+        return resources[self.store.resource_id[self.index]]
+
+    @property
+    def resource_amount(self) -> float:
+        return float(self.store.amount[self.index])
+
+    @resource_amount.setter
+    def resource_amount(self, amount: float):
+        self.store.amount[self.index] = amount
+
+    @property
+    def last_check(self) -> float:
+        return float(self.store.last_check[self.index])
+
+    @last_check.setter
+    def last_check(self, time: float):
+        self.store.last_check[self.index] = time
+
+    def set_resource_amount(self, amt):
+        self.resource_amount = amt
+
+    def time_passed(self, now):
+        passed = now - self.last_check
+        self.last_check = now
+        return passed
+
+    def __eq__(self, other):
+        return isinstance(other, PlanetView) and other.store is self.store and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
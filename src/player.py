@@ -1,36 +1,62 @@
-import random
+import math
 import enum
 
 import strings
+import outbox
 import globals
+import progress
+import galaxy
+import combat
 from planet import *
+from planet_array import PlanetArray, PlanetView
 from entity import *
 
 
 class Action(Enum):
     PLANET_SEARCH = enum.auto()
+    PATROL = enum.auto()
 
 
-class PendingAction:
-    def __init__(self, uid: int, action: Action, length: int):
+# <shuttle_id> is the shuttle sent out for a planet search, -1 if there is none
+class PendingAction(utils.Slotted):
+    __slots__ = ("uid", "action", "start_time", "length", "ready", "shuttle_id")
+
+    def __init__(self, uid: int, action: Action, length: int, shuttle_id: int = -1):
         self.uid = uid
         self.action = action
         self.start_time = utils.now()
         self.length = length
         self.ready = False
+        self.shuttle_id = shuttle_id
+
+    # Actions saved before they were linked to their shuttle
+    def __setstate__(self, state):
+        self.shuttle_id = -1
+        super().__setstate__(state)
+
+    def due_time(self) -> int:
+        return self.start_time + self.length
+
 
+action_lengths = {Action.PLANET_SEARCH: 5, Action.PATROL: 30}
 
-action_lengths = {Action.PLANET_SEARCH: 5}
 
+class Shuttle(utils.Slotted):
+    __slots__ = ("id", "name", "lvl", "hp", "in_use", "departure_time")
 
-class Shuttle:
     def __init__(self):
+        self.id = -1
         self.name = utils.rand_str(3)
         self.lvl = 1
         self.hp = 50
         self.in_use = False
         self.departure_time = -1
 
+    # Shuttles saved before they had ids get one from their hangar
+    def __setstate__(self, state):
+        self.id = -1
+        super().__setstate__(state)
+
     def depart(self, time: int):
         self.in_use = True
         self.departure_time = time
@@ -40,61 +66,203 @@ class Shuttle:
         self.departure_time = -1
 
 
-class ShuttleHangar:
+# Shuttles are kept by id and idle ones on a free list as well, so sending a shuttle out or taking it
+#   back never scans the hangar. Shuttles are never removed, so ids are never reused
+class ShuttleHangar(Trackable):
+    __slots__ = ("shuttles", "idle", "next_id")
+
     def __init__(self):
-        self.shuttles = []
+        super().__init__()
+        self.shuttles = {}
+        self.idle = []
+        self.next_id = 0
+
+    # Only the shuttles themselves are stored, hangars saved before shuttles had ids keep them in a plain list
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        shuttles = list(self.shuttles.values() if isinstance(self.shuttles, dict) else self.shuttles)
+        self.shuttles = {}
+        self.idle = []
+        self.next_id = max([shuttle.id + 1 for shuttle in shuttles], default=0)
+        for shuttle in shuttles:
+            if shuttle.id < 0:
+                shuttle.id = self.next_id
+                self.next_id += 1
+            self.index_shuttle(shuttle)
+
+    def index_shuttle(self, shuttle: Shuttle):
+        self.shuttles[shuttle.id] = shuttle
+        if not shuttle.in_use:
+            self.idle.append(shuttle.id)
+
+    def add_shuttle(self, shuttle: Shuttle):
+        shuttle.id = self.next_id
+        self.next_id += 1
+        self.index_shuttle(shuttle)
+        self.mark_changed()
+
+    def get_shuttle(self, id: int) -> Shuttle:
+        return self.shuttles.get(id)
 
     def get_idle_shuttles(self):
-        idle_shuttles = []
-        for shuttle in self.shuttles:
-            if not shuttle.in_use:
-                idle_shuttles.append(shuttle)
-        return idle_shuttles
+        return [self.shuttles[id] for id in self.idle]
+
+    def idle_count(self) -> int:
+        return len(self.idle)
+
+    def busy_count(self) -> int:
+        return len(self.shuttles) - len(self.idle)
 
     def next_idle_shuttle(self) -> Shuttle:
-        idle_shuttles = self.get_idle_shuttles()
-        if idle_shuttles:
-            return idle_shuttles[0]
+        if self.idle:
+            return self.shuttles[self.idle[-1]]
+
+    def dispatch(self, time: int) -> Shuttle:
+        if not self.idle:
+            return None
+        shuttle = self.shuttles[self.idle.pop()]
+        shuttle.depart(time)
+        self.mark_changed()
+        return shuttle
+
+    def return_shuttle(self, id: int) -> Shuttle:
+        shuttle = self.shuttles.get(id)
+        if shuttle is None or not shuttle.in_use:
+            return None
+        shuttle.return_to_hangar()
+        self.idle.append(id)
+        self.mark_changed()
+        return shuttle
+
+    # Searches saved before they were linked to their shuttle are matched to one that left at the same time,
+    #   each shuttle to a single search. Shuttles out without a search to bring them back, like those
+    #   two shuttles sent in the same second used to leave behind, are returned
+    def link(self, actions: list):
+        linked = {action.shuttle_id for action in actions if action.shuttle_id >= 0}
+        departures = {}
+        for shuttle in self.shuttles.values():
+            if shuttle.in_use and shuttle.id not in linked:
+                departures.setdefault(shuttle.departure_time, []).append(shuttle.id)
+        if not departures:
+            return
 
-    def find_by_departure(self, departure_time: int) -> Shuttle:
-        for shuttle in self.shuttles:
-            if shuttle.departure_time == departure_time:
-                return shuttle
+        for action in actions:
+            if action.action == Action.PLANET_SEARCH and action.shuttle_id < 0 and departures.get(action.start_time):
+                action.shuttle_id = departures[action.start_time].pop()
+        for ids in departures.values():
+            for id in ids:
+                self.return_shuttle(id)
 
 
+# Planets are kept by handle, along with per-resource planet counts and reserve totals
+#   that are updated on every change instead of being recounted.
+# With globals.planet_layout "array" the planets live in a PlanetArray <store> and are drilled with its
+#   vectorized extract(), a planet's handle is its slot and the container hands out PlanetViews.
 class PlanetContainer(Upgradeable):
+    __slots__ = ("max_planets", "planet_count", "planets", "next_handle", "resource_counts", "resource_reserves",
+                 "store")
+
     def __init__(self):
         super().__init__(upgrade_by=3, upgrade_multiplier=0.25, initial_cost=10)
         self.max_planets = 5
         self.planet_count = 0
-        self.planets = []
+        self.planets = {}
+        self.next_handle = 0
+        self.resource_counts = {}
+        self.resource_reserves = {}
+        self.store = PlanetArray() if globals.planet_layout == "array" else None
+
+    # Containers saved before planets got handles store them in a plain list, containers saved with the
+    #   other planet layout are indexed again in this one
+    def __setstate__(self, state):
+        self.store = None
+        super().__setstate__(state)
+        planets = self.planets
+        if isinstance(planets, dict):
+            if (self.store is not None) == (globals.planet_layout == "array"):
+                return
+            planets = list(planets.values())
+
+        self.planets = {}
+        self.planet_count = 0
+        self.next_handle = 0
+        self.resource_counts = {}
+        self.resource_reserves = {}
+        self.store = PlanetArray() if globals.planet_layout == "array" else None
+        for planet in planets:
+            self.index_planet(planet)
+
+    def index_planet(self, planet: Planet):
+        if self.store is not None:
+            planet = self.store.add(planet.resource, planet.resource_amount, planet.last_check, planet.name)
+        else:
+            if isinstance(planet, PlanetView):
+                planet = unpack_planet(planet)
+            planet.handle = self.next_handle
+            self.next_handle += 1
+        self.planets[planet.handle] = planet
+        self.planet_count = len(self.planets)
+        self.resource_counts[planet.resource] = self.resource_counts.get(planet.resource, 0) + 1
+        self.resource_reserves[planet.resource] = self.resource_reserves.get(planet.resource, 0) + planet.resource_amount
 
     def add_planet(self, planet: Planet):
         if self.planet_count + 1 > self.max_planets:
             return
-        self.planet_count += 1
-        self.planets.append(planet)
+        self.index_planet(planet)
+        self.mark_changed()
+
+    def get_planet(self, handle: int) -> Planet:
+        return self.planets.get(handle)
+
+    # Always in the order of drill()
+    def get_planets(self) -> list:
+        if self.store is not None:
+            return self.store.views()
+        return list(self.planets.values())
 
     def remove_planet(self, planet: Planet):
-        self.planet_count -= 1
-        self.planets.remove(planet)
+        del self.planets[planet.handle]
+        self.planet_count = len(self.planets)
+
+        resource = planet.resource
+        self.resource_counts[resource] -= 1
+        if self.resource_counts[resource] == 0:
+            del self.resource_counts[resource]
+            del self.resource_reserves[resource]
+        else:
+            self.resource_reserves[resource] = max(self.resource_reserves[resource] - planet.resource_amount, 0)
+        if self.store is not None:
+            self.store.remove(planet.handle)
+        self.mark_changed()
+
+    def remove_planets(self, planets: list):
+        for planet in planets:
+            self.remove_planet(planet)
+
+    # Extraction of every planet of get_planets() up to <now>, see progress.extract()
+    def drill(self, now: int, rate: float, free_space: float) -> progress.Extraction:
+        if self.store is None:
+            return progress.extract(self.get_planets(), now, rate, free_space)
+        extraction = self.store.extract(now, rate, free_space)
+        return progress.Extraction([float(amount) for amount in extraction.amounts],
+                                   [bool(depleted) for depleted in extraction.depleted], extraction.stop_time)
+
+    def extract(self, planet: Planet, amount: float):
+        amount = min(amount, planet.resource_amount)
+        planet.resource_amount -= amount
+        self.resource_reserves[planet.resource] = max(self.resource_reserves[planet.resource] - amount, 0)
+        self.mark_changed()
 
     def get_resource_reserves(self):
-        resources = {}
-        for planet in self.planets:
-            resources[planet.resource] = resources.get(planet.resource, 0) + planet.resource_amount
-        return resources
+        return dict(self.resource_reserves)
 
     def get_extraction_rate(self, resource: Resource):
-        rate = 0
-        for planet in self.planets:
-            if planet.resource == resource:
-                rate += 1
-        return rate
+        return self.resource_counts.get(resource, 0)
 
     def upgrade(self):
         self.max_planets += self.upgrade_amount
         self.upgrade_cost += self.upgrade_cost * self.upgrade_multiplier
+        self.mark_changed()
 
     def get_pcount_str(self):
         return str(self.planet_count) + "/" + str(self.max_planets)
@@ -103,7 +271,18 @@ class PlanetContainer(Upgradeable):
         return self.planet_count == self.max_planets
 
 
+def unpack_planet(view: PlanetView) -> Planet:
+    planet = Planet(view.resource)
+    planet.name = view.name
+    planet.resource_amount = view.resource_amount
+    planet.last_check = view.last_check
+    return planet
+
+
 class Player(Entity):
+    __slots__ = ("id", "last_check", "money", "lvl", "exp", "required_exp", "drill_lvl", "pending_actions",
+                 "planet_container", "shuttle_hangar", "market_seq")
+
     PROGRESS_NTF_MIN_TIME = 900
 
     shuttle_price = 50
@@ -113,9 +292,10 @@ class Player(Entity):
 
     send_shuttle_exp = 4
 
+    bounty_per_hp = 2
+
     def __init__(self, id=0, name=""):
-        super().__init__()
-        self.name = name
+        super().__init__(name)
         self.id = id
 
         self.last_check = utils.now()
@@ -131,6 +311,26 @@ class Player(Entity):
 
         self.planet_container = PlanetContainer()
         self.shuttle_hangar = ShuttleHangar()
+        # Market operations applied to this player so far
+        self.market_seq = 0
+        self.mark_changed()
+
+    def __setstate__(self, state):
+        self.market_seq = 0
+        super().__setstate__(state)
+        self.shuttle_hangar.link(self.pending_actions)
+
+    # Collect change flags of the player and everything stored along with it
+    def pop_changes(self) -> bool:
+        changed = self.pop_changed()
+        changed = self.cargo.pop_changed() or changed
+        changed = self.planet_container.pop_changed() or changed
+        changed = self.shuttle_hangar.pop_changed() or changed
+        return changed
+
+    # What the leaderboards rank players by: (level, exp, credits, planets)
+    def rank_scores(self) -> tuple:
+        return self.lvl, self.exp, self.money, self.planet_container.planet_count
 
     def buy_shuttle(self):
         if self.money < self.shuttle_price:
@@ -139,13 +339,14 @@ class Player(Entity):
 
         self.pay_money(self.shuttle_price)
         shuttle = Shuttle()
-        self.shuttle_hangar.shuttles.append(shuttle)
+        self.shuttle_hangar.add_shuttle(shuttle)
         self.notify("Bought a new shuttle: " + icons.shuttle + " " + shuttle.name)
 
     def level_up(self):
         self.exp = 0
         self.required_exp += int(self.required_exp * self.exp_multiplier)
         self.lvl += 1
+        self.mark_changed()
 
         msg = icons.levelup + " Level Up! You are now a level " + str(self.lvl) + " captain."
         self.notify(msg)
@@ -155,6 +356,7 @@ class Player(Entity):
             return
 
         self.exp += amt
+        self.mark_changed()
 
         msg = icons.exp + " You get +" + str(amt) + " experience!"
         self.notify(msg)
@@ -165,19 +367,43 @@ class Player(Entity):
     def has_more_pending_actions(self):
         return len(self.pending_actions) > 0
 
-    def start_timed_action(self, action: Action):
-        global action_lengths
-        globals.pending_players.append(str(self.id))
-        pending_action = PendingAction(self.id, action, action_lengths[action])
-        self.pending_actions.append(pending_action)
-        if self.start_action(action):
-            pending_action.ready = True
-        else:
-            self.pending_actions.remove(pending_action)
+    def next_action_due(self):
+        dues = [action.due_time() for action in self.pending_actions if action.ready]
+        return min(dues) if dues else None
+
+    # Whole second at which the cargo bay fills up or a planet runs out, predicted from the current state
+    def next_extraction_event(self):
+        due = progress.next_event(self.planet_container.get_planets(), self.extraction_rate,
+                                   self.cargo.free_space())
+        return None if due is None else math.ceil(due)
+
+    # When the timed task daemon has to look at this player again
+    def next_wakeup(self):
+        dues = [due for due in (self.next_action_due(), self.next_extraction_event()) if due is not None]
+        return min(dues) if dues else None
+
+    # Tell the player right away when the cargo bay filled up or planets ran out
+    def check_extraction_events(self):
+        due = self.next_extraction_event()
+        if due is None or due > utils.now():
+            return
+
+        self.check_progress(quiet=True)
+        if self.cargo.is_full():
+            self.notify(icons.box + " Your cargo bay is full, the drills have stopped!\n/show_cargo")
 
-    def start_planet_search(self):
-        shuttle = self.shuttle_hangar.next_idle_shuttle()
-        if shuttle is None:
+    # <count> is how many times to start the action at once, None for as many as possible
+    def start_timed_action(self, action: Action, count: int = 1):
+        if action == Action.PLANET_SEARCH:
+            self.start_planet_search(count)
+        elif action == Action.PATROL:
+            self.start_patrol()
+
+    # Every planet a shuttle brings back needs room in the celestial database, including those of the
+    #   searches already under way
+    def start_planet_search(self, count: int = 1):
+        hangar = self.shuttle_hangar
+        if hangar.idle_count() == 0:
             self.notify("You don't have any shuttles left in your hangar!")
             return
 
@@ -185,69 +411,143 @@ class Player(Entity):
             self.notify("Your celestial database is full!")
             return
 
-        shuttle.depart(self.pending_actions[-1].start_time)
+        room = self.planet_container.max_planets - self.planet_container.planet_count - hangar.busy_count()
+        if room <= 0:
+            self.notify("Your celestial database will be full once your shuttles return!")
+            return
 
-        self.notify("You send your " + icons.shuttle + " " + shuttle.name + " shuttle to search for a new planet...\n\n" +
-                    icons.time + " It will return in " + utils.time_str(action_lengths[Action.PLANET_SEARCH]) + ".")
-        return True
+        count = min(hangar.idle_count() if count is None else count, hangar.idle_count(), room)
+        length = action_lengths[Action.PLANET_SEARCH]
+        for i in range(count):
+            pending_action = PendingAction(self.id, Action.PLANET_SEARCH, length)
+            pending_action.shuttle_id = hangar.dispatch(pending_action.start_time).id
+            pending_action.ready = True
+            self.pending_actions.append(pending_action)
+        self.mark_changed()
 
-    def start_action(self, action: Action):
-        global action_lengths
-        if action == Action.PLANET_SEARCH:
-            return self.start_planet_search()
+        if count == 1:
+            shuttle = hangar.get_shuttle(self.pending_actions[-1].shuttle_id)
+            self.notify("You send your " + icons.shuttle + " " + shuttle.name + " shuttle to search for a new planet...\n\n" +
+                        icons.time + " It will return in " + utils.time_str(length) + ".")
+        else:
+            self.notify("You send " + str(count) + " " + icons.shuttle + " shuttles to search for new planets...\n\n" +
+                        icons.time + " They will return in " + utils.time_str(length) + ".")
 
-    def complete_action(self, pending_action: PendingAction):
-        if pending_action.action == Action.PLANET_SEARCH:
-            self.find_planet(pending_action)
+    def on_patrol(self) -> bool:
+        return any(action.action == Action.PATROL for action in self.pending_actions)
 
-    def check_pending_action(self, action: PendingAction):
-        if utils.now() - action.start_time >= action.length and action.ready:
-            self.complete_action(action)
-            return True
-        else:
-            return False
+    def start_patrol(self):
+        if self.on_patrol():
+            self.notify("Your ship is already out on patrol!")
+            return
+
+        length = action_lengths[Action.PATROL]
+        pending_action = PendingAction(self.id, Action.PATROL, length)
+        pending_action.ready = True
+        self.pending_actions.append(pending_action)
+        self.mark_changed()
+        self.notify("You set out to patrol the sector for pirates...\n\n" +
+                    icons.time + " You will be back in " + utils.time_str(length) + ".")
+
+    # <battles> are the patrols' battles already resolved by start time, see due_battles()
+    def complete_actions(self, pending_actions: list, battles: dict = None):
+        searches = [action for action in pending_actions if action.action == Action.PLANET_SEARCH]
+        if searches:
+            self.find_planets(searches)
+        patrols = [action for action in pending_actions if action.action == Action.PATROL]
+        if patrols:
+            self.finish_patrols(patrols, battles or {})
+
+    # Everything due is completed together, so shuttles sent out at once come back with a single message
+    def check_pending_actions(self, battles: dict = None):
+        now = utils.now()
+        due, waiting = [], []
+        for action in self.pending_actions:
+            (due if action.ready and now >= action.due_time() else waiting).append(action)
+        if not due:
+            return
+
+        self.pending_actions = waiting
+        self.mark_changed()
+        self.complete_actions(due, battles)
+
+    # Battles of the patrols that are due, by start time, for the timed task daemon to resolve together
+    #   with those of other players before completing them
+    def due_battles(self) -> dict:
+        now = utils.now()
+        return {action.start_time: self.patrol_battle(action) for action in self.pending_actions
+                if action.action == Action.PATROL and action.ready and now >= action.due_time()}
+
+    # The player's ship fights a copy of itself, so the battle can be resolved without the player's lock.
+    # A patrol meets the same mobs however often it's looked at
+    def patrol_battle(self, action: PendingAction) -> combat.Battle:
+        ship = Entity(self.name)
+        ship.hp, ship.max_hp = self.hp, self.max_hp
+        ship.shield, ship.shield_max = self.shield, self.shield_max
+        ship.atk = self.atk
+        return combat.Battle([ship], combat.spawn_mobs(self.lvl, str(self.id) + ":" + str(action.start_time)))
+
+    # The ship is repaired and its shield recharged after every patrol, won or not
+    def finish_patrols(self, patrols: list, battles: dict):
+        unresolved = [self.patrol_battle(action) for action in patrols if action.start_time not in battles]
+        combat.resolve(unresolved)
+        resolved = iter(unresolved)
+        bounty = exp = 0
+        for action in patrols:
+            battle = battles.get(action.start_time) or next(resolved)
+            ship = battle.fleet[0]
+            msg = (icons.atk + " Patrol report\n\n" +
+                   "You ran into " + ", ".join(mob.name for mob in battle.mobs) + ".\n")
+            if battle.winner == combat.Battle.FLEET:
+                bounty += self.bounty_per_hp * sum(mob.max_hp for mob in battle.mobs)
+                exp += sum(mob.max_hp for mob in battle.mobs)
+                msg += "All of them were destroyed after " + str(battle.rounds) + " rounds of fighting!\n"
+            elif battle.winner == combat.Battle.MOBS:
+                msg += "Your ship was disabled after " + str(battle.rounds) + " rounds and towed back to base.\n"
+            else:
+                msg += "You broke off the fight after " + str(battle.rounds) + " rounds.\n"
+            msg += icons.hp + " Hull integrity after the fight: " + str(ship.hp) + "/" + str(ship.max_hp)
+            self.notify(msg)
 
-    def check_pending_actions(self):
-        for action in self.pending_actions[:]:
-            if self.check_pending_action(action):
-                self.pending_actions.remove(action)
+        self.hp, self.shield, self.dead = self.max_hp, self.shield_max, False
+        self.mark_changed()
+        self.add_money(bounty)
+        self.add_exp(exp)
 
-    def check_progress(self, verbose: bool = False):
+    # <quiet> leaves out the progress summary, messages about depleted planets are always sent
+    def check_progress(self, verbose: bool = False, quiet: bool = False):
         now = utils.now()
         time_passed = now - self.last_check
-        minutes_passed = time_passed / 60
         self.last_check = now
         depleted_msg = ""
         msg = (icons.progress + " Progress\n" +
                "[" + utils.time_str(time_passed) + " since last check]\n\n")
 
-        resources_extracted = {}
-        resources_remain = {}
-        for planet in self.planet_container.planets[:]:
-            if self.cargo.is_full():
-                break
-            extracted = self.extraction_rate * (planet.time_passed(now) / 60)
-
-            if planet.resource_amount - extracted <= 0:
-                extracted = planet.resource_amount
-                planet.resource_amount = 0
-            else:
-                planet.resource_amount -= extracted
-
-            overflow = self.cargo.put(planet.resource, extracted)
-            planet.resource_amount += overflow
-            extracted -= overflow
-
-            if extracted <= 0:
-                extracted = 0
+        planets = self.planet_container.get_planets()
+        extraction = self.planet_container.drill(now, self.extraction_rate, self.cargo.free_space())
 
-            resources_extracted[planet.resource] = resources_extracted.get(planet.resource, 0) + extracted
-            resources_remain[planet.resource] = resources_remain.get(planet.resource, 0) + planet.resource_amount
-
-            if planet.resource_amount == 0:
-                self.planet_container.remove_planet(planet)
+        # Drills stop when the cargo bay fills up and continue from that moment once there's space again
+        stop_time = now if extraction.stop_time is None else extraction.stop_time
+        resources_extracted = {}
+        depleted = []
+        for planet, extracted, is_depleted in zip(planets, extraction.amounts, extraction.depleted):
+            last_check = max(planet.last_check, stop_time)
+            if extracted <= 0 and not is_depleted and last_check == planet.last_check:
+                continue
+
+            planet.last_check = last_check
+            self.planet_container.extract(planet, planet.resource_amount if is_depleted else extracted)
+
+            if extracted > 0:
+                resources_extracted[planet.resource] = resources_extracted.get(planet.resource, 0) + extracted
+            if is_depleted:
+                depleted.append(planet)
                 depleted_msg += icons.planet + " " + planet.name + " is out of " + planet.resource.name + "!\n"
 
+        self.planet_container.remove_planets(depleted)
+        for resource, amount in resources_extracted.items():
+            self.cargo.put(resource, amount)
+
         if resources_extracted:
             msg += "Your drills have extracted:\n"
         elif self.cargo.is_full():
@@ -255,21 +555,25 @@ class Player(Entity):
         else:
             msg += "You don't have any planets in your celestial body database."
 
+        resources_remain = self.planet_container.get_resource_reserves()
         for resource, amount in resources_extracted.items():
             msg += (icons.bulletpoint + " " + str(round(amount, 2)) + " kg of " + resource.name + "" +
-                    " (" + str(round(resources_remain[resource], 2)) + " kg left)" + "\n")
+                    " (" + str(round(resources_remain.get(resource, 0), 2)) + " kg left)" + "\n")
 
-        if time_passed >= self.PROGRESS_NTF_MIN_TIME or verbose:
+        if (time_passed >= self.PROGRESS_NTF_MIN_TIME or verbose) and not quiet:
             self.notify(msg)
 
         if len(depleted_msg) > 0:
             self.notify(depleted_msg)
 
+        return resources_extracted
+
     def add_money(self, quantity: float):
         if quantity <= 0:
             return
 
         self.money += quantity
+        self.mark_changed()
         msg = icons.money + " You receive +" + utils.round_str(quantity) + " credits."
         self.notify(msg)
 
@@ -277,6 +581,7 @@ class Player(Entity):
         if self.money - quantity < 0:
             return
         self.money -= quantity
+        self.mark_changed()
         self.notify("You paid " + icons.money + utils.round_str(quantity) + "\n" +
                     "Current balance: " + icons.money + utils.round_str(self.money))
 
@@ -294,20 +599,28 @@ class Player(Entity):
 
         return True
 
-    def find_planet(self, action: PendingAction):
-        planet = Planet(roll_resource())
-        self.shuttle_hangar.find_by_departure(action.start_time).return_to_hangar()
-
-        base_resources = self.lvl * resources_per_lvl
-        planet.set_resource_amount(random.uniform(base_resources * 0.15, base_resources))
-        self.planet_container.add_planet(planet)
-
-        self.notify("You found a new planet!\n\n" +
-                    icons.planet + " Name: " + planet.name + "\n" +
-                    icons.resource + " Resource type: " + planet.resource.name + "\n" +
-                    icons.box + " Resource amount: " + str(round(planet.resource_amount, 2)) + " kg\n"
-        )
-        self.add_exp(int(planet.resource_amount * 0.2))
+    def find_planets(self, pending_actions: list):
+        planets = []
+        for action in pending_actions:
+            planet = galaxy.discover(self.lvl)
+            self.shuttle_hangar.return_shuttle(action.shuttle_id)
+            self.planet_container.add_planet(planet)
+            planets.append(planet)
+
+        if len(planets) == 1:
+            planet = planets[0]
+            self.notify("You found a new planet!\n\n" +
+                        icons.planet + " Name: " + planet.name + "\n" +
+                        icons.resource + " Resource type: " + planet.resource.name + "\n" +
+                        icons.box + " Resource amount: " + str(round(planet.resource_amount, 2)) + " kg\n"
+            )
+        else:
+            msg = "Your shuttles found " + str(len(planets)) + " new planets!\n\n"
+            for planet in planets:
+                msg += (icons.planet + " " + planet.name + ": " + planet.resource.name + ", " +
+                        str(round(planet.resource_amount, 2)) + " kg\n")
+            self.notify(msg)
+        self.add_exp(sum(int(planet.resource_amount * 0.2) for planet in planets))
 
     def show_profile(self):
         self.check_progress()
@@ -320,7 +633,8 @@ class Player(Entity):
                     "Ship:\n" +
                     self.cargo.get_cargo_header_str() + strings.tab + "/show_cargo\n" +
                     icons.planet + " Planets found: " + str(self.planet_container.planet_count) + strings.tab + "/celestial_database\n" +
-                    icons.shuttle + " Shuttles: " + str(len(self.shuttle_hangar.shuttles))
+                    icons.shuttle + " Shuttles: " + str(len(self.shuttle_hangar.shuttles)) + "\n\n" +
+                    icons.atk + " Hunt pirates for bounties" + strings.tab + "/patrol"
         )
 
     def show_cargo(self):
@@ -343,7 +657,8 @@ class Player(Entity):
     def view_shop(self):
         self.notify(icons.shop + " Shop\n" +
                     "Your credits: " + icons.money + " " + utils.round_str(self.money) + "\n\n" +
-                    icons.shuttle + " Buy 1 shuttle for " + str(self.shuttle_price) + " " + icons.money + strings.tab + "/buy_shuttle \n")
+                    icons.shuttle + " Buy 1 shuttle for " + str(self.shuttle_price) + " " + icons.money + strings.tab + "/buy_shuttle \n" +
+                    icons.market + " Trade resources with other captains" + strings.tab + "/market\n")
 
     def view_planet_list(self):
         self.check_progress()
@@ -374,4 +689,4 @@ class Player(Entity):
         thing.upgrade()
 
     def notify(self, msg):
-        globals.bot.send_message(self.id, msg)
+        outbox.send(self.id, msg)
@@ -0,0 +1,86 @@
+# Offline extraction of all planets at once.
+# Every planet is drilled at <rate> kg/min from its own last_check until it runs out or <now>;
+#   all planets share one cargo bay, and drilling stops everywhere at the moment the combined output fills it.
+# The cost depends only on the number of planets, not on how much time has passed.
+
+
+class Extraction:
+    def __init__(self, amounts: list, depleted: list, stop_time):
+        # kg extracted from each planet
+        self.amounts = amounts
+        # whether each planet ran out
+        self.depleted = depleted
+        # moment the cargo bay got full, None if it never did
+        self.stop_time = stop_time
+
+
+def extract(planets, now: int, rate: float, free_space: float) -> Extraction:
+    rate /= 60
+    spans = []
+    for planet in planets:
+        start = min(planet.last_check, now)
+        depletion = start + planet.resource_amount / rate
+        spans.append((start, min(depletion, now), depletion <= now))
+
+    stop_time = fill_time(spans, rate, free_space)
+    end = now if stop_time is None else stop_time
+
+    amounts = []
+    depleted = []
+    for planet, (start, stop, runs_out) in zip(planets, spans):
+        if runs_out and end >= stop:
+            amounts.append(planet.resource_amount)
+            depleted.append(True)
+        else:
+            amounts.append(min(max(end - start, 0) * rate, planet.resource_amount))
+            depleted.append(False)
+
+    return Extraction(amounts, depleted, stop_time)
+
+
+# Earliest moment something happens without the player doing anything: the cargo bay filling up,
+#   or a planet running out before that. None if nothing will, e.g. the cargo bay is already full
+def next_event(planets, rate: float, free_space: float):
+    if free_space <= 0 or not planets:
+        return None
+
+    rate /= 60
+    spans = []
+    for planet in planets:
+        start = planet.last_check
+        spans.append((start, start + planet.resource_amount / rate, True))
+
+    depletion = min(span[1] for span in spans)
+    stop_time = fill_time(spans, rate, free_space)
+    return depletion if stop_time is None else min(stop_time, depletion)
+
+
+# Combined output is piecewise linear: every planet adds <rate> to its slope while it's being drilled.
+# Walk through the points where the slope changes until the output reaches <free_space>.
+def fill_time(spans, rate: float, free_space: float):
+    if not spans:
+        return None
+
+    events = []
+    for start, stop, runs_out in spans:
+        if stop > start:
+            events.append((start, 1))
+            events.append((stop, -1))
+
+    if free_space <= 0:
+        return min(span[0] for span in spans)
+
+    events.sort()
+    total = 0
+    active = 0
+    last_time = None
+    for time, change in events:
+        if active > 0:
+            produced = active * rate * (time - last_time)
+            if total + produced >= free_space:
+                return last_time + (free_space - total) / (active * rate)
+            total += produced
+        active += change
+        last_time = time
+
+    return None
@@ -1,6 +1,11 @@
+import random
 from typing import NamedTuple
 from enum import Enum
-import utils
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class ResourceType(Enum):
@@ -39,14 +44,72 @@ class Resource(Enum):
     Diamond = ResourceContainer(type=ResourceType.Precious, price=7.5, probability=0.75)
 
 
-resource_list = list(Resource)
-resource_list.sort(key=lambda res: res.value.probability)
+# Walker's alias method: one uniform draw picks a column, a second one picks between the column's resource
+#   and its alias, so every roll is O(1) and resources come up in proportion to their probability weights.
+# Rolls come from the sampler's own generators, so the same <seed> gives the same rolls
+class ResourceSampler:
+    def __init__(self, weights: dict, seed=None):
+        self.resources = list(weights.keys())
+        count = len(self.resources)
+        total = sum(weights.values())
+        scaled = [weights[resource] * count / total for resource in self.resources]
+
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+        if numpy is not None:
+            self.probability_array = numpy.array(self.probability)
+            self.alias_array = numpy.array(self.alias)
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.random = random.Random(seed)
+        self.generator = numpy.random.default_rng(seed) if numpy is not None else None
+
+    def roll(self) -> Resource:
+        column = self.random.randrange(len(self.resources))
+        if self.random.random() < self.probability[column]:
+            return self.resources[column]
+        return self.resources[self.alias[column]]
+
+    # Same choice made from two given uniform numbers in [0, 1), for deterministic rolls
+    def pick(self, u: float, v: float) -> Resource:
+        column = int(u * len(self.resources))
+        if v < self.probability[column]:
+            return self.resources[column]
+        return self.resources[self.alias[column]]
+
+    def roll_ids(self, count: int):
+        if self.generator is not None:
+            columns = self.generator.integers(0, len(self.resources), count)
+            keep = self.generator.random(count) < self.probability_array[columns]
+            return numpy.where(keep, columns, self.alias_array[columns])
+
+        ids = []
+        for i in range(count):
+            column = self.random.randrange(len(self.resources))
+            ids.append(column if self.random.random() < self.probability[column] else self.alias[column])
+        return ids
+
+    def roll_many(self, count: int) -> list:
+        return [self.resources[id] for id in self.roll_ids(count)]
+
+
+sampler = ResourceSampler({resource: resource.value.probability for resource in Resource})
 
 
 def roll_resource() -> Resource:
-    roll = utils.rand_percent()
-    for resource in resource_list:
-        if utils.roll_result(roll, resource.value.probability):
-            return resource
+    return sampler.roll()
+
 
-    return Resource.Dust
+def roll_resources(count: int) -> list:
+    return sampler.roll_many(count)
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import contextvars
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import utils
+
+# Exceptions with these messages are raised by handlers to stop the runtime
+stop_reasons = ("restart", "hard_restart", "stop")
+
+
+# Polls updates from the bot and hands every message to <handler> on a worker thread.
+# Messages from different users are handled concurrently, messages of one user are handled in order.
+# An exception with one of the <stop_reasons> stops the runtime and is re-raised from run().
+# Every long poll runs on a daemon thread of its own, so stopping doesn't wait up to <poll_timeout> for the
+#   poll in flight. Its updates are dropped without being confirmed, and the next run gets them again.
+class Runtime:
+    def __init__(self, bot, handler, workers: int = 32, poll_timeout: int = 20):
+        self.bot = bot
+        self.handler = handler
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.executor = None
+        self.loop = None
+        self.stopping = None
+        self.stop_reason = None
+        self.user_locks = {}
+        self.tasks = set()
+
+    def run(self):
+        self.stop_reason = None
+        self.executor = ThreadPoolExecutor(self.workers)
+        try:
+            asyncio.run(self.main())
+        finally:
+            self.executor.shutdown(wait=True)
+
+        if self.stop_reason is not None:
+            raise self.stop_reason
+
+    def stop(self, reason: Exception = None):
+        self.stop_reason = reason
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        poller = asyncio.create_task(self.poll())
+
+        await self.stopping.wait()
+        poller.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def poll(self):
+        offset = None
+        while not self.stopping.is_set():
+            try:
+                updates = await self.fetch(offset)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                message = update.message
+                if message is not None and message.text is not None:
+                    self.spawn(message)
+
+    def fetch(self, offset) -> asyncio.Future:
+        loop = self.loop
+        future = loop.create_future()
+
+        def done(updates, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(updates)
+
+        def poll_once():
+            updates, error = None, None
+            try:
+                updates = self.get_updates(offset)
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(done, updates, error)
+            except RuntimeError:
+                pass  # the loop of that run is already closed
+
+        threading.Thread(target=poll_once, name="poll", daemon=True).start()
+        return future
+
+    def get_updates(self, offset):
+        return self.bot.get_updates(offset=offset, limit=100, timeout=self.poll_timeout,
+                                    long_polling_timeout=self.poll_timeout)
+
+    def spawn(self, message):
+        task = asyncio.create_task(self.dispatch(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Every user has a lock (with a count of messages waiting for it) while they have messages in flight
+    async def dispatch(self, message):
+        uid = message.from_user.id
+        lock = self.user_locks.get(uid)
+        if lock is None:
+            lock = self.user_locks[uid] = [asyncio.Lock(), 0]
+        lock[1] += 1
+
+        try:
+            async with lock[0]:
+                await self.loop.run_in_executor(self.executor, contextvars.copy_context().run, self.handler, message)
+        except Exception as e:
+            if str(e) in stop_reasons:
+                self.stop(e)
+            else:
+                utils.out("Error while handling a message from " + str(uid) + ":")
+                traceback.print_exc()
+        finally:
+            lock[1] -= 1
+            if lock[1] == 0:
+                del self.user_locks[uid]
+
@@ -0,0 +1,95 @@
+import time
+import heapq
+import itertools
+import threading
+import traceback
+import utils
+import metrics
+
+tick_duration = metrics.histogram("timed_task_tick_seconds", "Time spent running due timed tasks per wakeup")
+scheduling_lag = metrics.histogram("timed_task_lag_seconds", "Delay between a timed task's due time and its run")
+
+
+# Deadline-ordered queue of (due, task) entries, processed by a single daemon thread
+#   that sleeps until the earliest deadline instead of polling every player.
+# Each due task is passed to <fire>; stale or duplicate entries are harmless, fire() is expected
+#   to only complete what is actually due.
+# <prepare>(tasks) sees all the tasks due at once before any of them is fired, whatever it returns
+#   is passed to fire(task, prepared) along with each of them.
+class Scheduler:
+    def __init__(self, fire, prepare=lambda tasks: None):
+        self.fire = fire
+        self.prepare = prepare
+        self.queue = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def schedule(self, due: int, task):
+        with self.cond:
+            heapq.heappush(self.queue, (due, next(self.counter), task))
+            if self.queue[0][0] == due:
+                self.cond.notify()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def next_due(self):
+        with self.cond:
+            return self.queue[0][0] if self.queue else None
+
+    def pop_due(self, now: float):
+        due = []
+        with self.cond:
+            while self.queue and self.queue[0][0] <= now:
+                entry = heapq.heappop(self.queue)
+                due.append((entry[0], entry[2]))
+        return due
+
+    def run_due(self, now: float) -> int:
+        start = time.perf_counter()
+        due = self.pop_due(now)
+        try:
+            prepared = self.prepare([task for due_time, task in due]) if due else None
+        except Exception:
+            traceback.print_exc()
+            prepared = None
+        for due_time, task in due:
+            scheduling_lag.observe(max(now - due_time, 0))
+            try:
+                self.fire(task, prepared)
+            except Exception:
+                traceback.print_exc()
+        tick_duration.observe(time.perf_counter() - start)
+        return len(due)
+
+    def wait_for_deadline(self):
+        with self.cond:
+            while self.running:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                delay = self.queue[0][0] - utils.clock.time()
+                if delay <= 0:
+                    return
+                self.cond.wait(delay)
+
+    def loop(self):
+        while self.running:
+            self.wait_for_deadline()
+            if self.running:
+                self.run_due(utils.clock.time())
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
@@ -0,0 +1,299 @@
+import os
+import glob
+import time
+import queue
+import types
+import threading
+import itertools
+import traceback
+import multiprocessing
+import globals
+import utils
+import outbox
+import metrics
+import leaderboard
+import storage_utils
+from delivery import Broadcast, PRIORITY_REPLY, broadcast_started, broadcast_busy
+from runtime import stop_reasons
+
+# Sharded mode (globals.shards > 1): the front process polls updates and routes each one by user id to one
+#   of <count> worker processes. Worker <index> owns the players with uid % count == index, with its own
+#   player store and files (players.<index>.dat / players.<index>.db), its own timed task queue and market
+#   (market.<index>.dat), so players only trade with players of the same shard.
+# Workers don't talk to Telegram, everything they send goes back to the front and through its Delivery,
+#   so the global rate limit still holds. Restart and stop requests end the run of every worker, which
+#   saves its players and exits; the next run starts them again from disk.
+#
+# Front -> worker: ("message", uid, username, text), ("gather", id, kind, args...), None to exit
+# Worker -> front: ("send", uid, text, priority), ("stop", reason), ("broadcast", uid, text),
+#   ("leaderboard", uid, board, key, scores, count), ("stats", uid), ("gathered", id, answer)
+# Gathering asks every shard the same question and goes on once all of them have answered.
+# A worker that exits on its own fails every gather still waiting for it (its answer is None) and
+#   ends the run like a crash, so the watchdog counts it and starts the shards again from disk
+supervise_interval = 1
+shards_down = "A shard stopped unexpectedly, try again once the bot has restarted."
+
+
+def shard_file(file: str, index: int) -> str:
+    root, extension = os.path.splitext(file)
+    return root + "." + str(index) + extension
+
+
+def shard_of(uid, count: int) -> int:
+    return int(uid) % count
+
+
+# Players must be split with "migrate.py --shard <count>" before the first sharded run,
+#   and the shard count can't change without doing that again
+def check_files(count: int):
+    file = storage_utils.player_db if globals.storage_backend == "sqlite" else storage_utils.player_file
+    root, extension = os.path.splitext(file)
+    indexes = []
+    for name in glob.glob(glob.escape(root) + ".*" + extension):
+        index = name[len(root) + 1:len(name) - len(extension)]
+        if index.isnumeric():
+            indexes.append(int(index))
+
+    if os.path.exists(file) and not indexes:
+        raise RuntimeError(file + " isn't split into shards yet, run migrate.py --shard " + str(count))
+    if any(index >= count for index in indexes):
+        raise RuntimeError(file + " is split into more than " + str(count) + " shards")
+
+
+# Stands in for the Delivery of a worker process, messages are delivered by the front
+class Replies:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def send(self, chat_id: int, text: str, priority: int, on_done=None):
+        self.replies.put(("send", chat_id, text, priority))
+
+    def stop(self):
+        pass
+
+
+def worker(index: int, count: int, inbox, replies):
+    import main
+    storage_utils.player_file = shard_file(storage_utils.player_file, index)
+    storage_utils.player_db = shard_file(storage_utils.player_db, index)
+    storage_utils.market_file = shard_file(storage_utils.market_file, index)
+    if globals.metrics_file is not None:
+        globals.metrics_file = shard_file(globals.metrics_file, index)
+    globals.shard = Shard(index, count, replies)
+    globals.delivery = Replies(replies)
+    main.start_time = None
+
+    storage_utils.start()
+    utils.out("Shard " + str(index) + " is running with " + str(len(globals.player_storage)) + " players")
+    try:
+        while True:
+            request = inbox.get()
+            if request is None:
+                break
+            globals.shard.handle(request)
+    finally:
+        storage_utils.stop()
+        storage_utils.unload()
+
+
+# The worker side, globals.shard in a worker process
+class Shard:
+    def __init__(self, index: int, count: int, replies):
+        self.index = index
+        self.count = count
+        self.replies = replies
+
+    def handle(self, request):
+        import main
+        if request[0] == "gather":
+            id, kind, args = request[1], request[2], request[3:]
+            if kind == "uids":
+                answer = list(globals.player_storage.uids())
+            elif kind == "leaderboard":
+                answer = main.leaderboard_query(*args)
+            elif kind == "stats":
+                answer = (self.index, metrics.summary())
+            else:
+                answer = None
+            self.replies.put(("gathered", id, answer))
+            return
+
+        uid, username, text = request[1:]
+        message = types.SimpleNamespace(from_user=types.SimpleNamespace(id=uid, username=username), text=text)
+        try:
+            main.handle_input(message)
+        except Exception as e:
+            if str(e) in stop_reasons:
+                self.replies.put(("stop", str(e)))
+            else:
+                utils.out("Error while handling a message from " + str(uid) + ":")
+                traceback.print_exc()
+
+    # Every shard only knows its own players, the front collects them all
+    def broadcast(self, uid: int, text: str):
+        self.replies.put(("broadcast", uid, text))
+
+    # Ranks on every shard are merged by the front, which also replies
+    def leaderboard(self, uid: int, board: str, key: tuple, scores: tuple, count: int):
+        self.replies.put(("leaderboard", uid, board, key, scores, count))
+
+    # Every shard has its own metrics, the front sends them all
+    def stats(self, uid: int):
+        self.replies.put(("stats", uid))
+
+
+# The front side: starts the workers, routes messages to them and handles what they send back.
+# <on_stop>(reason) is called when a worker handled a restart or stop request, or died
+class Dispatcher:
+    def __init__(self, count: int, on_stop=None):
+        self.count = count
+        self.on_stop = on_stop
+        self.context = multiprocessing.get_context("fork")
+        self.replies = self.context.Queue()
+        self.inboxes = []
+        self.processes = []
+        self.reader = None
+        self.gathers = {}
+        self.gather_ids = itertools.count()
+        self.gathers_lock = threading.Lock()
+        self.stopping = False
+        self.failed = False
+
+    def start(self):
+        check_files(self.count)
+        for index in range(self.count):
+            inbox = self.context.Queue()
+            process = self.context.Process(target=worker, args=(index, self.count, inbox, self.replies),
+                                           name="shard-" + str(index), daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+        utils.out("Started " + str(self.count) + " shards")
+
+    # Runtime handler, messages of one user always go to the same shard and stay in order
+    def dispatch(self, message):
+        uid = message.from_user.id
+        self.inboxes[shard_of(uid, self.count)].put(("message", uid, message.from_user.username, message.text))
+
+    def fan_out(self, request):
+        for inbox in self.inboxes:
+            inbox.put(request)
+
+    # <on_done>(answers) is called by the reply reader once every shard has answered <request>
+    def gather(self, request: tuple, on_done):
+        with self.gathers_lock:
+            failed = self.failed
+            if not failed:
+                id = next(self.gather_ids)
+                self.gathers[id] = [self.count, [], on_done]
+        if failed:
+            on_done([None] * self.count)
+            return
+        self.fan_out(("gather", id) + request)
+
+    # Waits until every shard has handled everything dispatched so far
+    def barrier(self):
+        done = threading.Event()
+        self.gather(("barrier",), lambda answers: done.set())
+        done.wait()
+
+    def read_replies(self):
+        checked = time.monotonic()
+        while True:
+            if time.monotonic() - checked >= supervise_interval:
+                checked = time.monotonic()
+                self.check_workers()
+            try:
+                reply = self.replies.get(timeout=supervise_interval)
+            except queue.Empty:
+                continue
+            if reply is None:
+                return
+            try:
+                self.handle_reply(reply)
+            except Exception:
+                traceback.print_exc()
+
+    def check_workers(self):
+        if self.stopping or self.failed:
+            return
+        dead = [process for process in self.processes if not process.is_alive()]
+        if not dead:
+            return
+
+        for process in dead:
+            utils.out(process.name + " exited with code " + str(process.exitcode) + ", restarting")
+        with self.gathers_lock:
+            self.failed = True
+            gathers, self.gathers = self.gathers, {}
+        for remaining, answers, on_done in gathers.values():
+            try:
+                on_done(answers + [None] * remaining)
+            except Exception:
+                traceback.print_exc()
+        if self.on_stop is not None:
+            self.on_stop(Exception("shard " + str(self.processes.index(dead[0])) + " died"))
+
+    def handle_reply(self, reply):
+        kind = reply[0]
+        if kind == "send":
+            outbox.deliver(*reply[1:])
+        elif kind == "stop":
+            if self.on_stop is not None:
+                self.on_stop(Exception(reply[1]))
+        elif kind == "broadcast":
+            uid, text = reply[1:]
+            self.gather(("uids",), lambda answers: self.start_broadcast(uid, text, answers))
+        elif kind == "leaderboard":
+            uid, board, key, scores, count = reply[1:]
+            self.gather(("leaderboard", board, key, count),
+                        lambda answers: self.send_leaderboard(uid, board, scores, count, answers))
+        elif kind == "stats":
+            uid = reply[1]
+            self.gather(("stats",), lambda answers: self.send_stats(uid, answers))
+        elif kind == "gathered":
+            with self.gathers_lock:
+                gather = self.gathers.get(reply[1])
+                if gather is None:
+                    return
+                gather[0] -= 1
+                gather[1].append(reply[2])
+                if gather[0] != 0:
+                    return
+                del self.gathers[reply[1]]
+            gather[2](gather[1])
+
+    def send_leaderboard(self, uid: int, board: str, scores: tuple, count: int, answers: list):
+        if None in answers:
+            outbox.deliver(uid, leaderboard.not_ready, PRIORITY_REPLY)
+            return
+        top = sorted(entry for answer in answers for entry in answer[0])[:count]
+        ahead = sum(answer[1] for answer in answers)
+        total = sum(answer[2] for answer in answers)
+        outbox.deliver(uid, leaderboard.format_board(board, top, ahead + 1, total, scores), PRIORITY_REPLY)
+
+    def send_stats(self, uid: int, answers: list):
+        summaries = dict(answer for answer in answers if answer is not None)
+        outbox.deliver(uid, "Front:\n" + metrics.summary(), PRIORITY_REPLY)
+        for index in range(self.count):
+            summary = summaries.get(index, "not responding")
+            outbox.deliver(uid, "Shard " + str(index) + ":\n" + summary, PRIORITY_REPLY)
+
+    def start_broadcast(self, uid: int, text: str, answers: list):
+        if None in answers:
+            outbox.deliver(uid, shards_down, PRIORITY_REPLY)
+            return
+        started = Broadcast(globals.delivery, text, sum(answers, [])).start()
+        outbox.deliver(uid, broadcast_started if started else broadcast_busy, PRIORITY_REPLY)
+
+    # Every shard finishes what it was sent and saves its players before exiting
+    def stop(self):
+        self.stopping = True
+        self.fan_out(None)
+        for process in self.processes:
+            process.join()
+        self.replies.put(None)
+        self.reader.join()
+        utils.out("Stopped " + str(self.count) + " shards")
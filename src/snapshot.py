@@ -0,0 +1,126 @@
+import os
+import mmap
+import math
+import struct
+import codec
+
+# Binary player snapshot:
+#   header: magic, format version, journal generation merged into it, player count, index offset
+#   records: codec records back to back
+#   index: one (uid, offset, length, due, level, exp, credits, planets) entry per player sorted by uid,
+#     <due> is Player.next_wakeup(), NaN if nothing is pending, the rest Player.rank_scores()
+# The file is read through mmap, looking up a player is a binary search over the index
+#   and decoding it only touches that player's record.
+# Format 1 snapshots have no scores in their index and are still read.
+magic = b"TGSPACE\0"
+format_version = 2
+
+header = struct.Struct(">8sHQIQ")
+index_entries = {1: struct.Struct(">qQId"), 2: struct.Struct(">qQIdqqdI")}
+index_entry = index_entries[format_version]
+
+
+def is_snapshot(file: str) -> bool:
+    with open(file, "rb") as snapshot:
+        return snapshot.read(len(magic)) == magic
+
+
+# <records> yields (uid, due, scores, record), written to an already open file
+def write(file, generation: int, records):
+    file.write(bytes(header.size))
+    index = []
+    offset = header.size
+    for uid, due, scores, record in records:
+        file.write(record)
+        index.append((int(uid), offset, len(record), math.nan if due is None else due) + tuple(scores))
+        offset += len(record)
+
+    index.sort()
+    file.write(b"".join(index_entry.pack(*entry) for entry in index))
+    file.seek(0)
+    file.write(header.pack(magic, format_version, generation, len(index), offset))
+    file.seek(0, os.SEEK_END)
+
+
+class Snapshot:
+    def __init__(self, file: str):
+        with open(file, "rb") as snapshot:
+            self.map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+        file_magic, version, self.generation, self.count, self.index_offset = header.unpack_from(self.map)
+        if file_magic != magic:
+            raise ValueError(file + " is not a player snapshot")
+        if version not in index_entries:
+            raise ValueError(file + " has unsupported snapshot format " + str(version))
+        self.index_entry = index_entries[version]
+        self.has_scores = version >= 2
+        self.uid_set = None
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, i: int) -> tuple:
+        return self.index_entry.unpack_from(self.map, self.index_offset + i * self.index_entry.size)
+
+    def entries(self):
+        for i in range(self.count):
+            yield self.entry(i)
+
+    def find(self, uid: str):
+        uid = int(uid)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.entry(middle)
+            if entry[0] == uid:
+                return entry
+            if entry[0] < uid:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def record(self, uid: str):
+        entry = self.find(uid)
+        if entry is None:
+            return None
+        return self.map[entry[1]:entry[1] + entry[2]]
+
+    def get(self, uid: str):
+        record = self.record(uid)
+        return None if record is None else codec.decode(record)
+
+    def uids(self) -> set:
+        if self.uid_set is None:
+            self.uid_set = {str(entry[0]) for entry in self.entries()}
+        return self.uid_set
+
+    # (uid, due) of every player with something pending, straight from the index
+    def dues(self):
+        for entry in self.entries():
+            if not math.isnan(entry[3]):
+                yield str(entry[0]), number(entry[3])
+
+    # (uid, scores) of every player, only if has_scores
+    def scores(self):
+        for entry in self.entries():
+            yield str(entry[0]), self.entry_scores(entry)
+
+    # (uid, due, scores, record) of every player, as taken by write(); a format 1 snapshot has no scores,
+    #   so its players are decoded for them
+    def records(self):
+        for entry in self.entries():
+            uid, offset, length, due = entry[:4]
+            record = self.map[offset:offset + length]
+            scores = self.entry_scores(entry) if self.has_scores else codec.decode(record).rank_scores()
+            yield str(uid), None if math.isnan(due) else number(due), scores, record
+
+    def entry_scores(self, entry: tuple) -> tuple:
+        return entry[4], entry[5], number(entry[6]), entry[7]
+
+    def close(self):
+        self.map.close()
+
+
+def number(value: float):
+    return int(value) if value.is_integer() else value
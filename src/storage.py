@@ -0,0 +1,269 @@
+import sqlite3
+import threading
+import contextlib
+from collections import OrderedDict
+import codec
+from journal import Journal
+
+
+def player_row(uid: str, player):
+    return (uid, codec.encode(player), player.next_wakeup()) + player.rank_scores()
+
+
+# Player storage backends. Both keep players keyed by str(uid) and remember which of them are dirty,
+#   flush() writes only the dirty ones and returns (records, bytes) written.
+# Players are serialized under <lock_player>(uid) so a handler can't change them halfway through
+class MemoryStorage:
+    def __init__(self, snapshot_file: str, snapshot_mode: str = "fork", freeze=contextlib.nullcontext,
+                 lock_player=lambda uid: contextlib.nullcontext()):
+        self.journal = Journal(snapshot_file, mode=snapshot_mode, freeze=freeze, lock_player=lock_player)
+        self.snapshot, self.players = self.journal.load()
+        self.dirty = set()
+        # Players in the snapshot plus the ones only the journal or put() know about
+        self.count = sum(1 for uid in self.players if not self.in_snapshot(uid))
+        if self.snapshot is not None:
+            self.count += len(self.snapshot)
+        self.count_lock = threading.Lock()
+
+    # Players that haven't changed since the last snapshot are decoded from it the first time they're needed
+    def get(self, uid: str):
+        player = self.players.get(uid)
+        if player is None and self.snapshot is not None:
+            player = self.snapshot.get(uid)
+            if player is not None:
+                player = self.players.setdefault(uid, player)
+        return player
+
+    def put(self, uid: str, player):
+        if uid not in self.players and not self.in_snapshot(uid):
+            with self.count_lock:
+                if uid not in self.players:
+                    self.count += 1
+                self.players[uid] = player
+        else:
+            self.players[uid] = player
+
+    def in_snapshot(self, uid: str) -> bool:
+        return self.snapshot is not None and self.snapshot.find(uid) is not None
+
+    def mark_dirty(self, uid: str):
+        self.dirty.add(uid)
+
+    # Read without the player's lock, a player's name never changes
+    def name(self, uid: str):
+        player = self.players.get(uid)
+        if player is None and self.snapshot is not None:
+            player = self.snapshot.get(uid)
+        return player.name if player is not None else None
+
+    def uids(self):
+        if self.snapshot is None:
+            return list(self.players.keys())
+        return list(self.snapshot.uids().union(self.players.keys()))
+
+    def pending_dues(self):
+        players = dict(self.players)
+        for uid, player in players.items():
+            due = player.next_wakeup()
+            if due is not None:
+                yield uid, due
+        if self.snapshot is not None:
+            for uid, due in self.snapshot.dues():
+                if uid not in players:
+                    yield uid, due
+
+    # Player.rank_scores() of every player, those only in the snapshot straight from its index
+    def ranks(self):
+        players = dict(self.players)
+        for uid, player in players.items():
+            yield uid, player.rank_scores()
+        if self.snapshot is not None:
+            snapshot_scores = self.snapshot.scores() if self.snapshot.has_scores else \
+                ((uid, self.get(uid).rank_scores()) for uid in self.snapshot.uids())
+            for uid, scores in snapshot_scores:
+                if uid not in players:
+                    yield uid, scores
+
+    def __len__(self):
+        return self.count
+
+    # <before_write>() runs after the dirty players are encoded and before they are written
+    def flush(self, before_write=lambda: None):
+        records = []
+        while self.dirty:
+            uid = self.dirty.pop()
+            records.append((uid, self.players[uid]))
+
+        if not records:
+            before_write()
+            return 0, 0
+
+        written = self.journal.append(records, before_write)
+        if self.journal.needs_compaction():
+            self.journal.compact_async(self.players, self.snapshot)
+        return len(records), written
+
+    def close(self):
+        self.journal.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+
+# Players are loaded on demand and kept in a bounded LRU cache,
+#   dirty players stay cached until they are flushed
+class SQLiteStorage:
+    # Added to the table after the fact, NULL in rows written before they existed. A NULL due would
+    #   leave the player's pending actions unscheduled, so it's filled in when the column is added
+    columns = [("due", "INTEGER"), ("lvl", "INTEGER"), ("exp", "INTEGER"), ("money", "REAL"), ("planets", "INTEGER")]
+
+    def __init__(self, db_file: str, cache_size: int = 10000, lock_player=lambda uid: contextlib.nullcontext()):
+        self.cache_size = cache_size
+        self.lock_player = lock_player
+        self.cache = OrderedDict()
+        self.dirty = set()
+        self.flushing = set()
+        # Players put that have no row yet, counted along with the table
+        self.added = set()
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS players (uid TEXT PRIMARY KEY, data BLOB NOT NULL, due INTEGER)")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(players)")]
+        missing = [(column, kind) for column, kind in self.columns if column not in columns]
+        if missing:
+            self.db.execute("BEGIN")
+            for column, kind in missing:
+                self.db.execute("ALTER TABLE players ADD COLUMN " + column + " " + kind)
+            if "due" not in columns:
+                self.fill_dues()
+            self.db.commit()
+        self.db.execute("CREATE INDEX IF NOT EXISTS players_due ON players (due) WHERE due IS NOT NULL")
+        self.db.commit()
+        self.count = self.db.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+    def fill_dues(self):
+        dues = []
+        for uid, data in self.db.execute("SELECT uid, data FROM players"):
+            due = codec.decode(data).next_wakeup()
+            if due is not None:
+                dues.append((due, uid))
+        self.db.executemany("UPDATE players SET due = ? WHERE uid = ?", dues)
+
+    def get(self, uid: str):
+        with self.lock:
+            player = self.cache.get(uid)
+            if player is not None:
+                self.cache.move_to_end(uid)
+                return player
+
+            row = self.db.execute("SELECT data FROM players WHERE uid = ?", (uid,)).fetchone()
+            if row is None:
+                return None
+
+            player = codec.decode(row[0])
+            self.cache[uid] = player
+            self.evict()
+            return player
+
+    # Read without the player's lock and without caching the player, a player's name never changes
+    def name(self, uid: str):
+        with self.lock:
+            player = self.cache.get(uid)
+            row = None if player is not None else \
+                self.db.execute("SELECT data FROM players WHERE uid = ?", (uid,)).fetchone()
+        if row is not None:
+            player = codec.decode(row[0])
+        return player.name if player is not None else None
+
+    def put(self, uid: str, player):
+        with self.lock:
+            if uid not in self.cache and uid not in self.added and not self.exists(uid):
+                self.added.add(uid)
+            self.cache[uid] = player
+            self.cache.move_to_end(uid)
+            self.evict()
+
+    def mark_dirty(self, uid: str):
+        with self.lock:
+            self.dirty.add(uid)
+
+    # If the least recently used player is still dirty, the cache is allowed to overgrow until the next flush
+    def evict(self):
+        while len(self.cache) > self.cache_size:
+            uid = next(iter(self.cache))
+            if uid in self.dirty or uid in self.flushing:
+                return
+            del self.cache[uid]
+
+    def uids(self):
+        with self.lock:
+            uids = set(self.cache.keys())
+            uids.update(row[0] for row in self.db.execute("SELECT uid FROM players"))
+            return list(uids)
+
+    def exists(self, uid: str) -> bool:
+        return self.db.execute("SELECT 1 FROM players WHERE uid = ?", (uid,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.count + len(self.added)
+
+    # Next wakeup of every player (Player.next_wakeup()) is stored in its own column, so the scheduler
+    #   can be rebuilt without loading players that have nothing pending
+    def pending_dues(self):
+        with self.lock:
+            rows = self.db.execute("SELECT uid, due FROM players WHERE due IS NOT NULL").fetchall()
+        return rows
+
+    # Leaderboard scores (Player.rank_scores()) have their own columns as well, rows written before
+    #   they existed are decoded for them
+    def ranks(self):
+        with self.lock:
+            rows = self.db.execute("SELECT uid, lvl, exp, money, planets FROM players WHERE lvl IS NOT NULL").fetchall()
+            old = [row[0] for row in self.db.execute("SELECT uid FROM players WHERE lvl IS NULL")]
+            cached = dict(self.cache)
+        for uid, lvl, exp, money, planets in rows:
+            if uid not in cached:
+                yield uid, (lvl, exp, codec.number(money), planets)
+        for uid in old:
+            if uid not in cached:
+                yield uid, self.get(uid).rank_scores()
+        for uid, player in cached.items():
+            yield uid, player.rank_scores()
+
+    # Handlers call put() while holding their player lock, so players are serialized without holding
+    #   self.lock; until they are written they stay in <flushing> and can't be evicted.
+    # <before_write>() runs after the dirty players are encoded and before they are written
+    def flush(self, before_write=lambda: None):
+        with self.lock:
+            self.flushing, self.dirty = self.dirty, set()
+            players = [(uid, self.cache[uid]) for uid in self.flushing]
+
+        rows = []
+        for uid, player in players:
+            with self.lock_player(uid):
+                rows.append(player_row(uid, player))
+        before_write()
+
+        with self.lock:
+            if rows:
+                self.write_rows(rows)
+            self.flushing = set()
+            self.evict()
+
+        return len(rows), sum(len(row[1]) for row in rows)
+
+    def write_rows(self, rows):
+        for row in rows:
+            if row[0] in self.added:
+                self.added.discard(row[0])
+                self.count += 1
+        self.db.executemany("INSERT OR REPLACE INTO players (uid, data, due, lvl, exp, money, planets) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,63 +1,260 @@
+import time
 import threading
-import pickle
+import traceback
+import itertools
+import contextlib
 import globals
 import utils
+import metrics
+import combat
+from storage import MemoryStorage, SQLiteStorage
+from scheduler import Scheduler
+from leaderboard import Leaderboards
+from market import Market
+from outbox import Outbox
+from delivery import PRIORITY_BACKGROUND
 
-print("* Loading player data...")
 player_file = 'players.dat'
+player_db = 'players.db'
+market_file = 'market.dat'
 
-if utils.file_size(player_file) > 10:
-    globals.player_storage = pickle.load(open(player_file, "rb"))
+backup_interval = 60  # seconds
 
 
 def load_player(uid):
-    if str(uid) in globals.player_storage:
-        return globals.player_storage[str(uid)]
-    else:
-        return None
+    return globals.player_storage.get(str(uid))
 
 
+# Only players that actually changed since the last save are marked dirty,
+#   and only their next wakeup and leaderboard scores have to be looked at again
 def save_player(player):
-    globals.storage_changed = True
-    globals.player_storage[str(player.id)] = player
+    uid = str(player.id)
+    globals.player_storage.put(uid, player)
+    if player.pop_changes():
+        globals.player_storage.mark_dirty(uid)
+        schedule_wakeup(uid, player.next_wakeup())
+        globals.leaderboards.update(uid, player.rank_scores(), player.name)
+        if player.on_patrol():
+            patrolling.add(uid)
+        else:
+            patrolling.discard(uid)
+
+
+# Handlers and timed tasks of the same player never run at the same time
+player_locks = [threading.RLock() for i in range(1024)]
+
+
+def player_lock(uid) -> threading.RLock:
+    return player_locks[int(uid) % len(player_locks)]
+
 
+# Keeps every player from being modified, always taken in the same order so two freezes can't deadlock.
+# Must not be entered while already holding a single player lock
+@contextlib.contextmanager
+def freeze_players():
+    for lock in player_locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(player_locks):
+            lock.release()
 
+
+# Records and bytes written by the last backup cycle
+last_write_records = 0
+last_write_bytes = 0
+
+backup_duration = metrics.histogram("backup_duration_seconds", "Time to write dirty players to disk")
+backup_records = metrics.counter("backup_records_total", "Player records written by backups")
+backup_bytes = metrics.counter("backup_bytes_total", "Bytes written by backups")
+metrics.gauge("player_storage_size", "Players in storage", lambda: len(globals.player_storage))
+metrics.gauge("scheduled_actions", "Entries in the timed task queue", lambda: len(globals.scheduler))
+metrics.gauge("scheduled_players", "Players with a wakeup in the timed task queue", lambda: len(wakeups))
+
+
+# Write dirty players through the storage backend, and the market if it changed: encoded after the players
+#   and written before them, see Market
 def write_all():
-    if not globals.storage_changed:
+    global last_write_records, last_write_bytes
+    start = time.perf_counter()
+    seqs = globals.market.ledger_seqs(player_lock, load_player)
+    records, written = globals.player_storage.flush(globals.market.save)
+    globals.market.confirm(seqs)
+    if records == 0:
         return
 
-    utils.out("Writing memory storage to disk...")
-    pickle.dump(globals.player_storage, open(player_file, 'wb'))
-    globals.storage_changed = False
+    backup_duration.observe(time.perf_counter() - start)
+    backup_records.inc(records)
+    backup_bytes.inc(written)
+    last_write_records = records
+    last_write_bytes = written
+    utils.out("Saved " + str(last_write_records) + " changed players (" + str(last_write_bytes) + " bytes)")
 
 
 # Recurring tasks
 
 # Save everything to disk
-backup_daemon: threading.Timer
-timed_task_daemon: threading.Timer
+backup_daemon: threading.Thread = None
+backup_stop = threading.Event()
 
 
 def perform_backup():
-    global backup_daemon
     write_all()
-    backup_daemon = threading.Timer(60, perform_backup)
-    backup_daemon.start()
+    if globals.metrics_file is not None:
+        metrics.dump(globals.metrics_file)
+
+
+# A failed backup is retried at the next interval instead of ending the loop
+def backup_loop():
+    while not backup_stop.wait(backup_interval):
+        try:
+            perform_backup()
+        except Exception:
+            traceback.print_exc()
 
 
 # Timed tasks (for players)
-def perform_timed_tasks():
+
+# Each player has at most one live entry in the timed task queue, uid -> (due, version).
+# Queue entries carry the version they were scheduled with, older ones were replaced
+#   by a later prediction and are dropped without loading the player
+wakeups = {}
+wakeup_lock = threading.Lock()
+wakeup_versions = itertools.count()
+
+# Players with a patrol out, as of their last save. Patrols started before a restart aren't in it and are
+#   fought by the player's own timed task instead
+patrolling = set()
+
+
+def schedule_wakeup(uid: str, due):
+    with wakeup_lock:
+        current = wakeups.get(uid)
+        if current is not None and current[0] == due:
+            return
+        if due is None:
+            wakeups.pop(uid, None)
+            return
+        version = next(wakeup_versions)
+        wakeups[uid] = (due, version)
+    timed_task_daemon.schedule(due, (uid, version))
+
+
+def is_current(task) -> bool:
+    uid, version = task
+    with wakeup_lock:
+        return wakeups.get(uid, (None, None))[1] == version
+
+
+# Patrols of all the players due in one tick are fought at once, see combat.resolve().
+# Returns uid -> {start time: battle}, completed by each player's own timed task
+def resolve_battles(tasks) -> dict:
+    battles = {}
+    for uid, version in filter(is_current, tasks):
+        if uid not in patrolling:
+            continue
+        with player_lock(uid):
+            player = load_player(uid)
+            due = player.due_battles() if player is not None else None
+        if due:
+            battles[uid] = due
+    combat.resolve([battle for due in battles.values() for battle in due.values()])
+    return battles
+
+
+def perform_timed_tasks(task, battles: dict = None):
+    uid, version = task
+    with wakeup_lock:
+        if wakeups.get(uid, (None, None))[1] != version:
+            return
+        del wakeups[uid]
+
+    with Outbox(PRIORITY_BACKGROUND), player_lock(uid):
+        player = load_player(uid)
+        if player is None:
+            return
+
+        globals.market.settle(player)
+        player.check_pending_actions((battles or {}).get(uid))
+        player.check_extraction_events()
+        save_player(player)
+        schedule_wakeup(uid, player.next_wakeup())
+
+
+timed_task_daemon: Scheduler = None
+
+
+# Lifecycle: the player store and the timed task queue outlive stop()/start(),
+#   so a soft restart doesn't have to load them again; unload() drops both
+def load_storage():
     global timed_task_daemon
+    print("* Loading player data...")
+    if globals.storage_backend == "sqlite":
+        globals.player_storage = SQLiteStorage(player_db, globals.player_cache_size, player_lock)
+    else:
+        globals.player_storage = MemoryStorage(player_file, globals.snapshot_mode, freeze_players, player_lock)
+
+    timed_task_daemon = Scheduler(perform_timed_tasks, resolve_battles)
+    globals.scheduler = timed_task_daemon
+    for uid, due in globals.player_storage.pending_dues():
+        schedule_wakeup(uid, due)
+
+    globals.leaderboards = Leaderboards(name_of=globals.player_storage.name)
+    if utils.clock.background:
+        globals.leaderboards.build_async(globals.player_storage.ranks())
+    else:
+        globals.leaderboards.build_logged(globals.player_storage.ranks())
 
-    for uid in globals.pending_players[:]:
-        player = load_player(int(uid))
-        player.check_pending_actions()
-        if not player.has_more_pending_actions():
-            globals.pending_players.remove(uid)
+    # What the market owes players is handed over by their next timed task
+    globals.market = Market(market_file, lambda uid: schedule_wakeup(uid, utils.now()))
+    reconcile_market()
+    for uid in globals.market.pending_settlements():
+        schedule_wakeup(uid, utils.now())
+
+
+# Players whose last market operations didn't make it to disk before a crash get them from the market
+def reconcile_market():
+    reconciled = 0
+    for uid in globals.market.ledger_seqs(player_lock, load_player):
+        with player_lock(uid):
+            player = load_player(uid)
+            if globals.market.reconcile(player):
+                save_player(player)
+                reconciled += 1
+    if reconciled:
+        utils.out("Applied missed market operations to " + str(reconciled) + " players")
+
+
+def start():
+    global backup_daemon
+    if globals.player_storage is None:
+        load_storage()
 
-    timed_task_daemon = threading.Timer(1, perform_timed_tasks)
     timed_task_daemon.start()
+    backup_stop.clear()
+    backup_daemon = threading.Thread(target=backup_loop, daemon=True)
+    backup_daemon.start()
 
 
-perform_backup()
-perform_timed_tasks()
+# Joins both daemons and saves whatever is left
+def stop():
+    backup_stop.set()
+    if backup_daemon is not None:
+        backup_daemon.join()
+    if globals.player_storage is None:
+        return
+    timed_task_daemon.stop()
+    write_all()
+
+
+def unload():
+    if globals.player_storage is None:
+        return
+    globals.player_storage.close()
+    globals.player_storage = None
+    globals.scheduler = None
+    globals.leaderboards = None
+    globals.market = None
+    wakeups.clear()
+    patrolling.clear()
@@ -1,9 +1,25 @@
+import os
 import random
 import string
-import calendar
 import time
 import datetime
 from pathlib import Path
+from clock import Clock
+
+
+# Base for game objects with __slots__. Their pickles hold (None, {slot: value}), objects saved
+#   before they had slots pickled a plain dict; attributes that no longer exist are dropped
+class Slotted:
+    __slots__ = ()
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            try:
+                setattr(self, name, value)
+            except AttributeError:
+                pass
 
 
 def rand_str(length=4) -> str:
@@ -15,8 +31,21 @@ def file_size(file) -> int:
     return Path(file).stat().st_size
 
 
+# Write to a temporary file first so a crash can never leave <file> half-written
+def write_atomic(file, write):
+    tmp_file = str(file) + ".tmp"
+    with open(tmp_file, "wb") as tmp:
+        write(tmp)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp_file, file)
+
+
+clock = Clock()
+
+
 def now() -> int:
-    return calendar.timegm(time.gmtime())
+    return clock.now()
 
 
 def out(msg):
@@ -1,6 +1,8 @@
 import sys
 import traceback
 import utils
+import main
+import storage_utils
 
 error_interval = 5  # seconds
 errors_max = 4
@@ -8,24 +10,32 @@ errors_max = 4
 last_error = 0  # timestamp of last error
 errors = 0  # error count in the last <error_interval> seconds
 
+# "restart" keeps the loaded player store, "hard_restart" and crashes drop it and load everything from disk again
 while True:
     try:
         utils.out("Starting the bot...")
-        exec(open('main.py').read())
+        main.run()
         utils.out("Stopped.")
     except Exception as e:
-        if (utils.now() - last_error) > error_interval:
-            errors = 0
-
-        last_error = utils.now()
-        errors += 1
-
         if str(e) == "stop":
             sys.exit()
 
-        if errors > errors_max:
-            utils.out("Too many errors!")
-            sys.exit()
+        if str(e) == "restart":
+            utils.out("Restarting...")
+            continue
+
+        if str(e) != "hard_restart":
+            if (utils.now() - last_error) > error_interval:
+                errors = 0
+
+            last_error = utils.now()
+            errors += 1
+
+            if errors > errors_max:
+                utils.out("Too many errors!")
+                sys.exit()
+
+            traceback.print_exc()
 
-        traceback.print_exc()
-        utils.out("Restarting...")
+        utils.out("Restarting from disk...")
+        storage_utils.unload()
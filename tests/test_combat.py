@@ -0,0 +1,44 @@
+import copy
+import random
+import pytest
+import combat
+from entity import Entity
+
+pytest.importorskip("numpy")
+
+
+def random_battles(rng, count):
+    battles = []
+    for i in range(count):
+        fleet = []
+        for j in range(rng.randint(1, 3)):
+            ship = Entity("ship")
+            ship.hp = ship.max_hp = rng.randint(1, 100)
+            ship.shield_max = rng.randint(1, 10)
+            ship.shield = rng.randint(0, ship.shield_max)
+            ship.atk = rng.choice([rng.randint(0, 6), round(rng.uniform(0, 6), 2)])
+            ship.dead = rng.random() < 0.05
+            fleet.append(ship)
+        battles.append(combat.Battle(fleet, combat.spawn_mobs(rng.randint(1, 30), str(rng.random()))))
+    return battles
+
+
+def outcome(battle):
+    return battle.rounds, battle.winner, [(entity.hp, entity.shield, entity.dead)
+                                          for entity in battle.fleet + battle.mobs]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_resolve_matches_fight(seed):
+    battles = random_battles(random.Random(seed), 3000)
+    expected = [combat.fight(battle) for battle in copy.deepcopy(battles)]
+    assert len(battles) >= combat.batch_min
+    combat.resolve(battles)
+    assert [outcome(battle) for battle in battles] == [outcome(battle) for battle in expected]
+
+
+def test_resolve_stops_after_max_rounds():
+    battles = random_battles(random.Random(1), 200)
+    expected = [combat.fight(battle, 3) for battle in copy.deepcopy(battles)]
+    combat.resolve(battles, 3)
+    assert [outcome(battle) for battle in battles] == [outcome(battle) for battle in expected]
@@ -0,0 +1,36 @@
+import os
+import delivery
+from delivery import Broadcast, resume_broadcast, join_broadcast
+
+
+# Sends until <limit> messages went out, then reports every other one as not sent like a stopped Delivery
+class FakeDelivery:
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self.sent = []
+
+    def send(self, chat_id: int, text: str, priority: int, on_done=None):
+        sent = self.limit is None or len(self.sent) < self.limit
+        if sent:
+            self.sent.append(chat_id)
+        on_done(sent)
+
+
+def test_interrupted_broadcast_resumes_from_its_position(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(delivery, "broadcast_batch", 2)
+    uids = list(range(7))
+
+    first = FakeDelivery(limit=5)
+    assert Broadcast(first, "hello", uids).start()
+    join_broadcast()
+    assert first.sent == [0, 1, 2, 3, 4]
+    with open(delivery.broadcast_position_file, "rb") as file:
+        assert int(file.read()) == 4
+
+    second = FakeDelivery()
+    assert resume_broadcast(second) is not None
+    join_broadcast()
+    assert second.sent == [4, 5, 6]
+    assert not os.path.exists(delivery.broadcast_file)
+    assert not os.path.exists(delivery.broadcast_position_file)
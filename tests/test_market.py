@@ -0,0 +1,76 @@
+import pytest
+
+pytest.importorskip("telebot")
+
+import codec
+import globals
+from fakebot import FakeBot
+from market import Market, Side
+from player import Player
+from resource import Resource
+
+
+@pytest.fixture
+def market(tmp_path):
+    globals.bot = FakeBot()
+    return Market(str(tmp_path / "market.dat"))
+
+
+def make_player(uid: int, money: float = 0, iron: int = 0) -> Player:
+    player = Player(uid, "player" + str(uid))
+    player.money = money
+    player.cargo.max_weight = 1000
+    if iron:
+        player.cargo.put(Resource.Iron, iron)
+    return player
+
+
+def test_trade_moves_credits_and_goods(market):
+    seller, buyer = make_player(1, iron=10), make_player(2, money=100)
+    market.place(seller, Side.SELL, Resource.Iron, 10, 2)
+    market.place(buyer, Side.BUY, Resource.Iron, 10, 3)
+    market.settle(seller)
+
+    assert seller.money == 20 and seller.cargo.get(Resource.Iron) == 0
+    assert buyer.money == 80 and buyer.cargo.get(Resource.Iron) == 10
+
+
+# A backup writes the market and then the players, a crash in between leaves players without their
+#   last market operations; loading the market gives them back
+def test_reconcile_applies_what_players_missed(market):
+    seller, buyer = make_player(1, iron=10), make_player(2, money=100)
+    seller_on_disk, buyer_on_disk = codec.encode(seller), codec.encode(buyer)
+    market.place(seller, Side.SELL, Resource.Iron, 10, 2)
+    market.place(buyer, Side.BUY, Resource.Iron, 10, 3)
+    market.settle(seller)
+    market.save()
+
+    loaded = Market(market.file)
+    for live, record in ((seller, seller_on_disk), (buyer, buyer_on_disk)):
+        player = codec.decode(record)
+        assert loaded.reconcile(player)
+        assert (player.money, player.cargo.get(Resource.Iron), player.market_seq) == \
+               (live.money, live.cargo.get(Resource.Iron), live.market_seq)
+        assert not loaded.reconcile(player)
+
+
+def test_confirm_drops_what_players_have(market):
+    buyer = make_player(2, money=100)
+    market.place(buyer, Side.BUY, Resource.Iron, 10, 3)
+    market.place(buyer, Side.BUY, Resource.Iron, 5, 3)
+    market.confirm({"2": 1})
+    assert [entry[0] for entry in market.ledger["2"]] == [2]
+    market.confirm({"2": buyer.market_seq})
+    assert "2" not in market.ledger
+
+
+def test_cancelled_orders_are_swept_from_the_heap(market):
+    buyer = make_player(2, money=10 ** 6)
+    for i in range(100):
+        market.place(buyer, Side.BUY, Resource.Iron, 1, 1 + i / 100)
+    for id in range(1, 100):
+        market.cancel(buyer, id)
+
+    heap = market.books[Resource.Iron].heaps[Side.BUY]
+    assert len(heap) <= 2 * sum(1 for priority, order in heap if order.quantity > 0)
+    assert market.books[Resource.Iron].best(Side.BUY).id == 100
@@ -0,0 +1,105 @@
+import copy
+import random
+import pytest
+import progress
+from entity import Cargo
+from planet import Planet
+from planet_array import PlanetArray
+from resource import Resource
+
+rate = 0.085
+now = 1767225600
+
+
+# The per-planet loop progress.extract() replaced, minute by minute rates and all
+def reference_extract(planets, cargo):
+    for planet in planets:
+        if cargo.is_full():
+            break
+        amount = rate * (planet.time_passed(now) / 60)
+        if planet.resource_amount - amount <= 0:
+            amount = planet.resource_amount
+            planet.resource_amount = 0
+        else:
+            planet.resource_amount -= amount
+
+        overflow = cargo.put(planet.resource, amount)
+        planet.resource_amount += overflow
+
+
+def random_planets(rng, count, max_absence):
+    planets = []
+    for i in range(count):
+        planet = Planet(rng.choice(list(Resource)))
+        planet.set_resource_amount(rng.uniform(1, 500))
+        planet.last_check = now - rng.randint(0, max_absence)
+        planets.append(planet)
+    return planets
+
+
+def cargo_of(max_weight):
+    cargo = Cargo()
+    cargo.max_weight = max_weight
+    return cargo
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference_loop_when_cargo_has_room(seed):
+    rng = random.Random(seed)
+    for i in range(50):
+        planets = random_planets(rng, rng.randint(0, 30), rng.choice([60, 3600, 7 * 24 * 3600]))
+        expected = copy.deepcopy(planets)
+        cargo = cargo_of(10 ** 9)
+        reference_extract(expected, cargo)
+
+        extraction = progress.extract(planets, now, rate, cargo.max_weight)
+        extracted = {}
+        for planet, after, amount, depleted in zip(planets, expected, extraction.amounts, extraction.depleted):
+            assert amount == pytest.approx(planet.resource_amount - after.resource_amount, abs=1e-6)
+            assert depleted == (after.resource_amount == 0)
+            extracted[planet.resource] = extracted.get(planet.resource, 0) + amount
+        assert extracted == pytest.approx(cargo.contents, abs=1e-6)
+        assert extraction.stop_time is None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_fills_the_same_cargo_space_as_reference_loop(seed):
+    rng = random.Random(seed)
+    for i in range(50):
+        planets = random_planets(rng, rng.randint(1, 30), 7 * 24 * 3600)
+        expected = copy.deepcopy(planets)
+        cargo = cargo_of(rng.uniform(1, 2000))
+        reference_extract(expected, cargo)
+
+        extraction = progress.extract(planets, now, rate, cargo.max_weight)
+        assert sum(extraction.amounts) == pytest.approx(cargo.cur_weight, abs=1e-6)
+        if cargo.is_full():
+            # The loop gives the space to whichever planets come first, extract() stops all of them at once,
+            #   so only the total and each planet's own limits have to hold
+            assert extraction.stop_time is not None
+            for planet, amount, depleted in zip(planets, extraction.amounts, extraction.depleted):
+                assert 0 <= amount <= planet.resource_amount + 1e-9
+                assert not depleted or amount == planet.resource_amount
+        else:
+            for planet, after, amount, depleted in zip(planets, expected, extraction.amounts, extraction.depleted):
+                assert amount == pytest.approx(planet.resource_amount - after.resource_amount, abs=1e-6)
+                assert depleted == (after.resource_amount == 0)
+
+
+# Removed slots are skipped, the rest is drilled in slot order like the planets given to progress.extract()
+@pytest.mark.parametrize("seed", range(20))
+def test_planet_array_matches_extract(seed):
+    rng = random.Random(seed)
+    for i in range(50):
+        planets = random_planets(rng, rng.randint(0, 30), rng.choice([60, 3600, 7 * 24 * 3600]))
+        store = PlanetArray.from_planets(planets)
+        for index in sorted(rng.sample(range(len(planets)), len(planets) // 4), reverse=True):
+            store.remove(index)
+            del planets[index]
+        free_space = rng.choice([0, rng.uniform(1, 2000), 10 ** 9])
+
+        expected = progress.extract(planets, now, rate, free_space)
+        extraction = store.extract(now, rate, free_space)
+        assert list(extraction.amounts) == pytest.approx(expected.amounts, abs=1e-6)
+        assert list(extraction.depleted) == expected.depleted
+        assert extraction.stop_time == pytest.approx(expected.stop_time)
@@ -0,0 +1,57 @@
+import pytest
+from resource import Resource, ResourceSampler
+
+rolls = 200000
+weights = {resource: resource.value.probability for resource in Resource}
+# Critical value of the chi-square distribution with len(Resource) - 1 = 14 degrees of freedom at p = 0.001
+critical = 36.12
+
+
+def chi_square(counts: dict) -> float:
+    total_weight = sum(weights.values())
+    draws = sum(counts.values())
+    total = 0
+    for resource, weight in weights.items():
+        expected = draws * weight / total_weight
+        total += (counts.get(resource, 0) - expected) ** 2 / expected
+    return total
+
+
+def count(resources) -> dict:
+    counts = {}
+    for resource in resources:
+        counts[resource] = counts.get(resource, 0) + 1
+    return counts
+
+
+@pytest.fixture
+def sampler():
+    return ResourceSampler(weights, seed=1)
+
+
+def test_roll(sampler):
+    assert chi_square(count(sampler.roll() for i in range(rolls))) < critical
+
+
+def test_roll_ids(sampler):
+    pytest.importorskip("numpy")
+    ids = sampler.roll_ids(rolls).tolist()
+    assert chi_square(count(sampler.resources[id] for id in ids)) < critical
+
+
+def test_roll_ids_without_numpy(sampler):
+    sampler.generator = None
+    assert chi_square(count(sampler.resources[id] for id in sampler.roll_ids(rolls))) < critical
+
+
+def test_pick(sampler):
+    # Evenly spread (u, v) pairs, as the galaxy's hashed coordinates give
+    side = 450
+    picks = (sampler.pick((i + 0.5) / side, (j + 0.5) / side) for i in range(side) for j in range(side))
+    assert chi_square(count(picks)) < critical
+
+
+def test_same_seed_same_rolls():
+    first, second = ResourceSampler(weights, seed=7), ResourceSampler(weights, seed=7)
+    assert [first.roll() for i in range(100)] == [second.roll() for i in range(100)]
+    assert list(first.roll_ids(100)) == list(second.roll_ids(100))
@@ -0,0 +1,25 @@
+import time
+import pytest
+from fakebot import FakeBot
+from runtime import Runtime
+
+
+def stop_on_message(message):
+    raise Exception(message.text[1:])
+
+
+# A long poll in flight doesn't hold up stopping, and the update it gets is served again to the next run
+def test_stop_does_not_wait_for_the_poll():
+    bot = FakeBot()
+    bot.push(1, "/restart")
+    runtime = Runtime(bot, stop_on_message, poll_timeout=20)
+
+    start = time.perf_counter()
+    with pytest.raises(Exception, match="restart"):
+        runtime.run()
+    assert time.perf_counter() - start < 5
+
+    bot.push(1, "/stop")
+    with pytest.raises(Exception, match="stop"):
+        runtime.run()
+    assert time.perf_counter() - start < 5
@@ -0,0 +1,37 @@
+import os
+import threading
+import pytest
+
+pytest.importorskip("telebot")
+
+import shards
+
+
+def exit_at_once(index, count, inbox, replies):
+    os._exit(1)
+
+
+def test_dead_worker_ends_the_run_as_a_crash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(shards, "worker", exit_at_once)
+    monkeypatch.setattr(shards, "supervise_interval", 0.05)
+    reasons = []
+    stopped = threading.Event()
+
+    def on_stop(reason):
+        reasons.append(reason)
+        stopped.set()
+
+    dispatcher = shards.Dispatcher(2, on_stop)
+    dispatcher.start()
+    try:
+        assert stopped.wait(10)
+        answers = []
+        dispatcher.gather(("uids",), answers.extend)
+        assert answers == [None, None]
+    finally:
+        dispatcher.stop()
+
+    assert len(reasons) == 1
+    assert str(reasons[0]) in ("shard 0 died", "shard 1 died")
+    assert str(reasons[0]) not in shards.stop_reasons
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("telebot")
+
+from simulate import Simulation
+
+
+def run(seed: int) -> str:
+    simulation = Simulation(50, seed, sessions_per_day=4)
+    try:
+        simulation.run(3 * 86400, 3600)
+        return simulation.digest()
+    finally:
+        simulation.close()
+
+
+def test_same_seed_same_outcome():
+    assert run(1) == run(1)
+
+
+def test_seed_changes_outcome():
+    assert run(1) != run(2)